@@ -103,13 +103,33 @@ CREATE TABLE active_relay (
 );
 
 
--- No hostname, for now. I don't think this breaks anybody's heart.
--- Later, could do lookup with socket.getfqdn (plpythonu)
--- CREATE TABLE hostname (
---    address INET NOT NULL,
---    hostname CHARACTER VARYING(255),
---    CONSTRAINT hostname_unique PRIMARY KEY (address)
---);
+-- TABLE relay_table_version
+-- Contains a single row, which counts the number of times that the
+-- active_relay table has been updated. TorStatus checks it to find
+-- out whether the relays it has cached are still current.
+CREATE TABLE relay_table_version (
+    version INTEGER NOT NULL,
+    validafter TIMESTAMP WITHOUT TIME ZONE,
+    updated TIMESTAMP WITHOUT TIME ZONE,
+    CONSTRAINT relay_table_version_pkey PRIMARY KEY (version)
+);
+
+INSERT INTO relay_table_version (version, validafter, updated)
+    VALUES (0, NULL, NULL);
+
+
+-- TABLE hostname
+-- The hostnames of the IP addresses of active relays, which are
+-- resolved in bulk after each update of the active_relay table by
+-- TorStatus' resolvehostnames command. Addresses that have no hostname
+-- are kept with a NULL hostname, so that they are not resolved again
+-- until they have expired.
+CREATE TABLE hostname (
+    address INET NOT NULL,
+    hostname CHARACTER VARYING(255),
+    resolved TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    CONSTRAINT hostname_unique PRIMARY KEY (address)
+);
 
 
 -- INDICES ------------------------------------------------------------
@@ -302,6 +322,11 @@ RETURNS INTEGER AS $$
                 cache.active_statusentry AS s
                 LEFT JOIN cache.active_descriptor as d
                 ON s.fingerprint=d.fingerprint;
+        UPDATE cache.relay_table_version
+            SET version = version + 1,
+                validafter = (SELECT MAX(validafter)
+                              FROM cache.active_relay),
+                updated = (SELECT localtimestamp AT TIME ZONE 'UTC');
     RETURN 1;
     END;
 $$ LANGUAGE plpgsql;
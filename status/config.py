@@ -12,7 +12,7 @@ is no reason that a column should not be sortable.
 
 """Columns not shown by default, but showable by selection"""
 AVAILABLE_COLUMNS = ['Fingerprint', 'Last Descriptor Published',
-                     'Contact', 'Bad Directory']
+                     'Contact', 'Bad Directory', 'Hostname']
 
 """Columns shown by default"""
 DEFAULT_COLUMNS = ['Country Code', 'Router Name', 'Bandwidth',
@@ -29,7 +29,7 @@ COLUMN_VALUE_NAME = {'Country Code': 'country',
                      'Bandwidth': 'bandwidthkbps',
                      'Uptime': 'uptime',
                      'IP': 'address',
-                     #'Hostname': 'hostname',
+                     'Hostname': 'hostname',
                      'Icons': 'icons',
                      'ORPort': 'orport',
                      'DirPort': 'dirport',
@@ -66,7 +66,8 @@ DISPLAYABLE_COLUMNS = frozenset(('Country Code', 'Router Name',
                                  'ORPort', 'DirPort', 'Bad Exit',
                                  'Fingerprint',
                                  'Last Descriptor Published',
-                                 'Contact', 'Bad Directory'))
+                                 'Contact', 'Bad Directory',
+                                 'Hostname'))
 
 FILTER_OPTIONS = {'Authority': 'isauthority',
                   'Bad Directory': 'isbaddirectory',
@@ -99,7 +100,7 @@ FILTERED_NAME = {'Longitude': 'longitude',
                  'Bandwidth': 'bandwidthkbps',
                  'Uptime': 'uptime',
                  'IP': 'address',
-                 #'Hostname': 'hostname',
+                 'Hostname': 'hostname',
                  'Hibernating': 'hibernating',
                  'ORPort': 'orport',
                  'DirPort': 'dirport',
@@ -148,7 +149,8 @@ NOT_MOVABLE_COLUMNS = frozenset(("Named", "Exit", "Authority", "Fast",
 
 SEARCHES = frozenset(('fingerprint', 'nickname', 'country',
                       'bandwidthkbps', 'uptimedays', 'published',
-                      'address', 'orport', 'dirport', 'platform'))
+                      'address', 'hostname', 'orport', 'dirport',
+                      'platform'))
 
 """Map the title of a search criteria in the list of values of
 SEARCH_OPTIONS_FIELDS_BOOLEANS to a criteria in CRITERIA"""
@@ -177,7 +179,7 @@ SEARCH_OPTIONS_FIELDS = {'Fingerprint': 'fingerprint',
                          'Uptime (days)': 'uptimedays',
                          'Last Descriptor Published': 'published',
                          'IP Address': 'address',
-                         #'Hostname': 'hostname',
+                         'Hostname': 'hostname',
                          'Onion Router Port': 'orport',
                          'Directory Server Port': 'dirport',
                          'Platform': 'platform',
@@ -205,6 +207,9 @@ SEARCH_OPTIONS_FIELDS_BOOLEANS = {
                                       'Is Greater Than',],
         'IP Address': ['Equals',
                        'Starts With',],
+        'Hostname': ['Equals (case insensitive)',
+                     'Contains (case insensitive)',
+                     'Starts With (case insensitive)',],
         'Onion Router Port': ['Equals',
                               'Is Less Than',
                               'Is Greater Than',],
@@ -217,7 +222,8 @@ SEARCH_OPTIONS_FIELDS_BOOLEANS = {
 SEARCH_OPTIONS_FIELDS_ORDER = ['Fingerprint', 'Router Name',
                             'Country Code', 'Bandwidth (kb/s)',
                             'Uptime (days)', 'Last Descriptor Published',
-                            'IP Address', 'Onion Router Port',
+                            'IP Address', 'Hostname',
+                            'Onion Router Port',
                             'Directory Server Port', 'Platform']
 
 SORT_OPTIONS = {'Router Name': 'nickname',
@@ -226,7 +232,7 @@ SORT_OPTIONS = {'Router Name': 'nickname',
                 'Bandwidth': 'bandwidthkbps',
                 'Uptime': 'uptime',
                 'Last Descriptor Published': 'published',
-                #'Hostname': 'hostname',
+                'Hostname': 'hostname',
                 'IP Address': 'address',
                 'ORPort': 'orport',
                 'DirPort': 'dirport',
@@ -249,7 +255,7 @@ SORT_OPTIONS = {'Router Name': 'nickname',
 
 SORT_OPTIONS_ORDER = ('Router Name', 'Fingerprint', 'Country Code',
                       'Bandwidth', 'Uptime',
-                      'Last Descriptor Published', #'Hostname',
+                      'Last Descriptor Published', 'Hostname',
                       'IP Address', 'ORPort', 'DirPort',
                       'Platform', 'Contact', 'Authority',
                       'Bad Directory', 'Bad Exit', 'Directory',
@@ -83,6 +83,24 @@ SESSION_ENGINE = 'django.contrib.sessions.backends.file'
 
 SESSION_FILE_PATH = os.path.join(os.path.dirname(__file__), 'tmp/')
 
+# The directory in which bandwidth history graphs are cached, which is
+# shared by every process that serves TorStatus, and the largest
+# number of bytes of graphs to keep there. The network statistic graphs
+# are published by 'python manage.py rendergraphs' in its 'network'
+# subdirectory. Leave GRAPH_CACHE_DIR empty to draw every graph anew.
+GRAPH_CACHE_DIR = os.path.join(os.path.dirname(__file__), 'tmp/graphs/')
+GRAPH_CACHE_SIZE = 64 * 1024 * 1024
+
+# The number of worker processes that draw graphs, and the number of
+# seconds that a request waits for a graph to be drawn. Set
+# GRAPH_RENDERERS to 0 to draw graphs in the processes serving requests.
+GRAPH_RENDERERS = 2
+GRAPH_RENDER_TIMEOUT = 30
+
+# The WHOIS server that the WHOIS page first looks addresses up at.
+# The IANA's server refers each address to the server of its registry.
+WHOIS_SERVER = 'whois.iana.org'
+
 ROOT_URLCONF = 'urls'
 
 TEMPLATE_DIRS = (
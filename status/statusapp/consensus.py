@@ -0,0 +1,254 @@
+"""
+The version of the ActiveRelay cache.
+
+Each time that C{cache.update_relay_table()} refreshes the ActiveRelay
+cache, it increments the version in C{cache.relay_table_version} and
+records the valid-after time of the last consensus. Rather than
+finding the last consensus with an aggregate over the ActiveRelay
+cache on every request, views ask this module, which reads the
+version row at most once every L{__CHECK_INTERVAL} seconds per
+process.
+
+The version is also summarized as a token, which is used to key
+anything that is computed from, or cached for, a single consensus, and
+to answer conditional GETs for pages that only change when the
+ActiveRelay cache does.
+"""
+# General python import statements ------------------------------------
+from functools import wraps
+import threading
+import time
+
+# Django-specific import statements -----------------------------------
+from django.views.decorators.cache import cache_page as \
+        django_cache_page
+from django.views.decorators.http import condition
+
+# TorStatus specific import statements --------------------------------
+from statusapp.models import RelayTableVersion
+
+# INIT Variables ------------------------------------------------------
+# The number of seconds for which a version read from the database is
+# trusted before it is read again.
+__CHECK_INTERVAL = 30
+
+# The version last read from the database, and when it was read.
+__VERSION = None
+__CHECKED = 0
+
+# Held while the version is being read from the database.
+__CHECK_LOCK = threading.Lock()
+
+
+def current():
+    """
+    Get the current version of the ActiveRelay cache.
+
+    @rtype: L{RelayTableVersion}
+    @return: The version of the ActiveRelay cache, as of at most
+        L{__CHECK_INTERVAL} seconds ago.
+    """
+    global __VERSION, __CHECKED
+
+    if __VERSION is None or time.time() - __CHECKED >= __CHECK_INTERVAL:
+        __CHECK_LOCK.acquire()
+        try:
+            # Another request may have read the version while we were
+            # waiting for the lock.
+            now = time.time()
+            if __VERSION is None or now - __CHECKED >= __CHECK_INTERVAL:
+                __VERSION = RelayTableVersion.objects.get()
+                __CHECKED = now
+        finally:
+            __CHECK_LOCK.release()
+    return __VERSION
+
+
+def last_validafter():
+    """
+    Get the valid-after time of the last consensus in the ActiveRelay
+    cache.
+
+    @rtype: C{datetime}
+    @return: The valid-after time of the last consensus.
+    """
+    return current().validafter
+
+
+def token():
+    """
+    Get a token that identifies the current version of the ActiveRelay
+    cache.
+
+    @rtype: C{string}
+    @return: The version and the valid-after time of the last
+        consensus, e.g. C{'1234-201110201200'}.
+    """
+    version = current()
+    if version.validafter is None:
+        return '%d-none' % version.version
+    return '%d-%s' % (version.version,
+                      version.validafter.strftime('%Y%m%d%H%M'))
+
+
+def per_consensus(function, max_results=None):
+    """
+    Decorate a function so that it is called at most once per version
+    of the ActiveRelay cache for any given arguments.
+
+    Results are remembered until the ActiveRelay cache is updated, and
+    are then forgotten. While a result is being computed, other threads
+    that call for the same arguments wait for it rather than computing
+    it again, while calls for other arguments go ahead.
+
+    @type function: C{function}
+    @param function: A function of hashable arguments whose result
+        only depends on its arguments and the ActiveRelay cache.
+    @type max_results: C{int}
+    @param max_results: The number of results to remember per version,
+        or C{None} to remember every result. Once this many results
+        are remembered, the oldest is forgotten to make room for each
+        new one.
+    @rtype: C{function}
+    @return: The decorated function.
+    """
+    # The token of the version that results were computed for, the
+    # results, keyed by their arguments, their arguments in the order
+    # they were computed in, and the results being computed, keyed by
+    # their arguments. The tuple is replaced, never changed, when the
+    # version changes.
+    state = [(None, {}, [], {})]
+    # Held only while the state is read or changed, never while a
+    # result is computed.
+    lock = threading.Lock()
+
+    def per_consensus_function(*args):
+        version_token = token()
+        results_token, results, computed, pending = state[0]
+        if results_token == version_token:
+            # The result may be forgotten by another thread while we
+            # look it up.
+            try:
+                return results[args]
+            except KeyError:
+                pass
+
+        while True:
+            lock.acquire()
+            try:
+                if state[0][0] != version_token:
+                    state[0] = (version_token, {}, [], {})
+                results_token, results, computed, pending = state[0]
+                if args in results:
+                    return results[args]
+                # The event that is set once the result is computed,
+                # the result, and whether it was computed.
+                flight = pending.get(args)
+                if flight is None:
+                    flight = pending[args] = [threading.Event(), None,
+                                              False]
+                    break
+            finally:
+                lock.release()
+
+            flight[0].wait()
+            if flight[2]:
+                return flight[1]
+            # The call that was computing the result raised an
+            # exception, so try to compute it again.
+
+        try:
+            result = function(*args)
+        except:
+            lock.acquire()
+            try:
+                del pending[args]
+            finally:
+                lock.release()
+            flight[0].set()
+            raise
+
+        lock.acquire()
+        try:
+            if max_results is not None and \
+                    len(computed) >= max_results:
+                del results[computed.pop(0)]
+            results[args] = result
+            computed.append(args)
+            del pending[args]
+        finally:
+            lock.release()
+        flight[1] = result
+        flight[2] = True
+        flight[0].set()
+        return result
+
+    return wraps(function)(per_consensus_function)
+
+
+def cache_page(timeout):
+    """
+    Cache a view as django's C{cache_page} does, but key the cached
+    pages on the version of the ActiveRelay cache, so that a page is
+    never served from the cache after the ActiveRelay cache has been
+    updated. Conditional GETs are answered as by L{conditional}, for
+    pages taken from the cache as well as for new ones.
+
+    @type timeout: C{int}
+    @param timeout: The number of seconds to cache each page for.
+    @rtype: C{function}
+    @return: A decorator for a view.
+    """
+    def decorator(view):
+        # Validators are set on new pages before django's cache_page
+        # can set its own, so that cached pages carry them too.
+        conditional_view = conditional(view)
+
+        @per_consensus
+        def cached_view(version_token):
+            return django_cache_page(timeout,
+                                     key_prefix=version_token)(
+                                     conditional_view)
+
+        def consensus_cached_view(request, *args, **kwargs):
+            return cached_view(token())(request, *args, **kwargs)
+
+        return conditional(wraps(view)(consensus_cached_view))
+
+    return decorator
+
+
+def conditional(view):
+    """
+    Answer conditional GETs for a view whose response only depends on
+    its URL and the ActiveRelay cache.
+
+    Responses carry the token of the current version as their ETag and
+    the valid-after time of the last consensus as their Last-Modified
+    time, and clients that already have the response for the current
+    version are sent a 304 instead.
+
+    @type view: C{function}
+    @param view: The view.
+    @rtype: C{function}
+    @return: The decorated view.
+    """
+    conditional_view = condition(etag_func=_etag,
+            last_modified_func=_last_modified)(view)
+    return wraps(view)(conditional_view)
+
+
+def _etag(request, *args, **kwargs):
+    """
+    Get the ETag of a response that only depends on its URL and the
+    ActiveRelay cache.
+    """
+    return token()
+
+
+def _last_modified(request, *args, **kwargs):
+    """
+    Get the Last-Modified time of a response that only depends on its
+    URL and the ActiveRelay cache.
+    """
+    return last_validafter()
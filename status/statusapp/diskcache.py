@@ -0,0 +1,160 @@
+"""
+A cache of files on local disk, bounded by their total size and shared
+by every process that uses the same directory.
+
+Each value is kept in a file of its own, named after the SHA-1 hash of
+its key. Files are written under a temporary name and then renamed, so
+that other processes never read a file that is only partly written.
+A file is touched whenever it is read, and once the files add up to
+more than the size of the cache, the files that were least recently
+touched are removed.
+"""
+# General python import statements ------------------------------------
+import errno
+import hashlib
+import os
+import tempfile
+import threading
+
+
+class DiskCache(object):
+    """
+    A cache of byte strings in files in a directory.
+
+    @type path: C{string}
+    @ivar path: The directory that the files are kept in.
+    @type max_size: C{int}
+    @ivar max_size: The largest total size, in bytes, of the files that
+        are kept.
+    @type suffix: C{string}
+    @ivar suffix: The suffix of the names of the files.
+    """
+
+    def __init__(self, path, max_size, suffix=''):
+        """
+        @type path: C{string}
+        @param path: The directory to keep the files in, which is
+            created if it does not exist.
+        @type max_size: C{int}
+        @param max_size: The largest total size of the files to keep.
+        @type suffix: C{string}
+        @param suffix: The suffix of the names of the files, e.g.
+            C{'.png'}.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.suffix = suffix
+
+        # The number of bytes this process has written since it last
+        # removed files. Other processes write to the directory too,
+        # so the total size of the files is only found, by listing
+        # them, after a fraction of the cache has been written.
+        self.written = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get the value of a key.
+
+        @type key: C{string}
+        @param key: The key.
+        @rtype: C{string}
+        @return: The value of the key, or C{None} if it is not kept.
+        """
+        filename = self._filename(key)
+        try:
+            cached = open(filename, 'rb')
+        except IOError:
+            return None
+        try:
+            value = cached.read()
+        finally:
+            cached.close()
+        try:
+            os.utime(filename, None)
+        except OSError:
+            # The file has just been removed by another process.
+            pass
+        return value
+
+    def set(self, key, value):
+        """
+        Set the value of a key, removing the least recently used files
+        if the cache has grown too large.
+
+        Errors in writing the file are ignored, since the value can
+        always be computed again.
+
+        @type key: C{string}
+        @param key: The key.
+        @type value: C{string}
+        @param value: The value.
+        """
+        try:
+            os.makedirs(self.path)
+        except OSError, error:
+            if error.errno != errno.EEXIST:
+                return
+
+        try:
+            descriptor, temporary = tempfile.mkstemp(dir=self.path,
+                                                     prefix='.')
+        except OSError:
+            return
+        try:
+            try:
+                os.write(descriptor, value)
+            finally:
+                os.close(descriptor)
+            os.rename(temporary, self._filename(key))
+        except OSError:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            return
+
+        self.lock.acquire()
+        try:
+            self.written += len(value)
+            if self.written < self.max_size // 8:
+                return
+            self.written = 0
+        finally:
+            self.lock.release()
+        self._evict()
+
+    def _filename(self, key):
+        """
+        Get the name of the file that holds the value of a key.
+        """
+        return os.path.join(self.path,
+                            hashlib.sha1(key).hexdigest() + self.suffix)
+
+    def _evict(self):
+        """
+        Remove the least recently used files until the files add up to
+        no more than the size of the cache.
+        """
+        files = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith(self.suffix) or name.startswith('.'):
+                continue
+            filename = os.path.join(self.path, name)
+            try:
+                status = os.stat(filename)
+            except OSError:
+                continue
+            files.append((status.st_mtime, status.st_size, filename))
+            total += status.st_size
+
+        files.sort()
+        for modified, size, filename in files:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
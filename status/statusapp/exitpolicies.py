@@ -0,0 +1,256 @@
+"""
+The exit policies of the relays in the last consensus, compiled for
+fast evaluation.
+
+The exit node query used to split every line of the exit policy of a
+relay, and every dotted quad and port range in it, each time it
+checked the relay against a destination. Instead, the exit policies of
+the relays in the last consensus are now compiled once per process and
+consensus into L{ExitPolicy}s, which hold each line as integer bounds
+on addresses and ports. Most relays share one of a handful of exit
+policies, and each distinct policy is only compiled, and held, once.
+
+Only IPv4 destinations are compiled. Lines about IPv6 addresses, and
+lines that cannot be parsed, never match.
+
+To find every relay that would exit to a destination, the lines of
+the distinct policies are also laid out in NumPy arrays, so that a
+destination is checked against all of them in one vectorised pass and
+the decision of each policy is then spread to the relays that share
+it.
+"""
+# TorStatus specific import statements --------------------------------
+from statusapp import consensus, snapshot
+
+# INIT Variables ------------------------------------------------------
+# The bounds of IPv4 addresses and of ports.
+__MAX_ADDRESS = 0xFFFFFFFF
+__MAX_PORT = 65535
+
+
+@consensus.per_consensus
+def current():
+    """
+    Get the compiled exit policies of the relays in the last
+    consensus, compiling them if they have not been compiled by this
+    process yet.
+
+    @rtype: L{ExitPolicies}
+    @return: The exit policies of the relays in the last consensus.
+    """
+    return ExitPolicies(snapshot.current())
+
+
+def compile_line(line):
+    """
+    Compile a line of an exit policy, such as C{'accept 1.2.3.0/24:80'}
+    or C{'reject *:1-1024'}.
+
+    @type line: C{string}
+    @param line: The line of the exit policy.
+    @rtype: C{tuple}
+    @return: The lowest and highest addresses and the lowest and
+        highest ports that the line matches, and C{True} if it accepts
+        them or C{False} if it rejects them, or C{None} if the line is
+        about IPv6 addresses or cannot be parsed.
+    """
+    try:
+        condition, pattern = line.split()
+    except ValueError:
+        return None
+    if condition not in ('accept', 'reject'):
+        return None
+
+    if ':' in pattern:
+        network, ports = pattern.rsplit(':', 1)
+    else:
+        network, ports = pattern, '*'
+    try:
+        if network in ('*', '*4'):
+            low, high = 0, __MAX_ADDRESS
+        elif '/' in network:
+            base, mask = network.split('/')
+            if '.' in mask:
+                mask = snapshot.address_value(mask)
+            else:
+                bits = int(mask)
+                if bits < 0 or bits > 32:
+                    return None
+                mask = (__MAX_ADDRESS << (32 - bits)) & __MAX_ADDRESS
+            low = snapshot.address_value(base) & mask
+            high = low | (~mask & __MAX_ADDRESS)
+        else:
+            low = high = snapshot.address_value(network)
+
+        if ports == '*':
+            port_low, port_high = 0, __MAX_PORT
+        elif '-' in ports:
+            port_low, port_high = [int(port)
+                                   for port in ports.split('-')]
+        else:
+            port_low = port_high = int(ports)
+    except ValueError:
+        return None
+    return (low, high, port_low, port_high, condition == 'accept')
+
+
+class ExitPolicies(object):
+    """
+    The compiled exit policies of the relays in a L{snapshot.Snapshot}.
+
+    @type snapshot: L{snapshot.Snapshot}
+    @ivar snapshot: The snapshot that the relays are in.
+    @type policies: C{list} of L{ExitPolicy}
+    @ivar policies: The exit policy of each relay, by its position in
+        the snapshot. Relays with the same exit policy share the same
+        L{ExitPolicy}.
+    @type distinct: C{dict} of C{tuple} to L{ExitPolicy}
+    @ivar distinct: Maps the lines of each distinct exit policy to its
+        compiled policy.
+    @type arrays: C{tuple} of C{numpy.ndarray}
+    @ivar arrays: The rules of the distinct policies as arrays, as
+        given by L{_build_arrays}, or C{None} until they are first
+        needed.
+    """
+
+    def __init__(self, snapshot):
+        """
+        @type snapshot: L{snapshot.Snapshot}
+        @param snapshot: The snapshot whose exit policies to compile.
+        """
+        self.snapshot = snapshot
+        self.arrays = None
+        self.distinct = {}
+        self.policies = []
+        for lines in snapshot.columns['exitpolicy']:
+            lines = tuple(lines or ())
+            policy = self.distinct.get(lines)
+            if policy is None:
+                policy = self.distinct[lines] = ExitPolicy(lines)
+            self.policies.append(policy)
+
+    def allows(self, index, address, port):
+        """
+        Check whether a relay would exit to a destination.
+
+        @type index: C{int}
+        @param index: The position of the relay in the snapshot.
+        @type address: C{int}
+        @param address: The IPv4 address of the destination, as given
+            by L{snapshot.address_value}.
+        @type port: C{int}
+        @param port: The port of the destination.
+        @rtype: C{bool}
+        @return: C{True} if the relay would exit to the destination,
+            C{False} otherwise.
+        """
+        return self.policies[index].allows(address, port)
+
+    def exits_to(self, address, port):
+        """
+        Find every relay that would exit to a destination.
+
+        NumPy is imported here rather than with this module, since only
+        this search needs it.
+
+        @type address: C{int}
+        @param address: The IPv4 address of the destination, as given
+            by L{snapshot.address_value}.
+        @type port: C{int}
+        @param port: The port of the destination.
+        @rtype: C{list} of C{int}
+        @return: The positions in the snapshot of the relays that would
+            exit to the destination, in order.
+        """
+        import numpy
+
+        if not self.policies:
+            return []
+        if self.arrays is None:
+            self.arrays = self._build_arrays()
+        lows, highs, port_lows, port_highs, accepts, starts, \
+                relay_policies = self.arrays
+
+        # Every policy ends in a rule that matches everything, so the
+        # first rule of a policy that matches is the lowest position
+        # of a match in its run of rules.
+        matches = ((lows <= address) & (address <= highs) &
+                   (port_lows <= port) & (port <= port_highs))
+        positions = numpy.where(matches, numpy.arange(len(lows)),
+                                len(lows))
+        decisions = accepts[numpy.minimum.reduceat(positions, starts)]
+        return numpy.flatnonzero(decisions[relay_policies]).tolist()
+
+    def _build_arrays(self):
+        """
+        Lay out the rules of the distinct policies in arrays, each
+        policy followed by a rule that rejects everything.
+
+        @rtype: C{tuple} of C{numpy.ndarray}
+        @return: The lowest and highest address, the lowest and highest
+            port, and whether it accepts, of each rule, the position of
+            the first rule of each policy, and the number of the policy
+            of each relay.
+        """
+        import numpy
+
+        reject_all = compile_line('reject *:*')
+        numbers = {}
+        rules = []
+        starts = []
+        for policy in self.policies:
+            if policy not in numbers:
+                numbers[policy] = len(starts)
+                starts.append(len(rules))
+                rules.extend(policy.rules)
+                rules.append(reject_all)
+
+        lows, highs, port_lows, port_highs, accepts = zip(*rules)
+        return (numpy.array(lows, dtype=numpy.int64),
+                numpy.array(highs, dtype=numpy.int64),
+                numpy.array(port_lows, dtype=numpy.int64),
+                numpy.array(port_highs, dtype=numpy.int64),
+                numpy.array(accepts, dtype=bool),
+                numpy.array(starts, dtype=numpy.intp),
+                numpy.array([numbers[policy]
+                             for policy in self.policies],
+                            dtype=numpy.intp))
+
+
+class ExitPolicy(object):
+    """
+    A compiled exit policy.
+
+    @type rules: C{tuple} of C{tuple}
+    @ivar rules: The lines of the policy that can match an IPv4
+        destination, in order, as given by L{compile_line}.
+    """
+    __slots__ = ('rules',)
+
+    def __init__(self, lines):
+        """
+        @type lines: C{iterable} of C{string}
+        @param lines: The lines of the exit policy, in order.
+        """
+        self.rules = tuple([rule for rule in map(compile_line, lines)
+                            if rule is not None])
+
+    def allows(self, address, port):
+        """
+        Check whether the policy accepts a destination. The first line
+        that matches the destination decides, and a destination that
+        no line matches is rejected.
+
+        @type address: C{int}
+        @param address: The IPv4 address of the destination, as given
+            by L{snapshot.address_value}.
+        @type port: C{int}
+        @param port: The port of the destination.
+        @rtype: C{bool}
+        @return: C{True} if the policy accepts the destination, C{False}
+            otherwise.
+        """
+        for low, high, port_low, port_high, accept in self.rules:
+            if low <= address <= high and port_low <= port <= port_high:
+                return accept
+        return False
@@ -0,0 +1,104 @@
+"""
+The nicknames and fingerprints of the relays in the ActiveRelay cache,
+for resolving the families of relays.
+
+A family is a list of fingerprints, prefixed with a '$', and
+nicknames. The details page used to look up each entry with a query of
+its own, so a relay with a large family cost a query per member.
+Instead, the fingerprints and nicknames of every relay in the
+ActiveRelay cache are now loaded once per process and consensus into
+L{RelayNames}, which resolves a whole family at once.
+"""
+# TorStatus specific import statements --------------------------------
+from statusapp.models import ActiveRelay
+from statusapp import consensus
+
+
+@consensus.per_consensus
+def current():
+    """
+    Get the nicknames and fingerprints of the relays in the ActiveRelay
+    cache, loading them if they have not been loaded by this process
+    yet.
+
+    @rtype: L{RelayNames}
+    @return: The nicknames and fingerprints of the relays.
+    """
+    return RelayNames(ActiveRelay.objects.order_by(
+                      'validafter').values_list('fingerprint',
+                                                'nickname'))
+
+
+def resolve(family):
+    """
+    Resolve the members of a family to the relays in the ActiveRelay
+    cache.
+
+    @type family: C{list} of C{string}
+    @param family: The fingerprints, prefixed with a '$', and
+        nicknames in the family.
+    @rtype: C{list} of C{tuple}
+    @return: The fingerprint and nickname of each member of the family,
+        in order, as given by L{RelayNames.resolve}.
+    """
+    return current().resolve(family)
+
+
+class RelayNames(object):
+    """
+    Maps between the fingerprints and nicknames of relays.
+
+    @type nicknames: C{dict} of C{string} to C{string}
+    @ivar nicknames: Maps the fingerprint of each relay to its
+        nickname.
+    @type fingerprints: C{dict} of C{string} to C{set}
+    @ivar fingerprints: Maps each nickname to the fingerprints of the
+        relays that have it.
+    """
+
+    def __init__(self, rows):
+        """
+        @type rows: C{iterable} of C{tuple}
+        @param rows: The fingerprint and nickname of each relay, from
+            the oldest consensus to the most recent, so that a relay
+            that has been renamed has its most recent nickname.
+        """
+        self.nicknames = {}
+        self.fingerprints = {}
+        for fingerprint, nickname in rows:
+            self.nicknames[fingerprint] = nickname
+            self.fingerprints.setdefault(nickname, set()).add(
+                    fingerprint)
+
+    def resolve(self, family):
+        """
+        Resolve the members of a family.
+
+        A fingerprint is resolved to the relay that has it, and a
+        nickname to the only relay that has it. Nicknames are matched
+        case-sensitively, and a nickname that more than one relay has
+        is not resolved.
+
+        @type family: C{list} of C{string}
+        @param family: The fingerprints, prefixed with a '$', and
+            nicknames in the family.
+        @rtype: C{list} of C{tuple}
+        @return: The fingerprint and nickname of each member of the
+            family, in order, or C{None} and the entry as it is given
+            in the family for a member that is not resolved.
+        """
+        members = []
+        for entry in family:
+            if entry.startswith('$') and len(entry) == 41:
+                fingerprint = entry[1:].lower()
+                if fingerprint in self.nicknames:
+                    members.append((fingerprint,
+                                    self.nicknames[fingerprint]))
+                    continue
+            else:
+                fingerprints = self.fingerprints.get(entry, ())
+                if len(fingerprints) == 1:
+                    members.append((list(fingerprints)[0], entry))
+                    continue
+            members.append((None, entry))
+        return members
@@ -0,0 +1,325 @@
+"""
+A cache of the hostnames of relays, filled in the background.
+
+Resolving the hostname of a relay can take seconds if a resolver is
+slow or does not answer, so views never resolve hostnames themselves.
+They ask this module, which answers from its cache at once, gives the
+IP address itself for an address it has not resolved yet, and queues
+the address to be resolved by a small pool of background threads.
+
+Hostnames are remembered for L{__TTL} seconds, and addresses without a
+hostname for L{__NEGATIVE_TTL} seconds. An address whose lookup timed
+out keeps any hostname it had, and is resolved again when it is next
+asked for.
+
+The hostnames of the relays in the ActiveRelay cache are also resolved
+in bulk by L{update_table}, which the C{resolvehostnames} command runs
+after each update of the cache, and are stored in the L{Hostname}
+table so that they can be listed, ordered and searched like any other
+field of a relay.
+"""
+# General python import statements ------------------------------------
+import datetime
+import Queue
+import socket
+import threading
+import time
+
+# Django-specific import statements -----------------------------------
+from django.db import transaction
+from django.db.models import F
+
+# TorStatus specific import statements --------------------------------
+from statusapp.models import ActiveRelay, Hostname, RelayTableVersion
+
+# INIT Variables ------------------------------------------------------
+# The number of seconds for which a hostname is remembered.
+__TTL = 6 * 60 * 60
+
+# The number of seconds for which an address without a hostname is
+# remembered.
+__NEGATIVE_TTL = 30 * 60
+
+# The number of seconds that a single lookup may take.
+__LOOKUP_TIMEOUT = 5
+
+# The number of lookups, including those that have timed out, that may
+# be made at a time.
+__MAX_LOOKUPS = 64
+
+# The number of threads resolving hostnames.
+__RESOLVERS = 4
+
+# The number of threads resolving hostnames in bulk.
+__BULK_RESOLVERS = 32
+
+# The number of addresses that are remembered, and that may wait to be
+# resolved, at a time.
+__MAX_ENTRIES = 10000
+__MAX_PENDING = 1000
+
+# Maps addresses to their hostname, or None if they have none, and the
+# time at which the entry expires.
+__CACHE = {}
+
+# Addresses waiting to be resolved, in a queue and as a set.
+__QUEUE = Queue.Queue(__MAX_PENDING)
+__PENDING = set()
+
+# Held by each lookup until it finishes, even after it has timed out.
+__LOOKUPS = threading.Semaphore(__MAX_LOOKUPS)
+
+# Given by L{_resolve} for an address that was not looked up, or whose
+# lookup did not finish in time, as opposed to C{None} for an address
+# that has no hostname.
+__NOT_LOOKED_UP = object()
+
+# Whether the resolvers have been started.
+__STARTED = False
+
+# Held while the cache, the pending addresses or the resolvers are
+# changed.
+__LOCK = threading.Lock()
+
+
+def hostname(address):
+    """
+    Get the hostname of an IP address without waiting for it to be
+    resolved.
+
+    @type address: C{string}
+    @param address: The IP address.
+    @rtype: C{string}
+    @return: The hostname of the address if it is known, or else the
+        address itself, as C{socket.getfqdn} would return.
+    """
+    global __STARTED
+
+    address = str(address)
+    now = time.time()
+    entry = __CACHE.get(address)
+    if entry is not None and entry[1] > now:
+        return entry[0] or address
+
+    __LOCK.acquire()
+    try:
+        if not __STARTED:
+            for number in range(__RESOLVERS):
+                resolver = threading.Thread(target=_resolve_queued)
+                resolver.setDaemon(True)
+                resolver.start()
+            __STARTED = True
+        if address not in __PENDING:
+            try:
+                __QUEUE.put_nowait(address)
+                __PENDING.add(address)
+            except Queue.Full:
+                # The address will be queued again when it is next
+                # asked for.
+                pass
+    finally:
+        __LOCK.release()
+
+    # A stale hostname is still better than none while it is resolved
+    # again.
+    if entry is not None:
+        return entry[0] or address
+    return address
+
+
+def is_resolved(address):
+    """
+    Check whether the hostname of an IP address has been resolved.
+
+    @type address: C{string}
+    @param address: The IP address.
+    @rtype: C{bool}
+    @return: C{True} if the address has been resolved, even if it has
+        no hostname or its hostname is due to be resolved again,
+        C{False} otherwise.
+    """
+    return str(address) in __CACHE
+
+
+def _resolve_queued():
+    """
+    Resolve queued addresses, forever.
+    """
+    while True:
+        address = __QUEUE.get()
+        name = _resolve(address)
+        if name is __NOT_LOOKED_UP:
+            # The address keeps any hostname it had, and is queued
+            # again when it is next asked for.
+            __LOCK.acquire()
+            try:
+                __PENDING.discard(address)
+            finally:
+                __LOCK.release()
+            continue
+        if name is None:
+            expires = time.time() + __NEGATIVE_TTL
+        else:
+            expires = time.time() + __TTL
+
+        __LOCK.acquire()
+        try:
+            if len(__CACHE) >= __MAX_ENTRIES:
+                now = time.time()
+                for cached in __CACHE.keys():
+                    if __CACHE[cached][1] <= now:
+                        del __CACHE[cached]
+                if len(__CACHE) >= __MAX_ENTRIES:
+                    __CACHE.clear()
+            __CACHE[address] = (name, expires)
+            __PENDING.discard(address)
+        finally:
+            __LOCK.release()
+
+
+def _resolve(address):
+    """
+    Resolve the hostname of an address, giving up after
+    L{__LOOKUP_TIMEOUT} seconds.
+
+    The system resolver cannot be given a timeout, so the lookup is
+    made in a thread of its own, which is abandoned if it takes too
+    long. At most L{__MAX_LOOKUPS} lookups are made at a time, so that
+    a resolver that does not answer cannot pile up abandoned threads;
+    an address is not resolved while they are all still running.
+
+    @type address: C{string}
+    @param address: The IP address.
+    @rtype: C{string}
+    @return: The hostname of the address, C{None} if it has none, or
+        L{__NOT_LOOKED_UP} if it could not be resolved in time.
+    """
+    if not __LOOKUPS.acquire(False):
+        return __NOT_LOOKED_UP
+    result = []
+
+    def look_up():
+        try:
+            result.append(socket.getfqdn(address))
+        finally:
+            __LOOKUPS.release()
+
+    lookup = threading.Thread(target=look_up)
+    lookup.setDaemon(True)
+    try:
+        lookup.start()
+    except Exception:
+        __LOOKUPS.release()
+        raise
+    lookup.join(__LOOKUP_TIMEOUT)
+    if not result:
+        return __NOT_LOOKED_UP
+    if result[0] == address:
+        return None
+    return result[0]
+
+
+def resolve_all(addresses, workers=__BULK_RESOLVERS):
+    """
+    Resolve the hostnames of many IP addresses at once, with a bounded
+    number of lookups made at a time.
+
+    @type addresses: C{iterable} of C{string}
+    @param addresses: The IP addresses.
+    @type workers: C{int}
+    @param workers: The number of lookups made at a time.
+    @rtype: C{dict} of C{string} to C{string}
+    @return: Maps each address to its hostname, or to C{None} if it has
+        none. Addresses that could not be resolved in time are left
+        out.
+    """
+    queue = Queue.Queue()
+    for address in set(addresses):
+        queue.put(address)
+    names = {}
+
+    def resolve_queued():
+        while True:
+            try:
+                address = queue.get_nowait()
+            except Queue.Empty:
+                return
+            name = _resolve(address)
+            if name is not __NOT_LOOKED_UP:
+                names[address] = name
+
+    resolvers = [threading.Thread(target=resolve_queued)
+                 for number in range(min(workers, queue.qsize()))]
+    for resolver in resolvers:
+        resolver.setDaemon(True)
+        resolver.start()
+    for resolver in resolvers:
+        resolver.join()
+    return names
+
+
+def update_table():
+    """
+    Resolve the hostnames of the relays in the ActiveRelay cache that
+    have not been resolved recently, and store them in the L{Hostname}
+    table.
+
+    Hostnames are resolved again after L{__TTL} seconds, and addresses
+    without a hostname after L{__NEGATIVE_TTL} seconds. An address that
+    could not be resolved in time keeps the hostname stored for it,
+    and is resolved again by the next update. Addresses that are no
+    longer in the ActiveRelay cache are forgotten. If any hostname
+    changes, the version of the ActiveRelay cache is incremented, so
+    that pages and snapshots of relays are refreshed.
+
+    @rtype: C{int}
+    @return: The number of addresses that were resolved.
+    """
+    now = datetime.datetime.utcnow()
+    resolved_after = now - datetime.timedelta(seconds=__TTL)
+    unresolved_after = now - datetime.timedelta(seconds=__NEGATIVE_TTL)
+
+    addresses = set(ActiveRelay.objects.values_list('address',
+                                                    flat=True))
+    stored = {}
+    fresh = set()
+    for address, name, resolved in Hostname.objects.values_list(
+            'address', 'hostname', 'resolved'):
+        stored[address] = name
+        if name is None:
+            if resolved > unresolved_after:
+                fresh.add(address)
+        elif resolved > resolved_after:
+            fresh.add(address)
+
+    names = resolve_all([address for address in addresses
+                         if address not in fresh])
+    _store(names, addresses, now, [address for address, name
+           in names.items() if stored.get(address) != name])
+    return len(names)
+
+
+@transaction.commit_on_success
+def _store(names, addresses, resolved, changed):
+    """
+    Store resolved hostnames in the L{Hostname} table, in a single
+    transaction.
+
+    @type names: C{dict} of C{string} to C{string}
+    @param names: Maps addresses to their hostnames, as given by
+        L{resolve_all}.
+    @type addresses: C{set} of C{string}
+    @param addresses: The addresses of the relays in the ActiveRelay
+        cache, whose hostnames are kept.
+    @type resolved: C{datetime}
+    @param resolved: The time at which the hostnames were resolved.
+    @type changed: C{list} of C{string}
+    @param changed: The addresses whose hostnames have changed.
+    """
+    for address, name in names.items():
+        Hostname(address=address, hostname=name,
+                 resolved=resolved).save()
+    Hostname.objects.exclude(address__in=list(addresses)).delete()
+    if changed:
+        RelayTableVersion.objects.update(version=F('version') + 1,
+                                         updated=resolved)
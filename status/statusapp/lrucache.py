@@ -0,0 +1,108 @@
+"""
+A least-recently-used cache bounded by the total size of its values.
+"""
+# General python import statements ------------------------------------
+import threading
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping that forgets its least recently used entries
+    once the sizes of its values add up to more than a given size.
+
+    Entries are kept in a doubly linked list, most recently used
+    first, of lists holding the previous entry, the next entry, the
+    key, the value and the size of the value.
+
+    @type max_size: C{int}
+    @ivar max_size: The largest total size of the values that are
+        kept.
+    @type size: C{int}
+    @ivar size: The total size of the values that are kept.
+    """
+    # The positions of the fields of an entry.
+    PREVIOUS, NEXT, KEY, VALUE, SIZE = range(5)
+
+    def __init__(self, max_size):
+        """
+        @type max_size: C{int}
+        @param max_size: The largest total size of the values to keep.
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        # The list is circular, and starts and ends at this entry.
+        self.root = [None, None, None, None, 0]
+        self.root[self.PREVIOUS] = self.root[self.NEXT] = self.root
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """
+        Get the value of a key, marking it as the most recently used.
+
+        @param key: The key.
+        @param default: The value to give if the key is not kept.
+        @return: The value of the key, or C{default}.
+        """
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            self._unlink(entry)
+            self._link(entry)
+            return entry[self.VALUE]
+        finally:
+            self.lock.release()
+
+    def set(self, key, value, size=1):
+        """
+        Set the value of a key, forgetting the least recently used
+        entries if the cache has grown too large. A value larger than
+        the cache is not kept.
+
+        @param key: The key.
+        @param value: The value.
+        @type size: C{int}
+        @param size: The size of the value, e.g. its length in bytes.
+        """
+        self.lock.acquire()
+        try:
+            if key in self.entries:
+                entry = self.entries.pop(key)
+                self._unlink(entry)
+                self.size -= entry[self.SIZE]
+            if size > self.max_size:
+                return
+
+            entry = [None, None, key, value, size]
+            self.entries[key] = entry
+            self._link(entry)
+            self.size += size
+            while self.size > self.max_size:
+                oldest = self.root[self.PREVIOUS]
+                self._unlink(oldest)
+                del self.entries[oldest[self.KEY]]
+                self.size -= oldest[self.SIZE]
+        finally:
+            self.lock.release()
+
+    def _link(self, entry):
+        """
+        Put an entry at the front of the list.
+        """
+        first = self.root[self.NEXT]
+        entry[self.PREVIOUS] = self.root
+        entry[self.NEXT] = first
+        first[self.PREVIOUS] = self.root[self.NEXT] = entry
+
+    def _unlink(self, entry):
+        """
+        Take an entry out of the list.
+        """
+        entry[self.PREVIOUS][self.NEXT] = entry[self.NEXT]
+        entry[self.NEXT][self.PREVIOUS] = entry[self.PREVIOUS]
@@ -0,0 +1,25 @@
+"""
+The rendergraphs command, which draws and publishes the network
+statistic graphs. It should be run after each update of the
+ActiveRelay cache, e.g. 'python manage.py rendergraphs' from a
+crontab.
+"""
+# Django-specific import statements -----------------------------------
+from django.core.management.base import NoArgsCommand
+
+# TorStatus specific import statements --------------------------------
+from statusapp.views import graphs
+
+
+class Command(NoArgsCommand):
+    """
+    Draw every network statistic graph for the current version of the
+    ActiveRelay cache and publish it for the web server to serve.
+    """
+    help = ('Draws the network statistic graphs for the current '
+            'version of the ActiveRelay cache.')
+
+    def handle_noargs(self, **options):
+        names = graphs.render_network_graphs()
+        if int(options.get('verbosity', 1)) > 1:
+            return 'Published %d graphs.\n' % len(names)
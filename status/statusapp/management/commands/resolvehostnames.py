@@ -0,0 +1,24 @@
+"""
+The resolvehostnames command, which resolves the hostnames of the
+relays in the ActiveRelay cache. It should be run after each update of
+the cache, e.g. 'python manage.py resolvehostnames' from a crontab.
+"""
+# Django-specific import statements -----------------------------------
+from django.core.management.base import NoArgsCommand
+
+# TorStatus specific import statements --------------------------------
+from statusapp import hostnames
+
+
+class Command(NoArgsCommand):
+    """
+    Resolve the hostnames of the relays in the ActiveRelay cache and
+    store them in the Hostname table.
+    """
+    help = ('Resolves the hostnames of the relays in the ActiveRelay '
+            'cache that have not been resolved recently.')
+
+    def handle_noargs(self, **options):
+        resolved = hostnames.update_table()
+        if int(options.get('verbosity', 1)) > 1:
+            return 'Resolved %d addresses.\n' % resolved
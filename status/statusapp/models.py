@@ -23,7 +23,8 @@ in the object's constructors.
     L{ScheduledUpdates}, L{Updates}, L{Geoipdb},
     L{RelaysMonthlySnapshots}, L{BridgeNetworkSize}, L{DirreqStats},
     L{BridgeStats}, L{TorperfStats}, L{GettorStats},
-    L{ActiveStatusentry}, L{ActiveRelay}, L{ActiveDescriptor}
+    L{ActiveStatusentry}, L{ActiveRelay}, L{ActiveDescriptor},
+    L{RelayTableVersion}
 """
 from django.db import models
 
@@ -1467,3 +1468,56 @@ class ActiveRelay(models.Model):
 
     def __unicode__(self):
         return self.fingerprint
+
+
+class RelayTableVersion(models.Model):
+    """
+    Model for the version of the ActiveRelay cache, which is
+    incremented each time that the cache is updated.
+
+    @type version: IntegerField (C{int})
+    @ivar version: The number of times that the ActiveRelay cache has
+        been updated.
+    @type validafter: DateTimeField (C{datetime})
+    @ivar validafter: The publication time of the last consensus in
+        the ActiveRelay cache.
+    @type updated: DateTimeField (C{datetime})
+    @ivar updated: The time at which the ActiveRelay cache was last
+        updated.
+    """
+    version = models.IntegerField(primary_key=True)
+    validafter = models.DateTimeField(blank=True)
+    updated = models.DateTimeField(blank=True)
+
+    class Meta:
+        verbose_name = 'relay table version'
+        db_table = 'cache\".\"relay_table_version'
+
+    def __unicode__(self):
+        return str(self.version)
+
+
+class Hostname(models.Model):
+    """
+    Model for the hostnames of the IP addresses of active relays,
+    which are resolved in bulk after each update of the ActiveRelay
+    cache.
+
+    @type address: IPAddressField (C{string})
+    @ivar address: The IP address.
+    @type hostname: CharField (C{string})
+    @ivar hostname: The hostname of the IP address, or C{None} if it
+        has none.
+    @type resolved: DateTimeField (C{datetime})
+    @ivar resolved: The time at which the hostname was resolved.
+    """
+    address = models.IPAddressField(primary_key=True)
+    hostname = models.CharField(max_length=255, blank=True)
+    resolved = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'hostname'
+        db_table = 'cache\".\"hostname'
+
+    def __unicode__(self):
+        return self.address
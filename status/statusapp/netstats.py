@@ -0,0 +1,127 @@
+"""
+The statistics of the relays in the last consensus that the network
+statistic graphs show.
+
+Each network statistic graph used to walk over every relay in the last
+consensus to build its own histogram. Instead, all of the histograms
+are now computed together, in a single pass over the columns of the
+snapshot, once per process and consensus, into a small
+L{NetworkStatistics} that every graph reads.
+"""
+# General python import statements ------------------------------------
+from bisect import bisect_right
+
+# TorStatus specific import statements --------------------------------
+from statusapp import consensus, snapshot
+
+# INIT Variables ------------------------------------------------------
+# The ranges of observed bandwidth, in KB/s, that relays are counted
+# in. Relays with more bandwidth than the last range, or without a
+# known bandwidth, are counted together.
+BANDWIDTH_RANGES = [(0, 10), (11, 20), (21, 50), (51, 100), (101, 500),
+                    (501, 1000), (1001, 2000), (2001, 3000),
+                    (3001, 5000), (5001, 10000)]
+
+# The platforms that relays are counted by. A relay is counted by the
+# first of these that its platform contains, or else as 'Unknown'.
+PLATFORMS = ['Linux', 'Windows', 'FreeBSD', 'Darwin', 'OpenBSD',
+             'NetBSD', 'SunOS']
+
+
+@consensus.per_consensus
+def current():
+    """
+    Get the statistics of the relays in the last consensus, computing
+    them if they have not been computed by this process yet.
+
+    @rtype: L{NetworkStatistics}
+    @return: The statistics of the relays in the last consensus.
+    """
+    return NetworkStatistics(snapshot.current())
+
+
+class NetworkStatistics(object):
+    """
+    The statistics of the relays in a L{snapshot.Snapshot}.
+
+    @type total: C{int}
+    @ivar total: The number of relays.
+    @type countries: C{dict} of C{string} to C{int}
+    @ivar countries: Maps each country code, or '??' for relays without
+        one, to the number of relays in that country.
+    @type exit_countries: C{dict} of C{string} to C{int}
+    @ivar exit_countries: Maps each country code, or '??', to the
+        number of exit relays in that country.
+    @type weeks_running: C{dict} of C{int} to C{int}
+    @ivar weeks_running: Maps each number of whole weeks of uptime to
+        the number of relays that have been running that long. Relays
+        without a descriptor are left out.
+    @type bandwidths: C{list} of C{int}
+    @ivar bandwidths: The number of relays in each of
+        L{BANDWIDTH_RANGES}, followed by the number of other relays.
+    @type platforms: C{dict} of C{string} to C{int}
+    @ivar platforms: Maps each of L{PLATFORMS}, and 'Unknown', to the
+        number of relays on that platform.
+    @type flags: C{dict} of C{string} to C{int}
+    @ivar flags: Maps the name of each flag to the number of relays
+        that have it set.
+    """
+
+    def __init__(self, relays):
+        """
+        @type relays: L{snapshot.Snapshot}
+        @param relays: The snapshot of the relays.
+        """
+        self.total = relays.size
+        self.countries = {}
+        self.exit_countries = {}
+        self.weeks_running = {}
+        self.bandwidths = [0] * (len(BANDWIDTH_RANGES) + 1)
+        self.platforms = dict.fromkeys(PLATFORMS + ['Unknown'], 0)
+
+        # The flags of each relay are already counted in the bitmaps
+        # of the snapshot.
+        self.flags = {}
+        for name, bitmap in relays.flag_bitmaps.items():
+            self.flags[name] = bin(bitmap).count('1')
+
+        lowers = [lower for lower, upper in BANDWIDTH_RANGES]
+        uppers = [upper for lower, upper in BANDWIDTH_RANGES]
+        excess = len(BANDWIDTH_RANGES)
+        exit_bit = relays.flag_bits['isexit']
+        null_int = relays.NULL_INT
+        for country, flags, uptimedays, kbps, platform in zip(
+                relays.columns['country'], relays.flags,
+                relays.columns['uptimedays'],
+                relays.columns['bandwidthkbps'],
+                relays.columns['platform']):
+            if country is None:
+                country = '??'
+            self.countries[country] = self.countries.get(country, 0) + 1
+            if flags & exit_bit:
+                self.exit_countries[country] = \
+                        self.exit_countries.get(country, 0) + 1
+
+            # Some relays don't have descriptors. The uptime in weeks
+            # is days / (day/week), where / signifies floor division.
+            if uptimedays != null_int:
+                weeks = uptimedays / 7
+                self.weeks_running[weeks] = \
+                        self.weeks_running.get(weeks, 0) + 1
+
+            # Bandwidths outside of every range, including NULL ones,
+            # are counted with the highest.
+            position = bisect_right(lowers, kbps) - 1
+            if position < 0 or kbps > uppers[position]:
+                position = excess
+            self.bandwidths[position] += 1
+
+            if platform is None:
+                self.platforms['Unknown'] += 1
+                continue
+            for key in PLATFORMS:
+                if key in platform:
+                    self.platforms[key] += 1
+                    break
+            else:
+                self.platforms['Unknown'] += 1
@@ -0,0 +1,190 @@
+"""
+A pool of worker processes that graphs are drawn in.
+
+Drawing a graph with matplotlib takes a fair amount of CPU, and used
+to happen on the thread serving the request, which also set the
+margins of the graph in matplotlib's global defaults, where they could
+be changed by another thread drawing another graph at the same time.
+Instead, graphs are now drawn from their data points alone, with the
+margins set on each figure, by a bounded pool of worker processes,
+so that drawing can use every core, and a request gives up on a graph
+that takes longer than L{__TIMEOUT} seconds rather than waiting on it.
+
+The pool should be started by L{start} when the web server loads the
+application, before the process starts any threads of its own, since
+the workers are forked from it; otherwise it is started the first
+time a graph is drawn. Setting C{GRAPH_RENDERERS} to 0 draws graphs in
+the serving process instead.
+"""
+# General python import statements ------------------------------------
+import multiprocessing
+import threading
+import time
+import traceback
+
+# Django-specific import statements -----------------------------------
+from django.conf import settings
+
+# INIT Variables ------------------------------------------------------
+# The number of worker processes that draw graphs.
+try:
+    __PROCESSES = getattr(settings, 'GRAPH_RENDERERS',
+                          multiprocessing.cpu_count())
+except NotImplementedError:
+    __PROCESSES = 1
+
+# The number of seconds that a request may wait for a graph.
+__TIMEOUT = getattr(settings, 'GRAPH_RENDER_TIMEOUT', 30)
+
+# The number of graphs that may be sent to the pool and not yet drawn
+# at a time, per process, including graphs that requests have given up
+# waiting for.
+__MAX_PENDING = 4 * __PROCESSES
+
+# The number of seconds after which a graph that has not been drawn is
+# taken to be lost, e.g. because its worker was killed.
+__LOST_TIMEOUT = 10 * __TIMEOUT
+
+# The pool, once it has been started.
+__POOL = None
+
+# The graphs that have been sent to the pool and not yet drawn, as
+# their results and the times at which they were sent.
+__PENDING = []
+
+# Held while the pool is started or graphs are sent to it.
+__LOCK = threading.Lock()
+
+
+class RenderTimeout(Exception):
+    """
+    Raised when a graph is not drawn within L{__TIMEOUT} seconds.
+    """
+    pass
+
+
+def start():
+    """
+    Start the pool of worker processes, if it has not been started and
+    graphs are not drawn in the serving process.
+
+    @rtype: C{multiprocessing.Pool}
+    @return: The pool, or C{None} if graphs are drawn in the serving
+        process.
+    """
+    global __POOL
+
+    if not __PROCESSES:
+        return None
+    __LOCK.acquire()
+    try:
+        if __POOL is None:
+            __POOL = multiprocessing.Pool(__PROCESSES)
+        return __POOL
+    finally:
+        __LOCK.release()
+
+
+def render(function, *args):
+    """
+    Draw a graph in the pool of worker processes, and wait for it.
+
+    @type function: C{function}
+    @param function: The function that draws the graph, which must be
+        defined at the top level of a module and must not use the
+        database.
+    @param args: The arguments to the function, which must be picklable.
+    @return: The result of the function, e.g. a PNG image.
+    @raise RenderTimeout: If the graph is not drawn in time, or too
+        many graphs are already waiting to be drawn.
+    @raise RuntimeError: If the function raises an exception.
+    """
+    pool = start()
+    if pool is None:
+        return function(*args)
+
+    result = _wait(lambda: _send(pool, function, args), __TIMEOUT)
+    if result is None:
+        raise RenderTimeout('Too many graphs are waiting to be drawn.')
+    try:
+        succeeded, value = result.get(__TIMEOUT)
+    except multiprocessing.TimeoutError:
+        raise RenderTimeout('The graph was not drawn in time.')
+    if not succeeded:
+        raise RuntimeError('Drawing a graph failed:\n%s' % value)
+    return value
+
+
+def _call(function, args):
+    """
+    Call a function in a worker process, catching any exception so
+    that the pool always reports the call as finished.
+
+    @rtype: C{tuple}
+    @return: C{True} and the result of the function, or C{False} and
+        the traceback of the exception that it raised.
+    """
+    try:
+        return True, function(*args)
+    except Exception:
+        return False, traceback.format_exc()
+
+
+def _send(pool, function, args):
+    """
+    Send a graph to the pool, unless L{__MAX_PENDING} graphs sent to
+    it have not been drawn yet.
+
+    A graph stays pending after the request that sent it has stopped
+    waiting for it, until a worker has drawn it, so that slow graphs
+    cannot pile up in the queue of the pool. A graph that has not been
+    drawn after L{__LOST_TIMEOUT} seconds is no longer counted, since
+    one whose worker was killed is never reported as drawn.
+
+    @type pool: C{multiprocessing.Pool}
+    @param pool: The pool.
+    @type function: C{function}
+    @param function: The function that draws the graph.
+    @param args: The arguments to the function.
+    @rtype: C{multiprocessing.pool.AsyncResult}
+    @return: The result of drawing the graph, or C{None} if too many
+        graphs are pending.
+    """
+    __LOCK.acquire()
+    try:
+        now = time.time()
+        __PENDING[:] = [(result, sent) for result, sent in __PENDING
+                        if not result.ready() and
+                        now - sent < __LOST_TIMEOUT]
+        if len(__PENDING) >= __MAX_PENDING:
+            return None
+        result = pool.apply_async(_call, (function, args))
+        __PENDING.append((result, now))
+        return result
+    finally:
+        __LOCK.release()
+
+
+def _wait(attempt, timeout):
+    """
+    Make an attempt until it succeeds, giving up after a number of
+    seconds.
+
+    @type attempt: C{function}
+    @param attempt: The attempt, which returns C{None} if it fails.
+    @type timeout: C{float}
+    @param timeout: The number of seconds to wait.
+    @return: The value of the attempt that succeeded, or C{None} if
+        none did in time.
+    """
+    waited = 0.0
+    delay = 0.005
+    value = attempt()
+    while value is None:
+        if waited >= timeout:
+            return None
+        time.sleep(delay)
+        waited += delay
+        delay = min(delay * 2, 0.25)
+        value = attempt()
+    return value
@@ -0,0 +1,773 @@
+"""
+An in-memory snapshot of the relays in the last consensus.
+
+Every page that lists or counts relays used to query the ActiveRelay
+cache for the last consensus and build a model object for each relay.
+Instead, the relays of the last consensus are now loaded once per
+process and consensus into a L{Snapshot}, which holds them as compact
+columns:
+
+    - Flags are bits in one integer per relay, and each flag also has
+      a bitmap of the relays that have it set, so that flag lookups
+      are a few operations on long integers.
+    - Integer fields, such as bandwidths, uptimes and ports, are
+      C{array}s of machine integers.
+    - Strings and other values are interned, so that the same
+      platform, country or exit policy line is only held once.
+    - Nicknames, fingerprints and IP addresses are also kept, in
+      lower case, in one sorted list, so that a basic search is a
+      binary search for the term.
+
+Each relay also has the C{hostname} of its IP address, as resolved in
+bulk into the L{Hostname} table, or C{None} if it has not been
+resolved or has no hostname, and relays are indexed by the integer
+value of their IP address, so that the relays at an address are found
+with a single lookup.
+
+A L{RelaySet} is a subset of the relays in a snapshot. It can be
+filtered, searched and ordered much like a C{QuerySet} of
+L{ActiveRelay}s, and yields L{SnapshotRelay}s that can be used in place
+of model objects wherever the relays are only read.
+"""
+# General python import statements ------------------------------------
+from array import array
+from bisect import bisect_left
+
+# Django-specific import statements -----------------------------------
+from django.core.exceptions import FieldError, ValidationError
+from django.db import models
+from django.db.models.fields import FieldDoesNotExist
+
+# TorStatus specific import statements --------------------------------
+from statusapp.models import ActiveRelay, Hostname
+from statusapp import consensus
+
+# INIT Variables ------------------------------------------------------
+# The fields of an ActiveRelay held in a snapshot, in the order in which
+# they are loaded.
+FIELDS = tuple([field.name for field in ActiveRelay._meta.fields
+                if field.name != 'validafter'])
+
+# The fields whose beginnings are searched by the basic search.
+SEARCH_FIELDS = ('nickname', 'fingerprint', 'address')
+
+# The number of result sets that are remembered per consensus.
+__MAX_RESULT_SETS = 256
+
+
+@consensus.per_consensus
+def current():
+    """
+    Get the snapshot of the last consensus in the ActiveRelay cache,
+    loading it if it has not been loaded by this process yet.
+
+    @rtype: L{Snapshot}
+    @return: The snapshot of the last consensus.
+    """
+    last_validafter = consensus.last_validafter()
+    rows = ActiveRelay.objects.filter(
+           validafter=last_validafter).order_by(
+           'fingerprint').values_list(*FIELDS)
+    hostnames = dict(Hostname.objects.values_list('address',
+                                                  'hostname'))
+    return Snapshot(last_validafter, rows, hostnames)
+
+
+def address_value(address):
+    """
+    Convert a dotted-quad IPv4 address to an integer.
+
+    >>> address_value('1.2.3.4')
+    16909060
+
+    @type address: C{string}
+    @param address: The IPv4 address.
+    @rtype: C{int}
+    @return: The address as an integer.
+    @raise ValueError: If the address is not a valid IPv4 address.
+    """
+    octets = address.split('.')
+    if len(octets) != 4:
+        raise ValueError('Not an IPv4 address: %r' % address)
+    value = 0
+    for octet in octets:
+        octet = int(octet)
+        if octet < 0 or octet > 255:
+            raise ValueError('Not an IPv4 address: %r' % address)
+        value = (value << 8) | octet
+    return value
+
+
+def signature(term, filters, order):
+    """
+    Get the canonical form of a search of the relays in the last
+    consensus, so that searches that are written differently but
+    always give the same result set have the same signature.
+
+    @type term: C{string}
+    @param term: The basic search term, or an empty string.
+    @type filters: C{dict}
+    @param filters: The advanced search lookups, as given by
+        L{helpers.get_filter_params}. They are ignored if a basic
+        search term is given.
+    @type order: C{string}
+    @param order: The order of the result set, as given by
+        L{helpers.get_order}.
+    @rtype: C{tuple}
+    @return: The search term, the lookups and the order, in a
+        hashable, canonical form.
+    """
+    # Basic searches are case-insensitive.
+    term = term.lower()
+    if term:
+        lookups = ()
+    else:
+        lookups = tuple(sorted(filters.items()))
+    return (term, lookups, order)
+
+
+def _find_results(term, lookups, order):
+    """
+    Search the relays in the last consensus.
+
+    @type term: C{string}
+    @param term: The basic search term, or an empty string.
+    @type lookups: C{tuple} of C{tuple}
+    @param lookups: The advanced search lookups, as (key, value) pairs.
+    @type order: C{string}
+    @param order: The order of the result set.
+    @rtype: L{RelaySet}
+    @return: The relays that match the search, in order.
+    """
+    relays = current().all()
+    if term:
+        relays = relays.search(term)
+    else:
+        relays = relays.filter(**dict(lookups))
+    return relays.order_by(order)
+
+_find_results = consensus.per_consensus(_find_results,
+                                        __MAX_RESULT_SETS)
+
+
+def results(term, filters, order):
+    """
+    Get the relays in the last consensus that match a search, in
+    order.
+
+    Result sets are remembered by the L{signature} of their search
+    until the ActiveRelay cache is updated, so the pages of a result
+    set, its count and its CSV are all taken from the same ordering,
+    which is only computed once.
+
+    @type term: C{string}
+    @param term: The basic search term, or an empty string.
+    @type filters: C{dict}
+    @param filters: The advanced search lookups, as given by
+        L{helpers.get_filter_params}.
+    @type order: C{string}
+    @param order: The order of the result set, as given by
+        L{helpers.get_order}.
+    @rtype: L{RelaySet}
+    @return: The relays that match the search, in order.
+    @raise FieldError: If the order or a lookup names no such field.
+    """
+    return _find_results(*signature(term, filters, order))
+
+
+class Snapshot(object):
+    """
+    The relays of a single consensus, held column by column.
+
+    Relays are numbered by their position in the snapshot, which is
+    ordered by fingerprint.
+
+    @type validafter: C{datetime}
+    @ivar validafter: The valid-after time of the consensus.
+    @type size: C{int}
+    @ivar size: The number of relays in the consensus.
+    @type flag_bits: C{dict} of C{string} to C{int}
+    @ivar flag_bits: Maps the name of each flag to its bit in
+        L{flags}.
+    @type flags: C{array} of C{int}
+    @ivar flags: The flags that are set for each relay.
+    @type null_flags: C{array} of C{int}
+    @ivar null_flags: The flags that are NULL for each relay, such as
+        hibernating for a relay without a descriptor.
+    @type flag_bitmaps: C{dict} of C{string} to C{long}
+    @ivar flag_bitmaps: Maps the name of each flag to a bitmap of the
+        relays that have it set, with bit I{n} for the relay at
+        position I{n}.
+    @type null_flag_bitmaps: C{dict} of C{string} to C{long}
+    @ivar null_flag_bitmaps: Maps the name of each flag to a bitmap of
+        the relays for which it is NULL.
+    @type everything: C{long}
+    @ivar everything: The bitmap of all of the relays.
+    @type prefix_keys: C{list} of C{unicode}
+    @ivar prefix_keys: The lowercased values of L{SEARCH_FIELDS} of
+        every relay, sorted.
+    @type prefix_positions: C{array} of C{int}
+    @ivar prefix_positions: The position of the relay that each of
+        L{prefix_keys} was taken from.
+    @type address_positions: C{dict} of C{int} to C{list}
+    @ivar address_positions: Maps the value of each IP address, as
+        given by L{address_value}, to the positions of the relays at
+        that address.
+    @type columns: C{dict} of C{string} to C{array} or C{list}
+    @ivar columns: Maps the name of every other field of
+        L{ActiveRelay}, and C{hostname}, to the values of that field.
+    @type int_columns: C{frozenset} of C{string}
+    @ivar int_columns: The names of the columns held as C{array}s.
+    """
+
+    # NULL integers are held as this value, since none of the integer
+    # fields of an ActiveRelay can be negative.
+    NULL_INT = -1
+
+    def __init__(self, validafter, rows, hostnames=None):
+        """
+        Build the columns of a snapshot from the relays of a consensus.
+
+        @type validafter: C{datetime}
+        @param validafter: The valid-after time of the consensus.
+        @type rows: C{iterable} of C{tuple}
+        @param rows: The values of L{FIELDS} for each relay, ordered by
+            fingerprint.
+        @type hostnames: C{dict} of C{string} to C{string}
+        @param hostnames: Maps IP addresses to their hostnames, or to
+            C{None} if they have none.
+        """
+        self.validafter = validafter
+        self.flag_bits = {}
+        self.columns = {}
+        self.flags = array('l')
+        self.null_flags = array('l')
+
+        # Split the fields into flags, integers, and everything else,
+        # remembering where each is in a row.
+        flag_positions = []
+        int_positions = []
+        other_positions = []
+        for position, name in enumerate(FIELDS):
+            field = ActiveRelay._meta.get_field(name)
+            if isinstance(field, models.BooleanField):
+                self.flag_bits[name] = 1 << len(flag_positions)
+                flag_positions.append(position)
+            elif isinstance(field, models.IntegerField):
+                self.columns[name] = array('l')
+                int_positions.append((position, self.columns[name]))
+            else:
+                self.columns[name] = []
+                other_positions.append((position, self.columns[name]))
+        self.int_columns = frozenset([FIELDS[position]
+                                      for position, column
+                                      in int_positions])
+
+        interned = {}
+        null_int = self.NULL_INT
+        self.size = 0
+        for row in rows:
+            flags = null_flags = 0
+            for bit, position in enumerate(flag_positions):
+                if row[position]:
+                    flags |= 1 << bit
+                elif row[position] is None:
+                    null_flags |= 1 << bit
+            self.flags.append(flags)
+            self.null_flags.append(null_flags)
+
+            for position, column in int_positions:
+                value = row[position]
+                if value is None:
+                    value = null_int
+                column.append(value)
+
+            for position, column in other_positions:
+                # Exit policies are lists of lines, and many relays
+                # share the same lines or even the same policy.
+                value = row[position]
+                if isinstance(value, list):
+                    value = tuple([interned.setdefault(line, line)
+                                   for line in value])
+                column.append(interned.setdefault(value, value))
+            self.size += 1
+
+        hostnames = hostnames or {}
+        self.columns['hostname'] = [hostnames.get(address)
+                                    for address
+                                    in self.columns['address']]
+
+        # The exit node query finds the relays at an IP address.
+        self.address_positions = {}
+        for position, address in enumerate(self.columns['address']):
+            try:
+                value = address_value(address)
+            except ValueError:
+                continue
+            self.address_positions.setdefault(value, []).append(
+                    position)
+
+        # Flag lookups are answered by combining one bitmap per flag,
+        # which are built from strings of bits, most significant first.
+        self.everything = (1L << self.size) - 1
+        self.flag_bitmaps = {}
+        self.null_flag_bitmaps = {}
+        for name, bit in self.flag_bits.items():
+            self.flag_bitmaps[name] = long(''.join([
+                    flags & bit and '1' or '0'
+                    for flags in reversed(self.flags)]) or '0', 2)
+            self.null_flag_bitmaps[name] = long(''.join([
+                    null_flags & bit and '1' or '0'
+                    for null_flags in reversed(self.null_flags)]) or
+                    '0', 2)
+
+        # Basic searches find the relays whose values start with a
+        # term in one sorted list of every searched value.
+        keys = []
+        for name in SEARCH_FIELDS:
+            keys.extend([(value.lower(), position) for position, value
+                         in enumerate(self.columns[name])])
+        keys.sort()
+        self.prefix_keys = [key for key, position in keys]
+        self.prefix_positions = array('l', [position for key, position
+                                            in keys])
+
+    def value(self, index, name):
+        """
+        Get the value of a field of a relay, as it would be found on an
+        L{ActiveRelay}.
+
+        @type index: C{int}
+        @param index: The position of the relay in the snapshot.
+        @type name: C{string}
+        @param name: The name of the field.
+        @rtype: C{object}
+        @return: The value of the field, or C{None} if it is NULL.
+        """
+        if name in self.flag_bits:
+            bit = self.flag_bits[name]
+            if self.null_flags[index] & bit:
+                return None
+            return bool(self.flags[index] & bit)
+        elif name == 'validafter':
+            return self.validafter
+        elif name in self.int_columns:
+            value = self.columns[name][index]
+            if value == self.NULL_INT:
+                return None
+            return value
+        elif name in self.columns:
+            value = self.columns[name][index]
+            if isinstance(value, tuple):
+                return list(value)
+            return value
+        raise AttributeError(name)
+
+    def flag_bitmap(self, name, value):
+        """
+        Get the bitmap of the relays that match a flag lookup.
+
+        @type name: C{string}
+        @param name: The name of the flag.
+        @param value: A true value for the relays with the flag set, a
+            false value for the relays with the flag not set. As in
+            the database, relays for which the flag is NULL match
+            neither.
+        @rtype: C{long}
+        @return: The bitmap of the matching relays.
+        """
+        if value:
+            return self.flag_bitmaps[name]
+        return self.everything & ~(self.flag_bitmaps[name] |
+                                   self.null_flag_bitmaps[name])
+
+    def starting_with(self, term):
+        """
+        Find the relays with a nickname, fingerprint or IP address
+        that starts with a term, regardless of case.
+
+        @type term: C{string}
+        @param term: The term to search for.
+        @rtype: C{list} of C{int}
+        @return: The positions of the matching relays, in order.
+        """
+        term = term.lower()
+        keys = self.prefix_keys
+        positions = self.prefix_positions
+        found = set()
+        start = bisect_left(keys, term)
+        for position in xrange(start, len(keys)):
+            if not keys[position].startswith(term):
+                break
+            found.add(positions[position])
+        return sorted(found)
+
+    def all(self):
+        """
+        Get all of the relays in the snapshot.
+
+        @rtype: L{RelaySet}
+        @return: All of the relays, ordered by fingerprint.
+        """
+        return RelaySet(self, range(self.size))
+
+    def at_address(self, address):
+        """
+        Get the relays at an IP address.
+
+        @type address: C{int}
+        @param address: The value of the IP address, as given by
+            L{address_value}.
+        @rtype: L{RelaySet}
+        @return: The relays at the address, ordered by fingerprint.
+        """
+        return RelaySet(self, self.address_positions.get(address, []))
+
+
+class SnapshotRelay(object):
+    """
+    A read-only relay in a L{Snapshot}, with the same attributes as
+    an L{ActiveRelay}.
+    """
+    __slots__ = ('snapshot', 'index')
+
+    def __init__(self, snapshot, index):
+        self.snapshot = snapshot
+        self.index = index
+
+    def __getattr__(self, name):
+        return self.snapshot.value(self.index, name)
+
+    def __unicode__(self):
+        return self.fingerprint
+
+
+class RelaySet(object):
+    """
+    An ordered subset of the relays in a L{Snapshot}.
+
+    Relay sets are never modified; filtering or ordering a relay set
+    returns a new one. Iterating over or indexing a relay set gives
+    L{SnapshotRelay}s, so a relay set can be paginated like a
+    C{QuerySet}.
+
+    @type order: C{string}
+    @ivar order: The field that the relays are ordered by, as given
+        to L{order_by}, or C{None} if they are ordered by fingerprint.
+    """
+
+    def __init__(self, snapshot, indices, order=None):
+        """
+        @type snapshot: L{Snapshot}
+        @param snapshot: The snapshot that the relays are in.
+        @type indices: C{list} of C{int}
+        @param indices: The positions of the relays in the snapshot,
+            in order.
+        @type order: C{string}
+        @param order: The field that the relays are ordered by.
+        """
+        self.snapshot = snapshot
+        self.indices = indices
+        self.order = order
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __iter__(self):
+        snapshot = self.snapshot
+        for index in self.indices:
+            yield SnapshotRelay(snapshot, index)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [SnapshotRelay(self.snapshot, index)
+                    for index in self.indices[key]]
+        return SnapshotRelay(self.snapshot, self.indices[key])
+
+    def count(self):
+        """
+        @rtype: C{int}
+        @return: The number of relays in the set.
+        """
+        return len(self.indices)
+
+    def values(self, name):
+        """
+        Get the values of a field for each relay in the set.
+
+        @type name: C{string}
+        @param name: The name of the field.
+        @rtype: C{list}
+        @return: The value of the field of each relay, in order.
+        """
+        value = self.snapshot.value
+        return [value(index, name) for index in self.indices]
+
+    def filter(self, **lookups):
+        """
+        Get the relays in the set that match every one of the given
+        lookups.
+
+        Lookups are given as they would be to C{QuerySet.filter}, for
+        the field lookups in C{config.CRITERIA}, e.g. C{isexit=1} or
+        C{nickname__istartswith='moria'}. As in the database, a NULL
+        value never matches.
+
+        Flag lookups are combined as bitmaps before any other lookup
+        is tested relay by relay.
+
+        @rtype: L{RelaySet}
+        @return: The relays that match all of the lookups, in the same
+            order as in this set.
+        @raise FieldError: If there is no such field or criteria.
+        """
+        snapshot = self.snapshot
+        bitmap = snapshot.everything
+        tests = []
+        for key, value in lookups.items():
+            if '__' in key:
+                name, criteria = key.split('__', 1)
+            else:
+                name, criteria = key, 'exact'
+            if name in snapshot.flag_bits:
+                if criteria != 'exact':
+                    raise FieldError("Unsupported lookup '%s' for flag "
+                                     "'%s'." % (criteria, name))
+                bitmap &= snapshot.flag_bitmap(name, value)
+            else:
+                tests.append(self._compile_lookup(name, criteria,
+                                                  value))
+
+        indices = self.indices
+        if bitmap != snapshot.everything:
+            # The bits of the bitmap, least significant first, with an
+            # extra bit set so that there is one for every relay.
+            bits = bin(bitmap | (1L << snapshot.size))[:1:-1]
+            if self.order is None and len(indices) == snapshot.size:
+                # All of the relays, in the order of the snapshot.
+                indices = [index for index, bit
+                           in enumerate(bits[:-1]) if bit == '1']
+            else:
+                indices = [index for index in indices
+                           if bits[index] == '1']
+        for test in tests:
+            indices = [index for index in indices if test(index)]
+        return RelaySet(snapshot, indices, self.order)
+
+    def search(self, term):
+        """
+        Get the relays in the set whose nickname, fingerprint or IP
+        address start with a term, regardless of case.
+
+        @type term: C{string}
+        @param term: The term to search for.
+        @rtype: L{RelaySet}
+        @return: The relays that match the term, in the same order as
+            in this set.
+        """
+        found = self.snapshot.starting_with(term)
+        if self.order is None and len(self.indices) == \
+                self.snapshot.size:
+            # All of the relays, in the order of the snapshot.
+            return RelaySet(self.snapshot, found, self.order)
+        found = set(found)
+        return RelaySet(self.snapshot, [index for index in self.indices
+                                        if index in found], self.order)
+
+    def order_by(self, order):
+        """
+        Order the relays in the set by a field.
+
+        Relays with equal values are ordered by fingerprint, so that
+        every relay has a distinct position in the order. As in the
+        database, NULL values are ordered last in ascending order and
+        first in descending order.
+
+        @type order: C{string}
+        @param order: The name of the field, prefixed with a '-' for
+            descending order, as it would be given to
+            C{QuerySet.order_by}.
+        @rtype: L{RelaySet}
+        @return: The relays in this set, ordered.
+        @raise FieldError: If there is no such field.
+        """
+        self._check_field(order.lstrip('-'))
+
+        # The snapshot is ordered by fingerprint, so start from that
+        # order and rely on sorting being stable to break ties.
+        indices = sorted(self.indices)
+        indices.sort(key=self._compile_sort_key(order.lstrip('-')))
+        if order.startswith('-'):
+            indices.reverse()
+        return RelaySet(self.snapshot, indices, order)
+
+    def sort_key(self, relay):
+        """
+        Get the key that a relay in the set is ordered by.
+
+        @type relay: L{SnapshotRelay}
+        @param relay: A relay in the set.
+        @rtype: C{tuple}
+        @return: The key of the relay, as taken by L{seek}.
+        """
+        name = (self.order or 'fingerprint').lstrip('-')
+        return self._compile_sort_key(name)(relay.index)
+
+    def seek(self, key, after):
+        """
+        Find the position in the set at which a key would be, using a
+        binary search over the ordered relays.
+
+        @type key: C{tuple}
+        @param key: A key, as returned by L{sort_key}. The relay that
+            the key was taken from need not be in the set any more.
+        @type after: C{bool}
+        @param after: C{True} to find the position of the first relay
+            that is ordered after the key, C{False} to find the
+            position of the first relay that is ordered at or after
+            the key.
+        @rtype: C{int}
+        @return: The position, between 0 and the size of the set.
+        """
+        name = (self.order or 'fingerprint').lstrip('-')
+        sort_key = self._compile_sort_key(name)
+        indices = self.indices
+        descending = bool(self.order) and self.order.startswith('-')
+
+        low, high = 0, len(indices)
+        while low < high:
+            middle = (low + high) // 2
+            comparison = cmp(sort_key(indices[middle]), key)
+            if descending:
+                comparison = -comparison
+            if comparison < 0 or (after and comparison == 0):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _compile_sort_key(self, name):
+        """
+        Compile a function that maps the position of a relay in the
+        snapshot to the key it is ordered by for a field.
+
+        @type name: C{string}
+        @param name: The name of the field.
+        @rtype: C{function}
+        @return: A function mapping the position of a relay to a tuple
+            of whether its value is NULL, its value, and its
+            fingerprint. Text values are folded to lowercase, so that
+            they are ordered regardless of case, as by the collation
+            of the database.
+        """
+        value = self.snapshot.value
+        fingerprints = self.snapshot.columns['fingerprint']
+
+        def sort_key(index):
+            field_value = value(index, name)
+            if isinstance(field_value, basestring):
+                field_value = field_value.lower()
+            return (field_value is None, field_value,
+                    fingerprints[index])
+
+        return sort_key
+
+    def _check_field(self, name):
+        """
+        Raise a L{FieldError} if a relay has no field with a name.
+        """
+        snapshot = self.snapshot
+        if name not in snapshot.flag_bits and \
+                name not in snapshot.columns and name != 'validafter':
+            raise FieldError("Cannot resolve keyword '%s' into field."
+                             % name)
+
+    def _compile_lookup(self, name, criteria, value):
+        """
+        Compile a field lookup into a function that tests whether the
+        relay at a position in the snapshot matches it.
+
+        @type name: C{string}
+        @param name: The name of the field.
+        @type criteria: C{string}
+        @param criteria: The lookup criteria, one of
+            C{config.CRITERIA}.
+        @param value: The value to look up, as given by the client.
+        @rtype: C{function}
+        @return: A function mapping the position of a relay to C{True}
+            if the relay matches the lookup, C{False} otherwise.
+        @raise FieldError: If there is no such field or criteria.
+        """
+        self._check_field(name)
+        snapshot = self.snapshot
+        get_value = snapshot.value
+
+        # Exact matches and comparisons are made against the value as
+        # the database would interpret it for the field; all other
+        # lookups match against the value as text.
+        if criteria in ('exact', 'lt', 'gt'):
+            try:
+                field = _get_field(name)
+                value = field.to_python(value)
+            except ValidationError:
+                return lambda index: False
+            if criteria == 'exact':
+                return lambda index: get_value(index, name) == value
+            elif criteria == 'lt':
+                return lambda index: _not_null_and(
+                        get_value(index, name), lambda v: v < value)
+            return lambda index: _not_null_and(
+                    get_value(index, name), lambda v: v > value)
+
+        value = unicode(value)
+        if criteria.startswith('i'):
+            value = value.lower()
+
+        def text(index):
+            field_value = get_value(index, name)
+            if field_value is None:
+                return None
+            if criteria.startswith('i'):
+                return unicode(field_value).lower()
+            return unicode(field_value)
+
+        if criteria == 'iexact':
+            return lambda index: text(index) == value
+        elif criteria in ('contains', 'icontains'):
+            return lambda index: _not_null_and(text(index),
+                                               lambda v: value in v)
+        elif criteria in ('startswith', 'istartswith'):
+            return lambda index: _not_null_and(text(index),
+                    lambda v: v.startswith(value))
+        raise FieldError("Unsupported lookup '%s' for field '%s'."
+                         % (criteria, name))
+
+
+def _get_field(name):
+    """
+    Get a field of a relay, which is either a field of L{ActiveRelay}
+    or the hostname of its IP address.
+
+    @type name: C{string}
+    @param name: The name of the field.
+    @rtype: C{Field}
+    @return: The field.
+    """
+    try:
+        return ActiveRelay._meta.get_field(name)
+    except FieldDoesNotExist:
+        return Hostname._meta.get_field(name)
+
+
+def _not_null_and(value, test):
+    """
+    Test a value, treating NULL as not matching.
+
+    @param value: The value to test.
+    @type test: C{function}
+    @param test: The test to apply to the value if it is not NULL.
+    @rtype: C{bool}
+    @return: C{False} if the value is C{None}, the result of the test
+        otherwise.
+    """
+    return value is not None and bool(test(value))
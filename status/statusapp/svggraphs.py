@@ -0,0 +1,305 @@
+"""
+Graphs written as SVG images directly from their data points.
+
+The bar graphs of the network statistics and the line graphs of the
+bandwidth history of relays are simple enough that they do not need
+matplotlib: their bars, lines, ticks and labels are written out as a
+few SVG elements each, which takes a fraction of the time of drawing a
+PNG and makes an image a fraction of the size. The layout follows the
+PNG graphs, with the same sizes, margins, colors and labels.
+"""
+# General python import statements ------------------------------------
+import datetime
+import math
+from xml.sax.saxutils import escape, quoteattr
+
+# INIT Variables ------------------------------------------------------
+# The size and margins, in pixels, of each bandwidth history graph.
+__LINE_WIDTH = 480
+__LINE_HEIGHT = 320
+__LINE_TOP_MARGIN = 42
+__LINE_BOTTOM_MARGIN = 32
+__LINE_LEFT_MARGIN = 98
+__LINE_RIGHT_MARGIN = 5
+
+# The length of tick marks, in pixels.
+__TICK = 4
+
+
+def bar_graph(xs, ys, labels, params):
+    """
+    Write a bar graph as an SVG image.
+
+    @type xs: C{list}
+    @param xs: The x values to be plotted.
+    @type ys: C{list}
+    @param ys: The y values to be plotted.
+    @type labels: C{list} of C{string}
+    @param labels: The labels to be used for each data point.
+    @type params: C{dict} of C{string} and C{int}
+    @param params: Parameters specifying how the graph is to be drawn,
+        as given to C{graphs.draw_bar_graph}.
+    @rtype: C{string}
+    @return: The graph, as an SVG image encoded in UTF-8.
+    """
+    width = params['WIDTH']
+    height = params['HEIGHT']
+    left = params['LEFT_MARGIN']
+    top = params['TOP_MARGIN']
+    plot_width = width - left - params['RIGHT_MARGIN']
+    plot_height = height - top - params['BOTTOM_MARGIN']
+    bottom = top + plot_height
+    bar_width = params['BAR_WIDTH']
+
+    # The x axis spans the bars, as in the PNG graphs.
+    if xs:
+        x_low = min(xs)
+        x_high = max(xs) + bar_width
+    else:
+        x_low, x_high = 0, 1
+    x_scale = float(plot_width) / (x_high - x_low)
+    ticks = _ticks(max(ys or [0]))
+    y_scale = float(plot_height) / ticks[-1]
+
+    out = [_header(width, height)]
+
+    # Every bar is drawn by one path.
+    bar = _number(bar_width * x_scale)
+    bars = []
+    for x, y in zip(xs, ys):
+        bars.append('M%s %sh%sv%sh-%sz'
+                    % (_number(left + (x - x_low) * x_scale),
+                       _number(bottom), bar, _number(-y * y_scale),
+                       bar))
+    out.append('<path fill=%s d="%s"/>' % (quoteattr(params['COLOR']),
+                                          ''.join(bars)))
+
+    # The height of each bar, above it.
+    out.append('<g font-size="%s" text-anchor="middle">'
+               % params['LABEL_FONT_SIZE'])
+    for x, y in zip(xs, ys):
+        out.append(_text(left + (x - x_low + bar_width / 2.0) * x_scale,
+                         bottom - y * y_scale - params['LABEL_FLOAT'],
+                         str(y)))
+    out.append('</g>')
+
+    # The label of each bar, below it.
+    vertical = params['LABEL_ROT'] == 'vertical'
+    out.append('<g font-size="%s" font-weight=%s text-anchor="%s">'
+               % (params['X_FONT_SIZE'],
+                  quoteattr(params['FONT_WEIGHT']),
+                  vertical and 'end' or 'middle'))
+    font_size = float(params['X_FONT_SIZE'])
+    marks = []
+    for x, label in zip(xs, labels):
+        center = left + (x - x_low + bar_width / 2.0) * x_scale
+        marks.append(_x_tick(center, bottom))
+        if vertical:
+            out.append(_text(center, bottom + __TICK, label,
+                             rotate=True))
+        else:
+            out.append(_text(center, bottom + __TICK + font_size,
+                             label))
+    out.append('<path stroke="#000" d="%s"/></g>' % ''.join(marks))
+
+    out.append(_y_axis(left, bottom, y_scale, ticks,
+                       params['Y_FONT_SIZE'], params['FONT_WEIGHT']))
+    out.append(_frame(left, top, plot_width, plot_height))
+    out.append('<text x="%s" y="%s" font-size="12" font-weight=%s '
+               'text-anchor="middle">%s</text>'
+               % (_number(left + plot_width / 2.0), _number(top - 6),
+                  quoteattr(params['FONT_WEIGHT']),
+                  escape(params['TITLE'])))
+    out.append('</svg>')
+    return u''.join(out).encode('utf-8')
+
+
+def line_graphs(panels):
+    """
+    Write line graphs of bandwidth history side by side as an SVG
+    image, each of the same size and with the same margins as a graph
+    on its own.
+
+    @type panels: C{list} of C{tuple}
+    @param panels: The type of bandwidth, the color to draw the line
+        graph with, the color to shade under it, the time of the first
+        data point and the 96 data points, the bytes transferred in
+        each fifteen minutes, of each graph from left to right.
+    @rtype: C{string}
+    @return: The graphs, as an SVG image encoded in UTF-8.
+    """
+    plot_width = __LINE_WIDTH - __LINE_LEFT_MARGIN - __LINE_RIGHT_MARGIN
+    plot_height = __LINE_HEIGHT - __LINE_TOP_MARGIN - \
+                  __LINE_BOTTOM_MARGIN
+    bottom = __LINE_TOP_MARGIN + plot_height
+
+    # The x axis spans the 96 data points and the tick after them.
+    x_scale = plot_width / 96.0
+
+    out = [_header(__LINE_WIDTH * len(panels), __LINE_HEIGHT)]
+    for number, (bwtype, color, shade, start_time, tr_list) in \
+            enumerate(panels):
+        left = number * __LINE_WIDTH + __LINE_LEFT_MARGIN
+        center = left + plot_width / 2.0
+
+        # Return bytes per second, not total bandwidth for 15 minutes
+        bps = [value / (15 * 60) for value in tr_list]
+        ticks = _ticks(max(bps or [0]))
+        y_scale = float(plot_height) / ticks[-1]
+
+        points = ' '.join(['%s,%s' % (_number(left + x * x_scale),
+                                      _number(bottom - y * y_scale))
+                           for x, y in enumerate(bps)])
+        out.append('<polygon fill=%s points="%s,%s %s %s,%s"/>'
+                   % (quoteattr(shade), _number(left), _number(bottom),
+                      points,
+                      _number(left + (len(bps) - 1) * x_scale),
+                      _number(bottom)))
+        out.append('<polyline fill="none" stroke=%s points="%s"/>'
+                   % (quoteattr(color), points))
+
+        out.append('<g font-size="8" font-weight="bold" '
+                   'text-anchor="middle">')
+        marks = []
+        for i in range(0, 104, 8):
+            time = start_time + datetime.timedelta(minutes=(15 * i))
+            marks.append(_x_tick(left + i * x_scale, bottom))
+            out.append(_text(left + i * x_scale, bottom + __TICK + 8,
+                             '%02d:%02d' % (time.hour, time.minute)))
+        out.append('<path stroke="#000" d="%s"/></g>' % ''.join(marks))
+
+        out.append(_y_axis(left, bottom, y_scale, ticks, 8, 'bold'))
+        out.append(_frame(left, __LINE_TOP_MARGIN, plot_width,
+                          plot_height))
+
+        end_time = start_time + datetime.timedelta(
+                   days=1) - datetime.timedelta(minutes=15)
+        out.append('<g font-size="12" text-anchor="middle">')
+        out.append(_text(center, __LINE_HEIGHT - 4, 'Time (GMT)'))
+        out.append(_text(left - __LINE_LEFT_MARGIN + 14,
+                         __LINE_TOP_MARGIN + plot_height / 2.0,
+                         'Bandwidth (bytes/sec)', rotate=True))
+        out.append('<g font-weight="bold">')
+        out.append(_text(center, __LINE_TOP_MARGIN - 22,
+                         'Average Bandwidth %s History:' % bwtype))
+        out.append(_text(center, __LINE_TOP_MARGIN - 7, '%s to %s' % (
+                         start_time.strftime('%Y-%m-%d %H:%M'),
+                         end_time.strftime('%Y-%m-%d %H:%M'))))
+        out.append('</g></g>')
+    out.append('</svg>')
+    return u''.join(out).encode('utf-8')
+
+
+def _header(width, height):
+    """
+    Get the start of an SVG image, with a white background.
+    """
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="%d" '
+            'height="%d" font-family="sans-serif">'
+            '<rect width="100%%" height="100%%" fill="#fff"/>'
+            % (width, height))
+
+
+def _y_axis(left, bottom, y_scale, ticks, font_size, font_weight):
+    """
+    Get the ticks and tick labels of a y axis.
+
+    @type left: C{float}
+    @param left: The x coordinate of the axis.
+    @type bottom: C{float}
+    @param bottom: The y coordinate of the lowest tick.
+    @type y_scale: C{float}
+    @param y_scale: The number of pixels per unit on the axis.
+    @type ticks: C{list}
+    @param ticks: The values of the ticks, as given by L{_ticks}.
+    @rtype: C{string}
+    @return: The SVG elements of the axis.
+    """
+    out = ['<g font-size="%s" font-weight=%s text-anchor="end">'
+           % (font_size, quoteattr(font_weight))]
+    marks = []
+    for tick in ticks:
+        y = bottom - tick * y_scale
+        marks.append('M%s %sh%s' % (_number(left), _number(y), __TICK))
+        out.append(_text(left - __TICK, y + float(font_size) / 3,
+                         _number(tick, 2)))
+    out.append('<path stroke="#000" d="%s"/></g>' % ''.join(marks))
+    return ''.join(out)
+
+
+def _x_tick(x, bottom):
+    """
+    Get the path data of a tick mark on an x axis.
+    """
+    return 'M%s %sv-%s' % (_number(x), _number(bottom), __TICK)
+
+
+def _frame(left, top, width, height):
+    """
+    Get the frame around a plot.
+    """
+    return ('<rect x="%s" y="%s" width="%s" height="%s" fill="none" '
+            'stroke="#000"/>' % (_number(left), _number(top),
+                                 _number(width), _number(height)))
+
+
+def _text(x, y, text, rotate=False):
+    """
+    Get a text element, optionally reading upwards.
+
+    @type x: C{float}
+    @param x: The x coordinate of the anchor of the text.
+    @type y: C{float}
+    @param y: The y coordinate of the baseline of the text, or, if it
+        is rotated, of its anchor.
+    @param text: The text, or a value to write as text.
+    @type rotate: C{bool}
+    @param rotate: Whether to turn the text a quarter counterclockwise
+        about its anchor, centering it on the anchor across its
+        baseline.
+    @rtype: C{string}
+    @return: The SVG element.
+    """
+    x = _number(x)
+    y = _number(y)
+    text = escape(u'%s' % text)
+    if rotate:
+        return ('<text x="%s" y="%s" dy=".35em" '
+                'transform="rotate(-90 %s %s)">%s</text>'
+                % (x, y, x, y, text))
+    return '<text x="%s" y="%s">%s</text>' % (x, y, text)
+
+
+def _ticks(high, count=6):
+    """
+    Choose round values for the ticks of an axis that starts at zero.
+
+    @type high: C{float}
+    @param high: The highest value that the axis has to show.
+    @type count: C{int}
+    @param count: The largest number of intervals between ticks.
+    @rtype: C{list} of C{float}
+    @return: The values of the ticks, from zero up to the first tick
+        at or above the highest value, at a step of 1, 2, 2.5 or 5
+        times a power of ten.
+    """
+    if high <= 0:
+        return [0, 1]
+    least = float(high) / count
+    magnitude = 10 ** math.floor(math.log10(least))
+    for multiple in (1, 2, 2.5, 5, 10):
+        step = multiple * magnitude
+        if step >= least:
+            break
+    intervals = int(math.ceil(high / step - 1e-9))
+    return [i * step for i in range(intervals + 1)]
+
+
+def _number(value, places=1):
+    """
+    Format a number without trailing zeros, e.g. C{12.5} or C{40}.
+    """
+    text = ('%.*f' % (places, value)).rstrip('0').rstrip('.')
+    if text == '-0':
+        return '0'
+    return text
@@ -6,10 +6,9 @@ import datetime
 
 # Django-specific import statements -----------------------------------
 from django import template
-from django.db.models import Max, Count
 
 # TorStatus-specific import statements --------------------------------
-from statusapp.models import Statusentry, ActiveRelay
+from statusapp import families
 
 register = template.Library()
 
@@ -81,53 +80,16 @@ def format_family(family):
     else:
         family_list = []
 
+    # The whole family is resolved at once, without a query per
+    # member.
     if family_list:
         links = []
-
-        for entry in family_list:
-            # Assume the entry is a fingerprint.
-            if (entry[0] == "$" and len(entry[1:]) == 40):
-
-                fingerprint = entry[1:].lower()
-                poss_entries = ActiveRelay.objects.filter(
-                               fingerprint=fingerprint).order_by(
-                               '-validafter')
-
-                # Fingerprints are unique, so either an entry with the
-                # fingerprint is found or not. Use only the most
-                # recent entry.
-                if poss_entries:
-                    nickname = poss_entries[0].nickname
-                    links.append("<a href=\"/details/%s\">%s</a>" % \
-                            (fingerprint, nickname))
-
-                else:
-                    links.append("(%s)" % entry)
-
-            # Assume the entry is a nickname.
+        for fingerprint, nickname in families.resolve(family_list):
+            if fingerprint is None:
+                links.append("(%s)" % nickname)
             else:
-                poss_entries = ActiveRelay.objects.filter(
-                               nickname=entry)
-                poss_fingerprints = poss_entries.values(
-                                    'fingerprint').annotate(
-                                    Count('fingerprint'))
-
-                # Can't find a fingerprint, so just return the
-                # nickname.
-                if not poss_fingerprints:
-                    links.append('(%s)' % entry)
-
-                # Found a unique fingerprint, so return the nickname
-                # with a hyperlink.
-                elif (len(poss_fingerprints) == 1):
-                    fingerprint = poss_fingerprints[0]['fingerprint']
-                    links.append("<a href=\"/details/%s\">%s</a>" % \
-                                (fingerprint, entry))
-
-                # Multiple fingerprints match the nickname. There is
-                # nothing to do except return the nickname.
-                else:
-                    links.append("(%s)" % entry)
+                links.append("<a href=\"/details/%s\">%s</a>" % \
+                        (fingerprint, nickname))
 
         return '\n'.join(links)
 
@@ -2,9 +2,35 @@
 The test module. To run tests, change directory to status and run
 'python manage.py test statusapp'.
 """
+import datetime
+import imp
+import itertools
+import os
+import shutil
+import socket
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+from xml.dom.minidom import parseString
+
 import django.test
+from django.http import HttpResponse, QueryDict
+from statusapp import consensus, hostnames, renderpool, svggraphs, \
+        whoisclient
+from statusapp.diskcache import DiskCache
+from statusapp.exitpolicies import ExitPolicies
+from statusapp.families import RelayNames
+from statusapp.lrucache import LRUCache
+from statusapp.netstats import NetworkStatistics
 from statusapp.views.helpers import is_ip_in_subnet, is_ipaddress, \
         is_port
+from statusapp.views.pagination import paginate
+from statusapp.views.relaytable import render_rows, stream_rows
+from statusapp.views import graphs, relaytable, viewstate
+from statusapp.snapshot import FIELDS, Snapshot, address_value, \
+        signature
 
 
 class IpInSubnetTest(django.test.TestCase):
@@ -72,3 +98,1096 @@ class PortTest(django.test.TestCase):
         self.assertEqual(is_port('-1'), False)
         self.assertEqual(is_port('65535'), True)
         self.assertEqual(is_port('65536'), False)
+
+
+class RelayTableTest(django.test.TestCase):
+    """
+    Test the render_rows and stream_rows functions.
+    """
+
+    relay = {'country': 'de', 'latitude': None, 'longitude': None,
+             'nickname': 'moria<1>', 'bandwidthkbps': '20 KB/s',
+             'address': '128.31.0.34', 'hibernating': 0,
+             'isbadexit': 1, 'isnamed': 1, 'isexit': 1, 'isfast': 0,
+             'platform': None, 'fingerprint': 'a' * 40}
+
+    def test_row(self):
+        """
+        Test that the row of a relay is classed and escaped as it was
+        by the template.
+        """
+        self.assertEqual(render_rows([self.relay],
+                ['Router Name', 'Bad Exit']),
+                '<tr  class="relayBadExit" ><td id="col_relayName">'
+                '<a class="linkDetails" href="/details/' + 'a' * 40 +
+                '" target="_BLANK">moria&lt;1&gt;</a></td>'
+                '<td id="col_relayBadExit"><img src="/static/img/'
+                'bg_yes.png" width="12" height="12" alt="Bad Exit" '
+                'title="Bad Exit"></tr>')
+
+    def test_layouts(self):
+        """
+        Test that only the renderers of a bounded number of column
+        layouts are kept.
+        """
+        renderers = getattr(relaytable, '__RENDERERS')
+        columns = ['Router Name', 'Bad Exit', 'Bandwidth', 'Uptime',
+                   'Hostname', 'ORPort']
+        for layout in itertools.permutations(columns):
+            relaytable.compile_row_renderer(layout)
+        self.assertTrue(len(renderers) <= renderers.max_size < 720)
+
+    def test_cells(self):
+        """
+        Test that flags are only displayed as icons and that values
+        are followed by the whitespace the template left behind.
+        """
+        self.assertEqual(render_rows([self.relay],
+                ['Bandwidth', 'Icons', 'Exit', 'Fast', 'Platform']),
+                '<tr class="relay"><td id="col_relayBandwidth">20 KB/s'
+                '\n            \n            </td><td id="col_relayIcons">'
+                '<img src="/static/img/status/Exit.png" alt="Exit" '
+                'title="Exit"><img src="/static/img/os-icons/'
+                'NotAvailable.png" alt="NotAvailable" title="Platform '
+                'Not Available"></td></td></td></td></tr>')
+
+    def test_stream(self):
+        """
+        Test that streamed chunks of rows are rendered just as the
+        rows would be rendered all at once.
+        """
+        columns = ['Router Name', 'IP', 'Bad Exit']
+        chunks = list(stream_rows([[self.relay], [], [self.relay]],
+                                  columns))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(chunks[1], '')
+        self.assertEqual(''.join(chunks),
+                         render_rows([self.relay] * 2, columns))
+
+
+class SnapshotTest(django.test.TestCase):
+    """
+    Test filtering and ordering the relays in a Snapshot.
+    """
+
+    def setUp(self):
+        relays = [{'fingerprint': 'a' * 40, 'nickname': 'moria1',
+                   'address': '128.31.0.34', 'orport': 9101,
+                   'isexit': False, 'ishibernating': None,
+                   'bandwidthkbps': None, 'exitpolicy': ['reject *:*']},
+                  {'fingerprint': 'b' * 40, 'nickname': 'Tonga',
+                   'address': '82.94.251.203', 'orport': 443,
+                   'isexit': True, 'ishibernating': False,
+                   'bandwidthkbps': 20, 'exitpolicy': ['reject *:*']},
+                  {'fingerprint': 'c' * 40, 'nickname': 'dizum',
+                   'address': '194.109.206.212', 'orport': 443,
+                   'isexit': True, 'ishibernating': True,
+                   'bandwidthkbps': 10, 'exitpolicy': ['accept *:*']}]
+        rows = [tuple([relay.get(name) for name in FIELDS])
+                for relay in relays]
+        self.relays = Snapshot(None, rows, {
+                '128.31.0.34': 'moria.csail.mit.edu'}).all()
+
+    def nicknames(self, relays):
+        return [relay.nickname for relay in relays]
+
+    def test_values(self):
+        """
+        Test that relays have the same values as ActiveRelays would.
+        """
+        relay = self.relays[0]
+        self.assertEqual(relay.orport, 9101)
+        self.assertEqual(relay.isexit, False)
+        self.assertEqual(relay.ishibernating, None)
+        self.assertEqual(relay.bandwidthkbps, None)
+        self.assertEqual(relay.exitpolicy, ['reject *:*'])
+
+    def test_filter(self):
+        """
+        Test that flags, field lookups and basic searches are matched
+        as in the database, with NULL values never matching.
+        """
+        self.assertEqual(self.nicknames(self.relays.filter(isexit=1)),
+                         ['Tonga', 'dizum'])
+        self.assertEqual(self.nicknames(self.relays.filter(
+                         ishibernating=0)), ['Tonga'])
+        self.assertEqual(self.nicknames(self.relays.filter(
+                         orport__exact='443', nickname__icontains='ON')),
+                         ['Tonga'])
+        self.assertEqual(self.nicknames(self.relays.filter(
+                         bandwidthkbps__lt='15')), ['dizum'])
+        self.assertEqual(self.nicknames(self.relays.filter(
+                         orport__gt='port')), [])
+        self.assertEqual(self.nicknames(self.relays.search('MOR')),
+                         ['moria1'])
+        self.assertEqual(self.nicknames(self.relays.search('19')),
+                         ['dizum'])
+        self.assertEqual(self.nicknames(self.relays.search('C')),
+                         ['dizum'])
+        self.assertEqual(self.nicknames(self.relays.order_by(
+                         '-nickname').search('')),
+                         ['Tonga', 'moria1', 'dizum'])
+        self.assertEqual(self.nicknames(self.relays.search('tongaa')),
+                         [])
+
+    def test_hostname(self):
+        """
+        Test that relays have the hostname of their IP address, which
+        can be searched and ordered by like any other field.
+        """
+        self.assertEqual(self.relays[0].hostname, 'moria.csail.mit.edu')
+        self.assertEqual(self.relays[1].hostname, None)
+        self.assertEqual(self.nicknames(self.relays.filter(
+                         hostname__icontains='MIT.edu')), ['moria1'])
+        self.assertEqual(self.nicknames(self.relays.filter(
+                         hostname__iexact='moria.csail.mit.edu')),
+                         ['moria1'])
+        self.assertEqual(self.nicknames(self.relays.order_by(
+                         'hostname')), ['moria1', 'Tonga', 'dizum'])
+
+    def test_at_address(self):
+        """
+        Test that relays are found by the value of their IP address.
+        """
+        snapshot = self.relays.snapshot
+        self.assertEqual(address_value('82.94.251.203'), 1381956555)
+        self.assertEqual(self.nicknames(snapshot.at_address(
+                         address_value('082.94.251.203'))), ['Tonga'])
+        self.assertEqual(self.nicknames(snapshot.at_address(
+                         address_value('82.94.251.204'))), [])
+        self.assertRaises(ValueError, address_value, '82.94.251')
+
+    def test_flag_bitmaps(self):
+        """
+        Test that combined flag lookups match the same relays, in the
+        same order, as flag lookups tested relay by relay would.
+        """
+        self.assertEqual(self.nicknames(self.relays.filter(isexit=1,
+                         ishibernating=0)), ['Tonga'])
+        self.assertEqual(self.nicknames(self.relays.filter(isexit=0)),
+                         ['moria1'])
+        self.assertEqual(self.nicknames(self.relays.order_by(
+                         '-nickname').filter(isexit=1,
+                         orport__exact='443')), ['Tonga', 'dizum'])
+        self.assertEqual(self.nicknames(self.relays.filter(isexit=1,
+                         ishibernating=1).filter(ishibernating=0)), [])
+
+    def test_order(self):
+        """
+        Test that NULL values are ordered last in ascending order and
+        that ties are ordered by fingerprint.
+        """
+        self.assertEqual(self.nicknames(self.relays.order_by(
+                         'bandwidthkbps')), ['dizum', 'Tonga', 'moria1'])
+        self.assertEqual(self.nicknames(self.relays.order_by(
+                         '-bandwidthkbps')), ['moria1', 'Tonga', 'dizum'])
+        self.assertEqual(self.nicknames(self.relays.order_by(
+                         'orport')), ['Tonga', 'dizum', 'moria1'])
+        self.assertEqual(self.nicknames(self.relays.order_by(
+                         '-orport')), ['moria1', 'dizum', 'Tonga'])
+
+    def test_paginate(self):
+        """
+        Test that cursors lead to the pages before and after a page,
+        even if the relay a cursor was taken from is gone.
+        """
+        relays = self.relays.order_by('-orport')
+        first = paginate(relays, 2, {})
+        self.assertEqual(self.nicknames(first.object_list),
+                         ['moria1', 'dizum'])
+        self.assertEqual((first.number, first.num_pages), (1, 2))
+        last = paginate(relays, 2, {'after': first.next_cursor})
+        self.assertEqual(self.nicknames(last.object_list), ['Tonga'])
+        self.assertEqual((last.number, last.has_next()), (2, False))
+        self.assertEqual(self.nicknames(paginate(relays, 2,
+                         {'before': last.previous_cursor}).object_list),
+                         ['moria1', 'dizum'])
+        gone = relays.filter(ishibernating=0)
+        self.assertEqual(self.nicknames(paginate(gone, 2,
+                         {'after': first.next_cursor}).object_list),
+                         ['Tonga'])
+        self.assertEqual(paginate(relays, 2, {'page': '7'}).number, 2)
+        self.assertEqual(paginate(relays, 2, {'after': 'x:y'}).number, 1)
+
+    def test_mismatched_cursor(self):
+        """
+        Test that a cursor with a value of a different type than the
+        sorted column is ignored.
+        """
+        relays = self.relays.order_by('-orport')
+        for value in ('d2011-10-20T00:00:00.000000', 'sfoo', 'b1'):
+            cursor = '-orport:%s:%s' % ('a' * 40, value)
+            self.assertEqual(self.nicknames(paginate(relays, 2,
+                             {'after': cursor}).object_list),
+                             ['moria1', 'dizum'])
+        self.assertEqual(paginate(relays, 2,
+                         {'after': '-orport:%s:i443' % ('c' * 40)}
+                         ).number, 2)
+
+    def test_signature(self):
+        """
+        Test that searches that always give the same result set have
+        the same signature.
+        """
+        self.assertEqual(signature('MOR', {}, 'nickname'),
+                         signature('mor', {'isexit': 1}, 'nickname'))
+        self.assertEqual(signature('', {'isexit': 1, 'isfast': 0},
+                                   '-orport'),
+                         signature('', {'isfast': 0, 'isexit': 1},
+                                   '-orport'))
+        self.assertNotEqual(signature('', {}, 'orport'),
+                            signature('', {}, '-orport'))
+
+
+class ConsensusTest(django.test.TestCase):
+    """
+    Test the per_consensus decorator.
+    """
+
+    def setUp(self):
+        self.token = consensus.token
+        self.version = '1-201110201200'
+        consensus.token = lambda: self.version
+
+    def tearDown(self):
+        consensus.token = self.token
+
+    def test_per_consensus(self):
+        """
+        Test that results are remembered until the version of the
+        ActiveRelay cache changes.
+        """
+        calls = []
+
+        @consensus.per_consensus
+        def square(number):
+            calls.append(number)
+            return number * number
+
+        self.assertEqual((square(3), square(3), square(4)), (9, 9, 16))
+        self.assertEqual(calls, [3, 4])
+        self.version = '2-201110201300'
+        self.assertEqual(square(3), 9)
+        self.assertEqual(calls, [3, 4, 3])
+
+    def test_single_flight(self):
+        """
+        Test that concurrent calls for the same arguments share one
+        computation, while calls for other arguments do not wait for it,
+        and that a computation that fails is tried again.
+        """
+        calls = []
+        started = threading.Event()
+        finish = threading.Event()
+        finished = threading.Event()
+
+        @consensus.per_consensus
+        def slow(number):
+            calls.append((number, finished.isSet()))
+            if number == 1:
+                started.set()
+                finish.wait(5)
+                finished.set()
+            if number < 0:
+                raise ValueError(number)
+            return number
+
+        results = []
+        threads = [threading.Thread(target=lambda:
+                                    results.append(slow(1)))
+                   for i in range(3)]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        self.assertEqual(slow(2), 2)
+        finish.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, [1, 1, 1])
+        self.assertEqual(calls, [(1, False), (2, False)])
+
+        self.assertRaises(ValueError, slow, -1)
+        self.assertRaises(ValueError, slow, -1)
+        self.assertEqual(len(calls), 4)
+
+    def test_conditional(self):
+        """
+        Test that clients with the response for the current version of
+        the ActiveRelay cache are sent a 304.
+        """
+        last_validafter = consensus.last_validafter
+        consensus.last_validafter = lambda: datetime.datetime(2011,
+                                                               10, 20)
+        try:
+            view = consensus.conditional(lambda request: HttpResponse())
+            response = view(_Request(QueryDict('')))
+            self.assertEqual(response['ETag'], '"1-201110201200"')
+            request = _Request(QueryDict(''),
+                               {'HTTP_IF_NONE_MATCH': response['ETag']})
+            self.assertEqual(view(request).status_code, 304)
+            self.version = '2-201110201300'
+            self.assertEqual(view(request).status_code, 200)
+        finally:
+            consensus.last_validafter = last_validafter
+
+    def test_max_results(self):
+        """
+        Test that the oldest result is forgotten once the most results
+        allowed are remembered.
+        """
+        calls = []
+
+        def square(number):
+            calls.append(number)
+            return number * number
+
+        square = consensus.per_consensus(square, 2)
+        self.assertEqual([square(n) for n in (3, 4, 3, 5, 4, 3)],
+                         [9, 16, 9, 25, 16, 9])
+        self.assertEqual(calls, [3, 4, 5, 3])
+
+
+class HostnamesTest(django.test.TestCase):
+    """
+    Test resolving hostnames in the background.
+    """
+
+    def setUp(self):
+        self.getfqdn = socket.getfqdn
+        socket.getfqdn = lambda address: {
+                '192.0.2.1': 'relay.example.org'}.get(address, address)
+
+    def tearDown(self):
+        socket.getfqdn = self.getfqdn
+
+    def test_hostname(self):
+        """
+        Test that the address itself is given until its hostname has
+        been resolved, and that addresses without a hostname are
+        remembered too.
+        """
+        self.assertEqual(hostnames.hostname('192.0.2.1'), '192.0.2.1')
+        hostnames.hostname('192.0.2.2')
+        for attempt in range(50):
+            if hostnames.is_resolved('192.0.2.1') and \
+                    hostnames.is_resolved('192.0.2.2'):
+                break
+            time.sleep(0.1)
+        self.assertEqual(hostnames.hostname('192.0.2.1'),
+                         'relay.example.org')
+        self.assertEqual(hostnames.hostname('192.0.2.2'), '192.0.2.2')
+        self.assertEqual(hostnames.is_resolved('192.0.2.2'), True)
+
+    def test_resolve_all(self):
+        """
+        Test that many addresses are resolved at once, with None for
+        those that have no hostname.
+        """
+        self.assertEqual(hostnames.resolve_all(
+                         ['192.0.2.1', '192.0.2.2', '192.0.2.1'],
+                         workers=2),
+                         {'192.0.2.1': 'relay.example.org',
+                          '192.0.2.2': None})
+        self.assertEqual(hostnames.resolve_all([]), {})
+
+    def test_max_lookups(self):
+        """
+        Test that an address is not resolved while too many lookups are
+        still running, and that a lookup that has timed out still holds
+        its place until it finishes.
+        """
+        lookups = getattr(hostnames, '__LOOKUPS')
+        timeout = getattr(hostnames, '__LOOKUP_TIMEOUT')
+        setattr(hostnames, '__LOOKUPS', threading.Semaphore(1))
+        setattr(hostnames, '__LOOKUP_TIMEOUT', 0.1)
+        answer = threading.Event()
+        resolved = socket.getfqdn
+
+        def getfqdn(address):
+            answer.wait(5)
+            return address
+
+        socket.getfqdn = getfqdn
+        try:
+            resolve = getattr(hostnames, '_resolve')
+            not_looked_up = getattr(hostnames, '__NOT_LOOKED_UP')
+            self.assertTrue(resolve('192.0.2.1') is not_looked_up)
+            socket.getfqdn = resolved
+            started = time.time()
+            self.assertTrue(resolve('192.0.2.1') is not_looked_up)
+            self.assertTrue(time.time() - started < 0.1)
+            self.assertEqual(hostnames.resolve_all(['192.0.2.1']), {})
+            answer.set()
+            for attempt in range(50):
+                name = resolve('192.0.2.1')
+                if name is not not_looked_up:
+                    break
+                time.sleep(0.1)
+            self.assertEqual(name, 'relay.example.org')
+        finally:
+            answer.set()
+            setattr(hostnames, '__LOOKUPS', lookups)
+            setattr(hostnames, '__LOOKUP_TIMEOUT', timeout)
+
+    def test_update_table(self):
+        """
+        Test that an address that could not be looked up keeps its
+        stored hostname, and that only real changes are stored as
+        changes.
+        """
+        resolved = datetime.datetime(2011, 10, 20)
+
+        class Objects(object):
+            def __init__(self, rows):
+                self.rows = rows
+
+            def values_list(self, *fields, **kwargs):
+                if kwargs.get('flat'):
+                    return [row[0] for row in self.rows]
+                return self.rows
+
+        class Model(object):
+            pass
+
+        relays = Model()
+        relays.objects = Objects([('192.0.2.1',), ('192.0.2.2',),
+                                  ('192.0.2.3',)])
+        stored = Model()
+        stored.objects = Objects([
+                ('192.0.2.1', 'relay.example.org', resolved),
+                ('192.0.2.2', 'old.example.org', resolved),
+                ('192.0.2.3', 'gone.example.org', resolved)])
+        calls = []
+        saved = dict((name, getattr(hostnames, name)) for name in
+                     ('ActiveRelay', 'Hostname', '_store',
+                      '__LOOKUPS'))
+        hostnames.ActiveRelay = relays
+        hostnames.Hostname = stored
+        hostnames._store = lambda *args: calls.append(args)
+        try:
+            setattr(hostnames, '__LOOKUPS', threading.Semaphore(0))
+            hostnames.update_table()
+            self.assertEqual(calls[0][0], {})
+            self.assertEqual(calls[0][3], [])
+
+            setattr(hostnames, '__LOOKUPS', threading.Semaphore(4))
+            hostnames.update_table()
+            self.assertEqual(calls[1][0],
+                             {'192.0.2.1': 'relay.example.org',
+                              '192.0.2.2': None, '192.0.2.3': None})
+            self.assertEqual(sorted(calls[1][3]),
+                             ['192.0.2.2', '192.0.2.3'])
+        finally:
+            for name, value in saved.items():
+                setattr(hostnames, name, value)
+
+
+class RelayNamesTest(django.test.TestCase):
+    """
+    Test resolving the members of families.
+    """
+
+    def test_resolve(self):
+        """
+        Test that fingerprints and unique nicknames are resolved, and
+        that unknown fingerprints and shared nicknames are not.
+        """
+        names = RelayNames([('a' * 40, 'moria1'), ('b' * 40, 'Unnamed'),
+                            ('c' * 40, 'Unnamed')])
+        self.assertEqual(names.resolve(['$' + 'A' * 40, 'moria1',
+                                        'Unnamed', 'MORIA1',
+                                        '$' + 'd' * 40]),
+                         [('a' * 40, 'moria1'), ('a' * 40, 'moria1'),
+                          (None, 'Unnamed'), (None, 'MORIA1'),
+                          (None, '$' + 'd' * 40)])
+
+    def test_renamed(self):
+        """
+        Test that a relay that has been renamed has its most recent
+        nickname.
+        """
+        names = RelayNames([('a' * 40, 'moria'), ('b' * 40, 'Tonga'),
+                            ('a' * 40, 'moria1')])
+        self.assertEqual(names.resolve(['$' + 'a' * 40]),
+                         [('a' * 40, 'moria1')])
+
+
+class ExitPoliciesTest(django.test.TestCase):
+    """
+    Test compiling and evaluating exit policies.
+    """
+
+    def setUp(self):
+        web = ['reject 0.0.0.0/8:*', 'reject 10.0.0.0/255.0.0.0:*',
+               'accept [::]/0:80', 'accept *:80', 'accept *:443',
+               'reject *:*']
+        policies = [web, ['accept 128.31.0.0/16:22-25',
+                          'accept 194.109.206.212:*', 'reject *:*'],
+                    list(web), None]
+        rows = [tuple([{'fingerprint': letter * 40,
+                        'nickname': letter, 'address': '127.0.0.1',
+                        'exitpolicy': policy}.get(name)
+                       for name in FIELDS])
+                for letter, policy in zip('abcd', policies)]
+        self.policies = ExitPolicies(Snapshot(None, rows))
+
+    def allowed(self, address, port):
+        return [self.policies.allows(index, address_value(address),
+                                     port) for index in range(4)]
+
+    def test_allows(self):
+        """
+        Test that the first matching line of a policy decides, and that
+        destinations that no line matches are rejected.
+        """
+        self.assertEqual(self.allowed('128.31.0.34', 80),
+                         [True, False, True, False])
+        self.assertEqual(self.allowed('128.31.0.34', 25),
+                         [False, True, False, False])
+        self.assertEqual(self.allowed('128.32.0.34', 25),
+                         [False, False, False, False])
+        self.assertEqual(self.allowed('10.1.2.3', 443),
+                         [False, False, False, False])
+        self.assertEqual(self.allowed('194.109.206.212', 443),
+                         [True, True, True, False])
+
+    def test_exits_to(self):
+        """
+        Test that the relays found to exit to a destination are those
+        whose policies accept it.
+        """
+        for address, port in [('128.31.0.34', 80), ('128.31.0.34', 25),
+                              ('10.1.2.3', 443), ('0.0.0.0', 8080),
+                              ('194.109.206.212', 443)]:
+            allowed = self.allowed(address, port)
+            self.assertEqual(self.policies.exits_to(
+                             address_value(address), port),
+                             [index for index in range(4)
+                              if allowed[index]])
+
+    def test_interned(self):
+        """
+        Test that identical policies are compiled once, and that lines
+        about IPv6 addresses are left out.
+        """
+        self.assertEqual(len(self.policies.distinct), 3)
+        self.assert_(self.policies.policies[0] is
+                     self.policies.policies[2])
+        self.assertEqual(len(self.policies.policies[0].rules), 5)
+
+
+class NetworkStatisticsTest(django.test.TestCase):
+    """
+    Test computing the statistics of the network statistic graphs.
+    """
+
+    def test_statistics(self):
+        """
+        Test that every histogram is counted in one pass, with relays
+        that lack a value counted as the graphs have always counted
+        them.
+        """
+        relays = [{'country': 'de', 'isexit': True, 'isfast': True,
+                   'uptimedays': 15, 'bandwidthkbps': 20,
+                   'platform': 'Tor 0.2.1.26 on Linux i686'},
+                  {'country': 'de', 'isexit': False, 'isfast': True,
+                   'uptimedays': 2, 'bandwidthkbps': 20000,
+                   'platform': 'Tor 0.2.2.15 on Windows XP'},
+                  {'country': None, 'isexit': True, 'isfast': None,
+                   'uptimedays': None, 'bandwidthkbps': None,
+                   'platform': None}]
+        rows = [tuple([dict(relay, fingerprint=letter * 40,
+                            nickname=letter,
+                            address='127.0.0.1').get(name)
+                       for name in FIELDS])
+                for letter, relay in zip('abc', relays)]
+        stats = NetworkStatistics(Snapshot(None, rows))
+        self.assertEqual(stats.total, 3)
+        self.assertEqual(stats.countries, {'de': 2, '??': 1})
+        self.assertEqual(stats.exit_countries, {'de': 1, '??': 1})
+        self.assertEqual(stats.weeks_running, {0: 1, 2: 1})
+        self.assertEqual(stats.bandwidths,
+                         [0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 2])
+        self.assertEqual(stats.platforms['Linux'], 1)
+        self.assertEqual(stats.platforms['Windows'], 1)
+        self.assertEqual(stats.platforms['Unknown'], 1)
+        self.assertEqual(stats.flags['isexit'], 2)
+        self.assertEqual(stats.flags['isfast'], 2)
+        self.assertEqual(stats.flags['isguard'], 0)
+
+
+class LRUCacheTest(django.test.TestCase):
+    """
+    Test the least-recently-used cache.
+    """
+
+    def test_eviction(self):
+        """
+        Test that the least recently used entries are forgotten once
+        the cache is too large, and that values too large for the
+        cache are not kept.
+        """
+        cache = LRUCache(10)
+        cache.set('a', 1, 4)
+        cache.set('b', 2, 4)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3, 4)
+        self.assertEqual((cache.get('a'), cache.get('b'),
+                          cache.get('c')), (1, None, 3))
+        cache.set('a', 4, 6)
+        self.assertEqual((cache.get('a'), cache.get('c'), cache.size),
+                         (4, 3, 10))
+        cache.set('d', 5, 11)
+        self.assertEqual((cache.get('d', 0), len(cache)), (0, 2))
+
+
+class DiskCacheTest(django.test.TestCase):
+    """
+    Test the cache of files on disk.
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_eviction(self):
+        """
+        Test that values are shared by caches in the same directory,
+        and that the least recently used files are removed once the
+        cache is too large.
+        """
+        cache = DiskCache(os.path.join(self.path, 'graphs'), 16, '.png')
+        cache.set('a', 'aaaaaa')
+        self.assertEqual(DiskCache(cache.path, 16, '.png').get('a'),
+                         'aaaaaa')
+        cache.set('b', 'bbbbbb')
+        os.utime(cache._filename('a'), (0, 0))
+        cache.set('c', 'cccccc')
+        self.assertEqual((cache.get('a'), cache.get('b'),
+                          cache.get('c')), (None, 'bbbbbb', 'cccccc'))
+
+
+class NetworkGraphTest(django.test.TestCase):
+    """
+    Test publishing and serving the network statistic graphs.
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.published = getattr(graphs, '__NETWORK_GRAPHS')
+        setattr(graphs, '__NETWORK_GRAPHS',
+                {'png': DiskCache(self.path, 1024, '.png'),
+                 'svg': DiskCache(self.path, 1024, '.svg')})
+        self.token = consensus.token
+        self.last_validafter = consensus.last_validafter
+        self.version = '1-201110201200'
+        consensus.token = lambda: self.version
+        consensus.last_validafter = lambda: datetime.datetime(2011,
+                                                               10, 20)
+
+    def tearDown(self):
+        for name in ('drawn', 'formatted', 'slow', 'quick',
+                     'versioned'):
+            getattr(graphs, '__NETWORK_GRAPH_RENDERERS').pop(name, None)
+        setattr(graphs, '__NETWORK_GRAPHS', self.published)
+        consensus.token = self.token
+        consensus.last_validafter = self.last_validafter
+        shutil.rmtree(self.path)
+
+    def test_published(self):
+        """
+        Test that a graph is drawn once per version of the ActiveRelay
+        cache, and that graphs published by other processes are served
+        without being drawn.
+        """
+        calls = []
+
+        @graphs._network_graph(('png', 'svg'))
+        def drawn(request, format):
+            calls.append(self.version)
+            return HttpResponse('PNG %d' % len(calls))
+
+        request = _Request(QueryDict(''))
+        self.assertEqual(drawn(request).content, 'PNG 1')
+        self.assertEqual(drawn(request).content, 'PNG 1')
+        self.assertEqual(calls, ['1-201110201200'])
+
+        self.version = '2-201110201300'
+        getattr(graphs, '__NETWORK_GRAPHS')['png'].set(
+                'drawn-2-201110201300', 'PNG published')
+        self.assertEqual(drawn(request).content, 'PNG published')
+        self.assertEqual(drawn(request)['ETag'], '"2-201110201300"')
+        self.assertEqual(calls, ['1-201110201200'])
+
+    def test_concurrent(self):
+        """
+        Test that a graph that is slow to draw does not hold up requests
+        for other graphs.
+        """
+        started = threading.Event()
+        finish = threading.Event()
+        finished = threading.Event()
+
+        @graphs._network_graph(('png',))
+        def slow(request, format):
+            started.set()
+            finish.wait(5)
+            finished.set()
+            return HttpResponse('slow')
+
+        @graphs._network_graph(('png',))
+        def quick(request, format):
+            return HttpResponse(str(finished.isSet()))
+
+        request = _Request(QueryDict(''))
+        thread = threading.Thread(target=slow, args=(request,))
+        thread.start()
+        started.wait(5)
+        self.assertEqual(quick(request).content, 'False')
+        finish.set()
+        thread.join(5)
+
+    def test_version(self):
+        """
+        Test that a graph with data of its own is drawn again, and has a
+        new ETag, when its data changes within a version of the
+        ActiveRelay cache.
+        """
+        versions = ['a']
+
+        @graphs._network_graph(('png',), lambda: versions[-1])
+        def versioned(request, format):
+            return HttpResponse('PNG %s' % versions[-1])
+
+        request = _Request(QueryDict(''))
+        response = versioned(request)
+        self.assertEqual((response.content, response['ETag']),
+                         ('PNG a', '"a"'))
+        versions.append('b')
+        response = versioned(request)
+        self.assertEqual((response.content, response['ETag']),
+                         ('PNG b', '"b"'))
+        request = _Request(QueryDict(''), {'HTTP_IF_NONE_MATCH': '"b"'})
+        self.assertEqual(versioned(request).status_code, 304)
+
+    def test_formats(self):
+        """
+        Test that a graph is served in the format of the request if it
+        can be drawn in it, and as a PNG otherwise.
+        """
+        @graphs._network_graph(('png', 'svg'))
+        def formatted(request, format):
+            return HttpResponse(format)
+
+        response = formatted(_Request(QueryDict('format=svg')))
+        self.assertEqual((response.content, response['Content-Type']),
+                         ('svg', 'image/svg+xml'))
+        response = formatted(_Request(QueryDict('format=gif')))
+        self.assertEqual((response.content, response['Content-Type']),
+                         ('png', 'image/png'))
+        self.assertEqual(getattr(graphs, '__NETWORK_GRAPHS')['svg'].get(
+                         'formatted-1-201110201200'), 'svg')
+
+
+class GraphImportTest(django.test.TestCase):
+    """
+    Test that the graph views can be loaded without loading matplotlib.
+    """
+
+    def setUp(self):
+        self.hidden = {}
+        for name in sys.modules.keys():
+            if name.split('.')[0] in ('matplotlib', 'pylab'):
+                self.hidden[name] = sys.modules.pop(name)
+
+    def tearDown(self):
+        for name in sys.modules.keys():
+            if name.split('.')[0] in ('matplotlib', 'pylab'):
+                del sys.modules[name]
+        sys.modules.update(self.hidden)
+        sys.modules.pop('_graphs_import', None)
+
+    def test_import(self):
+        """
+        Test that loading the graph views does not import matplotlib,
+        which is only imported once a PNG graph is drawn.
+        """
+        source = os.path.splitext(graphs.__file__)[0] + '.py'
+        imp.load_source('_graphs_import', source)
+        self.assertTrue('matplotlib' not in sys.modules)
+
+
+class SvgGraphTest(django.test.TestCase):
+    """
+    Test writing graphs as SVG images.
+    """
+
+    def test_bar_graph(self):
+        """
+        Test that a bar graph is a well-formed image with a bar and a
+        label for each data point.
+        """
+        params = dict(graphs.DEFAULT_PARAMS, LABEL_ROT='vertical',
+                      TITLE='Relays & <Exits>')
+        image = svggraphs.bar_graph([0, 1, 2], [5, 0, 12],
+                                    ['DE', u'\xc5', 7], params)
+        svg = parseString(image).documentElement
+        self.assertEqual((svg.getAttribute('width'),
+                          svg.getAttribute('height')), ('960', '320'))
+        self.assertEqual(svg.getElementsByTagName('path')[0]
+                         .getAttribute('d').count('M'), 3)
+        texts = [text.firstChild.data
+                 for text in svg.getElementsByTagName('text')]
+        for text in [u'5', u'0', u'12', u'DE', u'\xc5', u'7',
+                     u'Relays & <Exits>']:
+            self.assertTrue(text in texts)
+
+    def test_line_graphs(self):
+        """
+        Test that line graphs are drawn side by side through each of
+        their data points.
+        """
+        start_time = datetime.datetime(2011, 10, 20)
+        panels = [('Read', '#68228B', '#DAC8E2', start_time,
+                   range(0, 96 * 900, 900)),
+                  ('Written', '#66CD00', '#D9F3C0', start_time,
+                   [0] * 96)]
+        svg = parseString(svggraphs.line_graphs(panels)).documentElement
+        self.assertEqual(svg.getAttribute('width'), '960')
+        lines = svg.getElementsByTagName('polyline')
+        self.assertEqual([len(line.getAttribute('points').split())
+                          for line in lines], [96, 96])
+
+    def test_ticks(self):
+        """
+        Test that axes are divided at round values.
+        """
+        ticks = getattr(svggraphs, '_ticks')
+        self.assertEqual(ticks(0), [0, 1])
+        self.assertEqual(ticks(12), [0, 2, 4, 6, 8, 10, 12])
+        self.assertEqual(ticks(1300), [0, 250, 500, 750, 1000, 1250,
+                                       1500])
+
+
+class RenderPoolTest(django.test.TestCase):
+    """
+    Test drawing graphs in the pool of worker processes.
+    """
+
+    def setUp(self):
+        self.processes = getattr(renderpool, '__PROCESSES')
+        self.timeout = getattr(renderpool, '__TIMEOUT')
+        setattr(renderpool, '__PROCESSES', 2)
+        setattr(renderpool, '__TIMEOUT', 0.5)
+
+    def tearDown(self):
+        setattr(renderpool, '__PROCESSES', self.processes)
+        setattr(renderpool, '__TIMEOUT', self.timeout)
+
+    def test_render(self):
+        """
+        Test that results and errors are passed back from the workers,
+        and that requests stop waiting for slow graphs.
+        """
+        self.assertEqual(renderpool.render(abs, -3), 3)
+        self.assertRaises(RuntimeError, renderpool.render, int, 'x')
+        self.assertRaises(renderpool.RenderTimeout, renderpool.render,
+                          time.sleep, 2)
+        setattr(renderpool, '__PROCESSES', 0)
+        self.assertEqual(renderpool.render(abs, -4), 4)
+        self.assertEqual(renderpool.start(), None)
+
+    def test_pending(self):
+        """
+        Test that a graph that a request has given up waiting for still
+        counts as pending until it is drawn, and that graphs that are
+        drawn or could not be sent do not.
+        """
+        pending = getattr(renderpool, '__PENDING')
+        max_pending = getattr(renderpool, '__MAX_PENDING')
+        setattr(renderpool, '__PENDING', [])
+        setattr(renderpool, '__MAX_PENDING', 1)
+        try:
+            self.assertEqual(renderpool.render(abs, -3), 3)
+            self.assertRaises(Exception, renderpool.render, lambda: 1)
+            self.assertRaises(renderpool.RenderTimeout,
+                              renderpool.render, time.sleep, 1.5)
+            started = time.time()
+            self.assertRaises(renderpool.RenderTimeout,
+                              renderpool.render, abs, -3)
+            self.assertTrue(time.time() - started >= 0.5)
+            time.sleep(1)
+            self.assertEqual(renderpool.render(abs, -3), 3)
+        finally:
+            setattr(renderpool, '__PENDING', pending)
+            setattr(renderpool, '__MAX_PENDING', max_pending)
+
+
+class _WhoisHandler(SocketServer.StreamRequestHandler):
+    """
+    A stand-in WHOIS server, which echoes the query it is sent.
+    """
+
+    def handle(self):
+        query = self.rfile.readline().strip()
+        self.wfile.write('inetnum: %s\r\nnetname: EXAMPLE\r\n' % query)
+
+
+class WhoisTest(django.test.TestCase):
+    """
+    Test looking up WHOIS information.
+    """
+
+    def setUp(self):
+        self.server = SocketServer.TCPServer(('127.0.0.1', 0),
+                                             _WhoisHandler)
+        serving = threading.Thread(target=self.server.serve_forever)
+        serving.setDaemon(True)
+        serving.start()
+        self.query = whoisclient.query
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        whoisclient.query = self.query
+
+    def test_query(self):
+        """
+        Test that a WHOIS server is queried about an address, and that
+        referrals are found in answers.
+        """
+        host, port = self.server.server_address
+        self.assertEqual(whoisclient.query('192.0.2.1', host, port),
+                         u'inetnum: 192.0.2.1\r\nnetname: EXAMPLE\r\n')
+        self.assertEqual(whoisclient._referral(
+                         'inetnum: 192.0.0.0\n'
+                         'refer:        whois.arin.net\n'),
+                         'whois.arin.net')
+        self.assertEqual(whoisclient._referral('% refer: none'), None)
+
+    def test_lookup(self):
+        """
+        Test that concurrent lookups of the same address are made
+        once, and that their answer is remembered.
+        """
+        queries = []
+
+        def slow_query(address, server):
+            queries.append(address)
+            time.sleep(0.2)
+            return u'netname: EXAMPLE'
+
+        whoisclient.query = slow_query
+        answers = []
+        lookups = [threading.Thread(target=lambda: answers.append(
+                   whoisclient.lookup('192.0.2.7', 5)))
+                   for number in range(5)]
+        for lookup in lookups:
+            lookup.start()
+        for lookup in lookups:
+            lookup.join()
+        self.assertEqual(answers, [u'netname: EXAMPLE'] * 5)
+        self.assertEqual(whoisclient.lookup('192.0.2.7', 0),
+                         u'netname: EXAMPLE')
+        self.assertEqual(queries, ['192.0.2.7'])
+
+    def test_failure(self):
+        """
+        Test that a lookup that fails in any way is remembered as a
+        failure, and that the lookup threads carry on.
+        """
+        def broken_query(address, server):
+            if address == '192.0.2.8':
+                raise ValueError(address)
+            return u'netname: %s' % address
+
+        whoisclient.query = broken_query
+        self.assertEqual(whoisclient.lookup('192.0.2.8', 5), None)
+        self.assertTrue('192.0.2.8' in getattr(whoisclient, '__CACHE'))
+        for number in range(5):
+            address = '192.0.2.%d' % (10 + number)
+            self.assertEqual(whoisclient.lookup(address, 5),
+                             u'netname: %s' % address)
+
+    def test_stale(self):
+        """
+        Test that a failed lookup keeps an earlier answer, and is tried
+        again later.
+        """
+        def broken_query(address, server):
+            raise socket.error(address)
+
+        cache = getattr(whoisclient, '__CACHE')
+        cache['192.0.2.9'] = (u'netname: EXAMPLE', 0)
+        whoisclient.query = broken_query
+        self.assertEqual(whoisclient.lookup('192.0.2.9', 5),
+                         u'netname: EXAMPLE')
+        information, expires = cache['192.0.2.9']
+        self.assertEqual(information, u'netname: EXAMPLE')
+        self.assertTrue(time.time() < expires <= time.time() +
+                        getattr(whoisclient, '__ERROR_TTL'))
+
+
+class _Request(object):
+    """
+    A GET request with nothing but parameters and headers.
+    """
+
+    def __init__(self, query, meta=None):
+        self.GET = query
+        self.META = meta or {}
+        self.method = 'GET'
+
+
+class ViewStateTest(django.test.TestCase):
+    """
+    Test carrying search and display choices in state tokens.
+    """
+
+    def test_default(self):
+        """
+        Test that the default choices are the empty token.
+        """
+        self.assertEqual(viewstate.encode(viewstate.default()), '')
+        state = viewstate.decode('')
+        self.assertEqual((state.search, state.filters, state.order,
+                          state.per_page), (u'', {}, 'nickname', 50))
+
+    def test_round_trip(self):
+        """
+        Test that choices survive being encoded and decoded, and that
+        tokens which have been tampered with are ignored.
+        """
+        state = viewstate.default()
+        state.filters = {'isexit': 1, 'nickname__icontains': u'tor'}
+        state.order = '-bandwidthkbps'
+        state.columns = ['IP', 'Router Name', 'Contact']
+        state.per_page = 20
+        token = viewstate.encode(state)
+        decoded = viewstate.decode(token)
+        self.assertEqual((decoded.filters, decoded.order,
+                          decoded.columns, decoded.per_page),
+                         (state.filters, state.order, state.columns,
+                          state.per_page))
+        self.assertEqual(viewstate.decode(token[1:]).per_page, 50)
+        self.assertEqual(viewstate.decode(token + '0').per_page, 50)
+
+    def test_from_request(self):
+        """
+        Test that searches and orders given in a request replace those
+        in its token, and that a reset keeps the display choices.
+        """
+        state = viewstate.from_request(_Request(QueryDict('search='
+                'moria&sortListing=orport&sortOrder=descending')))
+        state.per_page = 10
+        token = viewstate.encode(state)
+        state = viewstate.from_request(_Request(QueryDict(
+                'state=%s&isexit=1' % token)))
+        self.assertEqual((state.search, state.filters, state.order),
+                         (u'', {'isexit': 1}, '-orport'))
+        state = viewstate.from_request(_Request(QueryDict(
+                'state=%s&reset=True' % token)))
+        self.assertEqual((state.search, state.order, state.per_page),
+                         (u'', 'nickname', 10))
@@ -28,6 +28,8 @@ urlpatterns = patterns('',
         'statusapp.views.graphs.readhist'),
     (r'^details/(?P<fingerprint>\w{40})/writehist.png$',
         'statusapp.views.graphs.writehist'),
+    (r'^details/(?P<fingerprint>\w{40})/history.png$',
+        'statusapp.views.graphs.history'),
 
     # Whois Page
     (r'^details/(?P<address>.{7,15})/whois$',
@@ -57,8 +59,8 @@ urlpatterns = patterns('',
 
     # Index and related pages
     (r'^index/$', 'statusapp.views.pages.index'),
-    ## Uncomment this line to enable a cached page of all routers.
-    ## This loads slowly and doesn't provide search and display options
+    ## Uncomment this line to enable a streamed page of all routers.
+    ## This doesn't provide search and display options
     #(r'^all$', 'statusapp.views.pages.full_index'),
 
     # About Tor Status
@@ -5,15 +5,46 @@ There is one function for each link.
 """
 # Django-specific import statements -----------------------------------
 from django.http import HttpResponse
-from django.db.models import Max
 
 # CSV specific import statements
 import csv
 
 # TorStatus specific import statements --------------------------------
-from statusapp.models import ActiveRelay
+from statusapp import snapshot
 import config
-import helpers
+import viewstate
+
+# INIT Variables ------------------------------------------------------
+# Maps the title of each column that can be in a CSV to the attribute
+# of a relay that holds its values.
+__CSV_FIELDS = {'Router Name': 'nickname',
+                'Country Code': 'country',
+                'Latitude': 'latitude',
+                'Longitude': 'longitude',
+                'Exit Policy': 'exitpolicy',
+                'Contact': 'contact',
+                'Onion Key': 'onionkey',
+                'Signing Key': 'signingkey',
+                'Family': 'family',
+                'Bandwidth': 'bandwidthobserved',
+                'Uptime': 'uptime',
+                'IP': 'address',
+                'Hostname': 'hostname',
+                'Fingerprint': 'fingerprint',
+                'Last Descriptor Published': 'published',
+                'Bad Directory': 'isbaddirectory',
+                'DirPort': 'dirport',
+                'Exit': 'isexit',
+                'Authority': 'isauthority',
+                'Hibernating': 'ishibernating',
+                'Fast': 'isfast',
+                'Guard': 'isguard',
+                'V2Dir': 'isv2dir',
+                'Platform': 'platform',
+                'Stable': 'isstable',
+                'ORPort': 'orport',
+                'Bad Exit': 'isbadexit',
+               }
 
 
 def current_results_csv(request):
@@ -23,7 +54,11 @@ def current_results_csv(request):
     @rtype: HttpResponse
     @return: The CSV formatted current result set.
     """
-    current_columns = request.session['currentColumns']
+    # Take the columns and the current result set from the state
+    # carried in the URL, from the same remembered search as the index
+    # page
+    state = viewstate.decode(request.GET.get('state', ''))
+    current_columns = list(state.columns)
 
     # Don't provide certain flag information in the csv
     for column in config.UNDISPLAYED_IN_CSVS:
@@ -37,87 +72,28 @@ def current_results_csv(request):
     elif "Icons" in current_columns:
         current_columns.remove("Icons")
 
-    last_va = ActiveRelay.objects.aggregate(
-              last=Max('validafter'))['last']
-    active_relays = ActiveRelay.objects.filter(
-                    validafter=last_va).order_by('nickname')
-
-    # Filter the results set using the provided search filters in
-    # the session
-    order = helpers.get_order(request)
-    basic_input = request.session.get('search', '')
-    advanced_input = request.session.get('filters', {})
-
-    # We should never have both basic_input and advanced_input
-    assert not (basic_input and advanced_input)
-
-    if basic_input:
-        active_relays = active_relays.filter(
-                        Q(nickname__istartswith=basic_input) | \
-                        Q(fingerprint__istartswith=basic_input) | \
-                        Q(address__istartswith=basic_input)).order_by(
-                        order)
-    else:
-        filter_params = helpers.get_filter_params(request)
-        active_relays = active_relays.filter(
-                        **filter_params).order_by(order)
+    active_relays = snapshot.results(state.search, state.filters,
+                                     state.order)
 
     # Create the HttpResponse object with the appropriate CSV header
     response = HttpResponse(mimetype='text/csv')
     response['Content-Disposition'] = 'attachment;\
             filename=current_results.csv'
 
-    rows = {}
-    headers = {}
-
-    # Make columns keys to empty lists
-    for column in current_columns: rows[column] = []
-
-    # Populate the row dictionary with all field values
-    for relay in active_relays:
-        fields_access = [
-                ("Router Name", relay.nickname),
-                ("Country Code", relay.country),
-                ("Latitude", relay.latitude),
-                ("Longitude", relay.longitude),
-                ("Exit Policy", relay.exitpolicy),
-                ("Contact", relay.contact),
-                ("Onion Key", relay.onionkey),
-                ("Signing Key", relay.signingkey),
-                ("Family", relay.family),
-                ("Bandwidth", relay.bandwidthobserved),
-                ("Uptime", relay.uptime),
-                ("IP", relay.address),
-                ("Fingerprint", relay.fingerprint),
-                ("Last Descriptor Published", relay.published),
-                ("Bad Directory", relay.isbaddirectory),
-                ("DirPort", relay.dirport),
-                ("Exit", relay.isexit),
-                ("Authority", relay.isauthority),
-                ("Hibernating", relay.ishibernating),
-                ("Fast", relay.isfast),
-                ("Guard", relay.isguard),
-                ("V2Dir", relay.isv2dir),
-                ("Platform", relay.platform),
-                ("Stable", relay.isstable),
-                ("ORPort", relay.orport),
-                ("Bad Exit", relay.isbadexit)]
-
-        for k, v in fields_access:
-            if k in current_columns: rows[k].append(v)
+    # Gather the values of each column for all relays at once; columns
+    # that relays have no values for are left empty.
+    values = []
+    for column in current_columns:
+        if column in __CSV_FIELDS:
+            values.append(active_relays.values(__CSV_FIELDS[column]))
+        else:
+            values.append([''] * len(active_relays))
 
     writer = csv.writer(response)
-    writer = csv.DictWriter(response, fieldnames=current_columns)
-
-    # Write the headers row
-    for column in current_columns: headers[column] = column
-    writer.writerow(headers)
 
-    # Write each row in the dictionary to the csv
-    for i in range(0, len(rows[current_columns[0]])):
-        dict_row = {}
-        for column in current_columns:
-            dict_row[column] = rows[column][i]
-        writer.writerow(dict_row)
+    # Write the headers row, then each relay's row
+    writer.writerow(current_columns)
+    for row in zip(*values):
+        writer.writerow(row)
 
     return response
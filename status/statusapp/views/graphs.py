@@ -1,26 +1,27 @@
 """
 Views for statusapp that involve creating dynamic graphs.
+
+Matplotlib is only imported by the functions that draw PNG images,
+which run in the pool of worker processes, so that processes which
+never draw a graph do not pay for loading it.
 """
 # Python-specific import statements -----------------------------------
 from copy import copy
 import datetime
+from functools import wraps
+import os
+from StringIO import StringIO
 
 # Django-specific import statements -----------------------------------
+from django.conf import settings
 from django.db.models import Max
-from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
 from django.http import HttpResponse
 
-# Matplotlib-specific import statements -------------------------------
-import matplotlib
-from pylab import legend
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
-from matplotlib.ticker import MaxNLocator
-
 # TorStatus specific import statements --------------------------------
-from statusapp.models import Bwhist, TotalBandwidth, NetworkSize, \
-        ActiveRelay
-from custom.aggregate import CountCase
+from statusapp.models import Bwhist, TotalBandwidth, NetworkSize
+from statusapp import consensus, netstats, renderpool, svggraphs
+from statusapp.diskcache import DiskCache
 
 # Default parameters to be used with the graphs. Each graph may change
 # certain parameters, but a default dictionary enforces uniformity
@@ -33,7 +34,249 @@ DEFAULT_PARAMS = {'WIDTH': 960, 'HEIGHT': 320, 'TOP_MARGIN': 25,
                   'FONT_WEIGHT': 'bold', 'BAR_WIDTH': 0.5,
                   'COLOR': '#005500', 'TITLE': ''}
 
+# The formats that graphs can be drawn in, and their content types. A
+# graph is drawn in the format given by the format parameter of its
+# request, e.g. ?format=svg, or else as a PNG.
+__CONTENT_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# The bandwidth history graphs of routers, kept on disk and shared by
+# every process, in a cache per format, or in none if the
+# GRAPH_CACHE_DIR setting is not set.
+if getattr(settings, 'GRAPH_CACHE_DIR', None):
+    __LINE_GRAPHS = dict((format, DiskCache(
+                              settings.GRAPH_CACHE_DIR,
+                              getattr(settings, 'GRAPH_CACHE_SIZE',
+                                      64 * 1024 * 1024), '.' + format))
+                         for format in __CONTENT_TYPES)
+else:
+    __LINE_GRAPHS = {}
+
+# The largest number of bytes of network statistic graphs to keep on
+# disk per format, which is enough for those of several consensuses.
+__NETWORK_GRAPHS_SIZE = 4 * 1024 * 1024
+
+# The network statistic graphs, published on disk by the rendergraphs
+# command for every process to serve, in a cache per format, or in
+# none if the GRAPH_CACHE_DIR setting is not set.
+if getattr(settings, 'GRAPH_CACHE_DIR', None):
+    __NETWORK_GRAPHS = dict((format, DiskCache(
+                                 os.path.join(settings.GRAPH_CACHE_DIR,
+                                              'network'),
+                                 __NETWORK_GRAPHS_SIZE, '.' + format))
+                            for format in __CONTENT_TYPES)
+else:
+    __NETWORK_GRAPHS = {}
+
+# Maps the name of each network statistic graph to the function that
+# draws it, the formats that it can be drawn in, and the function that
+# gives the version of its data, or None if its data is the ActiveRelay
+# cache.
+__NETWORK_GRAPH_RENDERERS = {}
+
+
+def _network_graph(formats, version=None):
+    """
+    Decorate a view that draws a network statistic graph, so that it
+    serves the graph as published by L{render_network_graphs} for the
+    current version of its data, which is the ActiveRelay cache unless
+    another version is given.
+
+    If the graph has not been published yet, it is drawn and published
+    by the first request for it in each process, while other requests
+    for it wait. Each process remembers the graphs of the current
+    version once it has read them. Conditional GETs are answered as by
+    C{consensus.conditional}, or with the version as the ETag if
+    another version is given.
+
+    @type formats: C{tuple} of C{string}
+    @param formats: The formats that the view can draw the graph in,
+        the first of which is served unless another is requested.
+    @type version: C{function}
+    @param version: A function that gives the version of the data
+        that the graph is drawn from as a string, or C{None} if the
+        graph is drawn from the ActiveRelay cache.
+    @rtype: C{function}
+    @return: A decorator for the view, which draws the graph in the
+        format that it is given without reading its request.
+    """
+    def decorator(function):
+        name = function.__name__
+        __NETWORK_GRAPH_RENDERERS[name] = (function, formats, version)
+
+        def network_graph_view(request):
+            format = _graph_format(request, formats)
+            try:
+                content = _network_graph_content(
+                        name, format, _network_graph_version(name))
+            except renderpool.RenderTimeout:
+                return _busy()
+            return HttpResponse(content,
+                                content_type=__CONTENT_TYPES[format])
+
+        view = wraps(function)(network_graph_view)
+        if version is None:
+            return consensus.conditional(view)
+        conditional_view = condition(etag_func=lambda request:
+                                     version())(view)
+        return wraps(function)(conditional_view)
+    return decorator
+
+
+def render_network_graphs():
+    """
+    Draw every network statistic graph for the current version of the
+    ActiveRelay cache and publish it on disk, replacing each graph
+    atomically so that it is never served partly written.
+
+    @rtype: C{list} of C{string}
+    @return: The names of the graphs that were published.
+    """
+    names = sorted(__NETWORK_GRAPH_RENDERERS)
+    for name in names:
+        function, formats, version = __NETWORK_GRAPH_RENDERERS[name]
+        for format in formats:
+            _publish_network_graph(name, format,
+                                   _network_graph_version(name))
+    return names
+
+
+@consensus.per_consensus
+def _network_graph_content(name, format, version):
+    """
+    Get a network statistic graph for a version of its data,
+    publishing it if it has not been published.
+
+    @type name: C{string}
+    @param name: The name of the graph.
+    @type format: C{string}
+    @param format: The format of the graph, e.g. 'png'.
+    @type version: C{string}
+    @param version: The current version of the data of the graph, as
+        given by L{_network_graph_version}.
+    @rtype: C{string}
+    @return: The graph, as an image in the format.
+    """
+    content = None
+    if format in __NETWORK_GRAPHS:
+        content = __NETWORK_GRAPHS[format].get(
+                  _network_graph_key(name, version))
+    if content is None:
+        content = _publish_network_graph(name, format, version)
+    return content
+
+
+def _publish_network_graph(name, format, version):
+    """
+    Draw a network statistic graph and publish it on disk.
+
+    @type name: C{string}
+    @param name: The name of the graph.
+    @type format: C{string}
+    @param format: The format of the graph, e.g. 'png'.
+    @type version: C{string}
+    @param version: The current version of the data of the graph, as
+        given by L{_network_graph_version}.
+    @rtype: C{string}
+    @return: The graph, as an image in the format.
+    """
+    function, formats, version_function = \
+            __NETWORK_GRAPH_RENDERERS[name]
+    content = function(None, format).content
+    if format in __NETWORK_GRAPHS:
+        __NETWORK_GRAPHS[format].set(_network_graph_key(name, version),
+                                     content)
+    return content
+
+
+def _network_graph_version(name):
+    """
+    Get the current version of the data of a network statistic graph,
+    which is the token of the version of the ActiveRelay cache unless
+    the graph was given a version of its own.
+    """
+    function, formats, version = __NETWORK_GRAPH_RENDERERS[name]
+    if version is None:
+        return consensus.token()
+    return version()
+
+
+def _graph_format(request, formats):
+    """
+    Get the format that a graph is requested in, from the format
+    parameter of the request.
+
+    @type request: C{HttpRequest}
+    @param request: The request for the graph.
+    @type formats: C{tuple} of C{string}
+    @param formats: The formats that the graph can be drawn in.
+    @rtype: C{string}
+    @return: The requested format, if the graph can be drawn in it, or
+        else the first of the formats.
+    """
+    format = request.GET.get('format')
+    if format in formats:
+        return format
+    return formats[0]
+
+
+def _busy():
+    """
+    Get the response to a request for a graph that could not be drawn
+    in time.
+
+    @rtype: C{HttpResponse}
+    @return: A response asking the client to try again later.
+    """
+    response = HttpResponse('The graph could not be drawn in time. '
+                            'Please try again in a moment.',
+                            content_type='text/plain', status=503)
+    response['Retry-After'] = '10'
+    return response
+
+
+def _network_graph_key(name, version):
+    """
+    Get the key of a network statistic graph for a version of its
+    data.
+    """
+    return '%s-%s' % (name, version)
+
+
+def _total_bandwidth_version():
+    """
+    Get the version of the data of the graph of the total bandwidth of
+    the network, which changes with the version of the ActiveRelay
+    cache and the date of the last total bandwidth of the network.
+    """
+    last_date = TotalBandwidth.objects.aggregate(
+                last=Max('date'))['last']
+    if last_date is None:
+        return consensus.token()
+    return '%s-%s' % (consensus.token(), last_date.strftime('%Y%m%d'))
+
+
+def _hist_etag(request, fingerprint):
+    """
+    Get the ETag of a bandwidth history graph, which changes with the
+    version of the ActiveRelay cache and the date of the last
+    bandwidth history of the router.
+    """
+    last_date = Bwhist.objects.filter(
+                fingerprint=fingerprint).aggregate(
+                last=Max('date'))['last']
+    if last_date is None:
+        return None
+    return '%s-%s' % (consensus.token(), last_date.strftime('%Y%m%d'))
+
 
+def _hist_last_modified(request, fingerprint):
+    """
+    Get the Last-Modified time of a bandwidth history graph.
+    """
+    return consensus.last_validafter()
+
+
+@condition(etag_func=_hist_etag, last_modified_func=_hist_last_modified)
 def readhist(request, fingerprint):
     """
     Create a graph of read bandwidth history for the last twenty-four
@@ -46,12 +289,14 @@ def readhist(request, fingerprint):
     @param fingerprint: The fingerprint of the router to gather
         bandwidth history information on.
     @rtype: HttpRequest
-    @return: A PNG image that is the graph of the read bandwidth
+    @return: A PNG or SVG image that is the graph of the read bandwidth
         history information for the given router.
     """
-    return draw_line_graph(fingerprint, 'Read', '#68228B', '#DAC8E2')
+    return draw_line_graph(fingerprint, 'Read', '#68228B', '#DAC8E2',
+                           _graph_format(request, ('png', 'svg')))
 
 
+@condition(etag_func=_hist_etag, last_modified_func=_hist_last_modified)
 def writehist(request, fingerprint):
     """
     Create a graph of written bandwidth history for the last twenty-four
@@ -64,14 +309,39 @@ def writehist(request, fingerprint):
     @param fingerprint: The fingerprint of the router to gather
         bandwidth history information on.
     @rtype: HttpRequest
-    @return: A PNG image that is the graph of the written bandwidth
-        history information for the given router.
+    @return: A PNG or SVG image that is the graph of the written
+        bandwidth history information for the given router.
+    """
+    return draw_line_graph(fingerprint, 'Written', '#66CD00', '#D9F3C0',
+                           _graph_format(request, ('png', 'svg')))
+
+
+@condition(etag_func=_hist_etag, last_modified_func=_hist_last_modified)
+def history(request, fingerprint):
     """
-    return draw_line_graph(fingerprint, 'Written', '#66CD00', '#D9F3C0')
+    Create the graphs of both read and written bandwidth history for
+    the last twenty-four hours available for a router with a given
+    fingerprint, side by side in one image.
 
+    The history of the router is only loaded once for both graphs, so
+    the details page embeds this image rather than L{readhist} and
+    L{writehist}.
 
-@cache_page(60 * 15)
-def bycountrycode(request):
+    @type fingerprint: C{string}
+    @param fingerprint: The fingerprint of the router to gather
+        bandwidth history information on.
+    @rtype: HttpRequest
+    @return: A PNG or SVG image of the graphs of the read and the
+        written bandwidth history information for the given router.
+    """
+    return draw_line_graphs(fingerprint,
+                            [('Read', '#68228B', '#DAC8E2'),
+                             ('Written', '#66CD00', '#D9F3C0')],
+                            _graph_format(request, ('png', 'svg')))
+
+
+@_network_graph(('png', 'svg'))
+def bycountrycode(request, format):
     """
     Return a graph representing the number of routers by country code.
 
@@ -83,33 +353,18 @@ def bycountrycode(request):
     params['LABEL_ROT'] = 'vertical'
     params['TITLE'] = 'Number of Routers by Country Code'
 
-    last_va = ActiveRelay.objects.aggregate(
-              last=Max('validafter'))['last']
-
-    relays = ActiveRelay.objects.filter(validafter=last_va)
-
-    # Build a dictionary mapping countries to the number of relays
-    # from that country
-    country_map = {}
-    for relay in relays:
-        country = relay.country
-        if country is None:
-            country = '??'
-        if country in country_map:
-            country_map[country] += 1
-        else:
-            country_map[country] = 1
+    country_map = netstats.current().countries
 
     keys = sorted(country_map)
     num_params = len(keys)
     xs = range(num_params)
     ys = [country_map[key] for key in keys]
 
-    return draw_bar_graph(xs, ys, keys, params)
+    return draw_bar_graph(xs, ys, keys, params, format)
 
 
-@cache_page(60 * 15)
-def exitbycountrycode(request):
+@_network_graph(('png', 'svg'))
+def exitbycountrycode(request, format):
     """
     Return a graph representing the number of exit routers
     by country code.
@@ -124,33 +379,18 @@ def exitbycountrycode(request):
     params['LABEL_ROT'] = 'vertical'
     params['TITLE'] = 'Number of Exit Routers by Country Code'
 
-    last_va = ActiveRelay.objects.aggregate(
-              last=Max('validafter'))['last']
-
-    relays = ActiveRelay.objects.filter(validafter=last_va, isexit=1)
-
-    # Build a dictionary mapping countries to the number of relays
-    # from that country
-    country_map = {}
-    for relay in relays:
-        country = relay.country
-        if country is None:
-            country = '??'
-        if country in country_map:
-            country_map[country] += 1
-        else:
-            country_map[country] = 1
+    country_map = netstats.current().exit_countries
 
     keys = sorted(country_map)
     num_params = len(keys)
     xs = range(num_params)
     ys = [country_map[key] for key in keys]
 
-    return draw_bar_graph(xs, ys, keys, params)
+    return draw_bar_graph(xs, ys, keys, params, format)
 
 
-@cache_page(60 * 15)
-def bytimerunning(request):
+@_network_graph(('png', 'svg'))
+def bytimerunning(request, format):
     """
     Return a graph representing the uptime of routers in the Tor
     network.
@@ -163,42 +403,18 @@ def bytimerunning(request):
     params['X_FONT_SIZE'] = '9'
     params['TITLE'] = 'Number of Routers by Time Running (weeks)'
 
-    last_va = ActiveRelay.objects.aggregate(
-              last=Max('validafter'))['last']
-
-    relays = ActiveRelay.objects.filter(validafter=last_va)
-
-    uptime_map = {}
-
-    # TODO: This step is very inefficient; a custom SUM(CASE WHERE...
-    # should probably be written.
-    for relay in relays:
-
-        # The uptime in weeks is seconds / (seconds/min * min/hour
-        # * hour/day * day/week), where / signifies floor division.
-        uptimedays = relay.uptimedays
-
-        # Some relays don't have descriptors
-        if uptimedays is None:
-            continue
-
-        # Add the relay's uptime to the mapping
-        weeks = relay.uptimedays / 7
-        if weeks in uptime_map:
-            uptime_map[weeks] += 1
-        else:
-            uptime_map[weeks] = 1
+    uptime_map = netstats.current().weeks_running
 
     keys = sorted(uptime_map)
     num_params = len(keys)
     xs = range(num_params)
     ys = [uptime_map[key] for key in keys]
 
-    return draw_bar_graph(xs, ys, keys, params)
+    return draw_bar_graph(xs, ys, keys, params, format)
 
 
-@cache_page(60 * 15)
-def byobservedbandwidth(request):
+@_network_graph(('png', 'svg'))
+def byobservedbandwidth(request, format):
     """
     Return a graph representing the observed bandwidth of the
     routers in the Tor network.
@@ -219,55 +435,23 @@ def byobservedbandwidth(request):
     params['LABEL_ROT'] = 'vertical'
     params['TITLE'] = 'Number of Routers by Observed Bandwidth (KB/sec)'
 
-    # Define the ranges for the graph, a list of 2-tuples of ints
-    RANGES = [(0, 10), (11, 20), (21, 50), (51, 100), (101, 500),
-              (501, 1000), (1001, 2000), (2001, 3000), (3001, 5000),
-              (5001, 10000)]
-
-    last_va = ActiveRelay.objects.aggregate(
-              last=Max('validafter'))['last']
-
-    relays = ActiveRelay.objects.filter(validafter=last_va)
-
-    # Get the highest defined limit in RANGES
+    # The ranges for the graph, a list of 2-tuples of ints, and the
+    # highest defined limit in them
+    RANGES = netstats.BANDWIDTH_RANGES
     excess = RANGES[-1][1] + 1
 
-    # Initialize a dictionary mapping bandwidth ranges to number of
-    # routers
-    bw_map = {}
-    for rng in RANGES:
-        bw_map[rng] = 0
-    bw_map[excess] = 0
-
-    for relay in relays:
-        kbps = relay.bandwidthkbps
-
-        # Binary search -- extensible to finer-grained ranges
-        rngs = RANGES
-        while (rngs and (not rngs[len(rngs) / 2][0] <= kbps <= \
-                             rngs[len(rngs) / 2][1])):
-            if rngs[len(rngs) / 2][0] > kbps:
-                rngs = rngs[:(len(rngs) / 2)]
-            else:
-                rngs = rngs[(len(rngs) / 2 + 1):]
-        if rngs:
-            bw_map[rngs[len(rngs) / 2][0], rngs[len(rngs) / 2][1]] += 1
-        else:
-            bw_map[excess] += 1
-
-    num_params = len(bw_map)
+    ys = netstats.current().bandwidths
+    num_params = len(ys)
     xs = range(num_params)
-    ys = [bw_map[lower, upper] for lower, upper in RANGES]
-    ys.append(bw_map[excess])
 
     labels = ['%s-%s' % (lower, upper) for lower, upper in RANGES]
     labels.append('%s+' % excess)
 
-    return draw_bar_graph(xs, ys, labels, params)
+    return draw_bar_graph(xs, ys, labels, params, format)
 
 
-@cache_page(60 * 15)
-def byplatform(request):
+@_network_graph(('png', 'svg'))
+def byplatform(request, format):
     """
     Return a graph representing the platforms of the active relays
     in the Tor network.
@@ -282,47 +466,18 @@ def byplatform(request):
     params['X_FONT_SIZE'] = '9'
     params['TITLE'] = 'Number of Routers by Platform'
 
-    last_va = ActiveRelay.objects.aggregate(
-              last=Max('validafter'))['last']
-
-    relays = ActiveRelay.objects.filter(validafter=last_va)
-
-    platform_map = {}
-    keys = ['Linux', 'Windows', 'FreeBSD', 'Darwin', 'OpenBSD',
-            'NetBSD', 'SunOS']
-    for platform in keys:
-        platform_map[platform] = 0
-
-    platform_map['Unknown'] = 0
-
-    # TODO: Inefficient for the same reason that the observed bandwidth
-    # graph is inefficient; a custom SUM(CASE WHERE...) should be
-    # necessary here
-    for relay in relays:
-        platform = relay.platform
-        if platform is None:
-            platform_map['Unknown'] += 1
-            continue
-        for key in keys:
-            if key in platform:
-                platform_map[key] += 1
-                break
-        # 'else' statement only runs if the for loop terminates
-        # normally -- that is, without a break
-        else:
-            platform_map['Unknown'] += 1
-
-    keys.append('Unknown')
+    platform_map = netstats.current().platforms
+    keys = netstats.PLATFORMS + ['Unknown']
 
     num_params = len(keys)
     xs = range(num_params)
     ys = [platform_map[key] for key in keys]
 
-    return draw_bar_graph(xs, ys, keys, params)
+    return draw_bar_graph(xs, ys, keys, params, format)
 
 
-@cache_page(60 * 15)
-def aggregatesummary(request):
+@_network_graph(('png', 'svg'))
+def aggregatesummary(request, format):
     """
     Return a graph representing an aggregate summary of the routers on
     the network as an HttpResponse object.
@@ -336,25 +491,7 @@ def aggregatesummary(request):
     params['TITLE'] = 'Aggregate Summary -- Number of Routers Matching' \
                     + ' Specified Criteria'
 
-    last_va = ActiveRelay.objects.aggregate(
-              last=Max('validafter'))['last']
-
-    relays = ActiveRelay.objects.filter(validafter=last_va)
-
-    total = relays.count()
-    counts = ActiveRelay.objects.filter(validafter=last_va).aggregate(
-             isauthority=CountCase('isauthority', when=True),
-             isbaddirectory=CountCase('isbaddirectory', when=True),
-             isbadexit=CountCase('isbadexit', when=True),
-             isexit=CountCase('isexit', when=True),
-             isfast=CountCase('isfast', when=True),
-             isguard=CountCase('isguard', when=True),
-             ishibernating=CountCase('ishibernating', when=True),
-             isnamed=CountCase('isnamed', when=True),
-             isstable=CountCase('isstable', when=True),
-             isrunning=CountCase('isrunning', when=True),
-             isvalid=CountCase('isvalid', when=True),
-             isv2dir=CountCase('isv2dir', when=True))
+    stats = netstats.current()
 
     keys = ['isauthority', 'isbaddirectory', 'isbadexit', 'isv2dir',
             'isexit', 'isfast', 'isguard', 'ishibernating', 'isnamed',
@@ -366,15 +503,15 @@ def aggregatesummary(request):
     xs = range(num_params)
 
     ys = []
-    ys.append(total)
-    for count in keys:
-        ys.append(counts[count])
+    ys.append(stats.total)
+    for flag in keys:
+        ys.append(stats.flags[flag])
 
-    return draw_bar_graph(xs, ys, labels, params)
+    return draw_bar_graph(xs, ys, labels, params, format)
 
 
-@cache_page(60 * 15)
-def networktotalbw(request):
+@_network_graph(('png',), _total_bandwidth_version)
+def networktotalbw(request, format):
     """
     Return a graph representing the total bandwidth of the Tor network.
 
@@ -382,29 +519,6 @@ def networktotalbw(request):
     @return: A graph representing the total bandwidth of the
         Tor Network.
     """
-    # Graph presentation parameters -----------------------------------
-    HEIGHT = 160
-    WIDTH = 440
-    TOP_MARGIN = 8
-    BOTTOM_MARGIN = 28
-    LEFT_MARGIN = 50
-    RIGHT_MARGIN = 50
-    X_FONT_SIZE = 8
-    Y_FONT_SIZE = 8
-    LABEL_FONT_SIZE = 8
-    LABEL_ROT = 'horizontal'
-    FONT_WEIGHT = 'bold'
-
-    # Set margins according to specification.
-    matplotlib.rcParams['figure.subplot.left'] = \
-            float(LEFT_MARGIN) / WIDTH
-    matplotlib.rcParams['figure.subplot.right'] = \
-            float(WIDTH - RIGHT_MARGIN) / WIDTH
-    matplotlib.rcParams['figure.subplot.top'] = \
-            float(HEIGHT - TOP_MARGIN) / HEIGHT
-    matplotlib.rcParams['figure.subplot.bottom'] = \
-            float(BOTTOM_MARGIN) / HEIGHT
-
     # TotalBandwidth Plot --------------------------------------------
     # Get last 93 TotalBandwidth entries
     tbw_entries = list(TotalBandwidth.objects.all().order_by(
@@ -428,12 +542,70 @@ def networktotalbw(request):
                                   2, to_add_date.day)
         times.append(to_add_str)
 
+    # Relays Plot -----------------------------------------------------
+    net_size = list(NetworkSize.objects.all().order_by('-date')[:93])
+
+    # Assume that the dates in net_size are the same as in tbw_entries,
+    # but assert it, just to be paranoid.
+    assert net_size[0].date == tbw_entries[0].date
+    assert net_size[-1].date == tbw_entries[-1].date
+
+    ys = []
+    for i in range(data_points - 1, -1, -1):
+        ys.append(net_size[i].avg_running)
+
+    return HttpResponse(renderpool.render(_render_network_total, xs,
+                                          ys_bwobserved, times, ys),
+                        content_type='image/png')
+
+
+def _render_network_total(xs, ys_bwobserved, times, ys):
+    """
+    Render the graph of the total bandwidth of the Tor network and of
+    the average number of relays running.
+
+    @type xs: C{list} of C{int}
+    @param xs: The x values to be plotted, one for each day.
+    @type ys_bwobserved: C{list} of C{float}
+    @param ys_bwobserved: The observed bandwidth of the network on
+        each day, in MiB.
+    @type times: C{list} of C{string}
+    @param times: The labels of every seventh day.
+    @type ys: C{list} of C{int}
+    @param ys: The average number of relays running on each day.
+    @rtype: C{string}
+    @return: The graph, as a PNG image.
+    """
+    from matplotlib.backends.backend_agg import \
+            FigureCanvasAgg as FigureCanvas
+    from matplotlib.figure import Figure
+    from matplotlib.font_manager import FontProperties
+    from matplotlib.ticker import MaxNLocator
+
+    # Graph presentation parameters -----------------------------------
+    HEIGHT = 160
+    WIDTH = 440
+    TOP_MARGIN = 8
+    BOTTOM_MARGIN = 28
+    LEFT_MARGIN = 50
+    RIGHT_MARGIN = 50
+    X_FONT_SIZE = 8
+    Y_FONT_SIZE = 8
+    LABEL_FONT_SIZE = 8
+    LABEL_ROT = 'horizontal'
+    FONT_WEIGHT = 'bold'
+
+    data_points = len(xs)
     width_inches = float(WIDTH) / 80
     height_inches = float(HEIGHT) / 80
 
     fig = Figure(facecolor='white', edgecolor='black',
                  figsize=(width_inches, height_inches), frameon=False)
 
+    # Set margins according to specification.
+    _set_margins(fig, WIDTH, HEIGHT, TOP_MARGIN, BOTTOM_MARGIN,
+                 LEFT_MARGIN, RIGHT_MARGIN)
+
     # Draw bandwidth observed line
     ax1 = fig.add_subplot(111)
 
@@ -459,18 +631,6 @@ def networktotalbw(request):
     for tick in ax1.get_yticklabels():
         tick.set_color('#68228B')
 
-    # Relays Plot -----------------------------------------------------
-    net_size = list(NetworkSize.objects.all().order_by('-date')[:93])
-
-    # Assume that the dates in net_size are the same as in tbw_entries,
-    # but assert it, just to be paranoid.
-    assert net_size[0].date == tbw_entries[0].date
-    assert net_size[-1].date == tbw_entries[-1].date
-
-    ys = []
-    for i in range(data_points - 1, -1, -1):
-        ys.append(net_size[i].avg_running)
-
     # Draw average relays running line using same 'xs' as before.
     ax2 = ax1.twinx()
     active_relays = ax2.plot(xs, ys, color='#005500',
@@ -491,8 +651,7 @@ def networktotalbw(request):
         tick.set_color('#005500')
 
     # Label entire graph
-    fontparam = matplotlib.font_manager.FontProperties(
-                size=8, weight='bold')
+    fontparam = FontProperties(size=8, weight='bold')
 
     # TODO: put both labels in one legend. How?
     ax1.legend(prop=fontparam, loc='lower left')
@@ -506,16 +665,19 @@ def networktotalbw(request):
     ax1.yaxis.set_major_locator(MaxNLocator(5))
     ax2.yaxis.set_major_locator(MaxNLocator(5))
     canvas = FigureCanvas(fig)
-    response = HttpResponse(content_type='image/png')
-    canvas.print_png(response, ha="center")
-    return response
+    image = StringIO()
+    canvas.print_png(image, ha="center")
+    return image.getvalue()
 
 
-def draw_bar_graph(xs, ys, labels, params):
+def draw_bar_graph(xs, ys, labels, params, format='png'):
     """
     Draws a bar graph, given data points, labels, and presentation
     parameters.
 
+    PNG images are drawn by matplotlib in the pool of worker processes,
+    while SVG images are written directly from the data points.
+
     @type xs: C{list}
     @param xs: The x values to be plotted.
     @type ys: C{list}
@@ -529,9 +691,31 @@ def draw_bar_graph(xs, ys, labels, params):
         BOTTOM_MARGIN, LEFT_MARGIN, RIGHT_MARGIN, X_FONT_SIZE,
         Y_FONT_SIZE, LABEL_FONT_SIZE, FONT_WEIGHT, BAR_WIDTH,
         COLOR, LABEL_FLOAT, LABEL_ROT, and TITLE.
+    @type format: C{string}
+    @param format: The format of the image, either 'png' or 'svg'.
     @rtype: HttpResponse
     @return: The graph as specified by the parameters given.
     """
+    if format == 'svg':
+        image = svggraphs.bar_graph(xs, ys, labels, params)
+    else:
+        image = renderpool.render(_render_bar_graph, xs, ys, labels,
+                                  params)
+    return HttpResponse(image, content_type=__CONTENT_TYPES[format])
+
+
+def _render_bar_graph(xs, ys, labels, params):
+    """
+    Render a bar graph, as described by L{draw_bar_graph}.
+
+    @rtype: C{string}
+    @return: The graph, as a PNG image.
+    """
+    import matplotlib
+    from matplotlib.backends.backend_agg import \
+            FigureCanvasAgg as FigureCanvas
+    from matplotlib.figure import Figure
+
     ## Get the parameters from the params dictionary
     # Width and height of the graph in pixels
     WIDTH = params['WIDTH']
@@ -556,21 +740,16 @@ def draw_bar_graph(xs, ys, labels, params):
     # Title of graph
     TITLE = params['TITLE']
 
-    # Set margins according to specification.
-    matplotlib.rcParams['figure.subplot.left'] = \
-            float(LEFT_MARGIN) / WIDTH
-    matplotlib.rcParams['figure.subplot.right'] = \
-            float(WIDTH - RIGHT_MARGIN) / WIDTH
-    matplotlib.rcParams['figure.subplot.top'] = \
-            float(HEIGHT - TOP_MARGIN) / HEIGHT
-    matplotlib.rcParams['figure.subplot.bottom'] = \
-            float(BOTTOM_MARGIN) / HEIGHT
-
     # Draw the figure.
     width_inches = float(WIDTH) / 80
     height_inches = float(HEIGHT) / 80
     fig = Figure(facecolor='white', edgecolor='black',
                  figsize=(width_inches, height_inches), frameon=False)
+
+    # Set margins according to specification.
+    _set_margins(fig, WIDTH, HEIGHT, TOP_MARGIN, BOTTOM_MARGIN,
+                 LEFT_MARGIN, RIGHT_MARGIN)
+
     ax = fig.add_subplot(111)
 
     # Plot the data.
@@ -597,12 +776,38 @@ def draw_bar_graph(xs, ys, labels, params):
     ax.set_title(TITLE, fontsize='12', fontweight=FONT_WEIGHT)
 
     canvas = FigureCanvas(fig)
-    response = HttpResponse(content_type='image/png')
-    canvas.print_png(response, ha="center")
-    return response
+    image = StringIO()
+    canvas.print_png(image, ha="center")
+    return image.getvalue()
+
+
+def _set_margins(fig, width, height, top, bottom, left, right):
+    """
+    Set the space around the plots of a figure, without changing the
+    defaults of any other figure.
+
+    @type fig: C{Figure}
+    @param fig: The figure.
+    @type width: C{int}
+    @param width: The width of the figure in pixels.
+    @type height: C{int}
+    @param height: The height of the figure in pixels.
+    @type top: C{int}
+    @param top: The space above the plots in pixels.
+    @type bottom: C{int}
+    @param bottom: The space below the plots in pixels.
+    @type left: C{int}
+    @param left: The space left of the plots in pixels.
+    @type right: C{int}
+    @param right: The space right of the plots in pixels.
+    """
+    fig.subplots_adjust(left=float(left) / width,
+                        right=float(width - right) / width,
+                        top=float(height - top) / height,
+                        bottom=float(bottom) / height)
 
 
-def draw_line_graph(fingerprint, bwtype, color, shade):
+def draw_line_graph(fingerprint, bwtype, color, shade, format='png'):
     """
     Draws a line graph with given data points and display parameters.
 
@@ -617,9 +822,138 @@ def draw_line_graph(fingerprint, bwtype, color, shade):
     @param color: The color to draw the line graph with.
     @type shade: C{string}
     @param shade: The color to shade under the line graph.
+    @type format: C{string}
+    @param format: The format of the image, either 'png' or 'svg'.
     @rtype: HttpResponse
     @return: The graph as specified by the parameters given.
     """
+    return draw_line_graphs(fingerprint, [(bwtype, color, shade)],
+                            format)
+
+
+def draw_line_graphs(fingerprint, graphs, format='png'):
+    """
+    Draws line graphs of the bandwidth history of a router side by
+    side in one image, from a single load of its history.
+
+    Images are kept in L{__LINE_GRAPHS}, keyed by what they show, so
+    that an image is only drawn again once the bandwidth history of
+    the router has changed. PNG images are drawn by matplotlib in the
+    pool of worker processes, while SVG images are written directly
+    from the data points.
+
+    @type fingerprint: C{string}
+    @param fingerprint: The fingerprint of the router that the graphs
+        are to be drawn for.
+    @type graphs: C{list} of C{tuple}
+    @param graphs: The type of bandwidth, either 'Read' or 'Written',
+        the color to draw the line graph with and the color to shade
+        under it, for each graph from left to right.
+    @type format: C{string}
+    @param format: The format of the image, either 'png' or 'svg'.
+    @rtype: HttpResponse
+    @return: The graphs as specified by the parameters given.
+    """
+    history = _load_history(fingerprint)
+    panels = [(bwtype, color, shade) + history[bwtype]
+              for bwtype, color, shade in graphs]
+
+    # The graphs only depend on their data points and how they are
+    # drawn, so graphs with the same ones are the same image.
+    key = repr(panels)
+    cache = __LINE_GRAPHS.get(format)
+    image = None
+    if cache is not None:
+        image = cache.get(key)
+    if image is None:
+        if format == 'svg':
+            image = svggraphs.line_graphs(panels)
+        else:
+            try:
+                image = renderpool.render(_render_line_graphs, panels)
+            except renderpool.RenderTimeout:
+                return _busy()
+        if cache is not None:
+            cache.set(key, image)
+    return HttpResponse(image, content_type=__CONTENT_TYPES[format])
+
+
+def _load_history(fingerprint):
+    """
+    Get the last twenty-four hours of read and written bandwidth
+    history available for a router, fetching the rows of its last two
+    days of history in a single query.
+
+    @type fingerprint: C{string}
+    @param fingerprint: The fingerprint of the router.
+    @rtype: C{dict} of C{string} to C{tuple}
+    @return: Maps 'Read' and 'Written' to the time of the first data
+        point and the 96 data points, the bytes transferred in each
+        fifteen minutes.
+    """
+    last_hists = list(Bwhist.objects.filter(fingerprint=fingerprint)\
+                      .order_by('-date')[:2])
+    last_hist = last_hists[0]
+
+    # The day before is only used if the router has history for it.
+    day_before = last_hist.date - datetime.timedelta(days=1)
+    day_before_hist = None
+    if len(last_hists) > 1 and last_hists[1].date == day_before:
+        day_before_hist = last_hists[1]
+
+    recent_date = last_hist.date
+    recent_time = datetime.datetime.combine(recent_date,
+                  datetime.time())
+
+    history = {}
+    for bwtype, field in (('Read', 'read'), ('Written', 'written')):
+        t_start, t_end, tr_list = getattr(last_hist, field)
+
+        # It's possible that we might be missing some entries at the
+        # beginning; add values of 0 in this case
+        tr_list[0:0] = ([0] * t_start)
+
+        # We want to have 96 data points in our graph; if we don't
+        # have them, get some data points from the day before, if we
+        # can
+        to_fill = 96 - len(tr_list)
+
+        start_time = recent_time - datetime.timedelta(
+                     minutes=(15 * to_fill))
+
+        # If less than 96 entries in the array, get earlier entries.
+        # If they don't exist, fill in the array with '0' values.
+        if to_fill:
+            if day_before_hist is not None:
+                y_start, y_end, y_list = getattr(day_before_hist,
+                                                 field)
+                y_list = ([0] * y_start) + y_list + \
+                         ([0] * (95 - y_end))
+            else:
+                y_list = ([0] * 96)
+            tr_list[0:0] = y_list[(-1 * to_fill):]
+
+        history[bwtype] = (start_time, tr_list)
+    return history
+
+
+def _render_line_graphs(panels):
+    """
+    Render line graphs of bandwidth history side by side, each of the
+    same size and with the same margins as a graph on its own.
+
+    @type panels: C{list} of C{tuple}
+    @param panels: The type of bandwidth, the color to draw the line
+        graph with, the color to shade under it, the time of the first
+        data point and the 96 data points, the bytes transferred in
+        each fifteen minutes, of each graph from left to right.
+    @rtype: C{string}
+    @return: The graphs, as a PNG image.
+    """
+    from matplotlib.backends.backend_agg import \
+            FigureCanvasAgg as FigureCanvas
+    from matplotlib.figure import Figure
+
     # Width and height of the graph in pixels
     WIDTH = 480
     HEIGHT = 320
@@ -628,72 +962,60 @@ def draw_line_graph(fingerprint, bwtype, color, shade):
     BOTTOM_MARGIN = 32
     LEFT_MARGIN = 98
     RIGHT_MARGIN = 5
-    # Font sizes, in pixels
-    X_FONT_SIZE = '8'
-    Y_FONT_SIZE = '8'
-    # Font weight used for labels and titles.
-    FONT_WEIGHT = 'bold'
+
+    # Width of the image in pixels.
+    TOTAL_WIDTH = WIDTH * len(panels)
+
+    width_inches = float(TOTAL_WIDTH) / 80
+    height_inches = float(HEIGHT) / 80
+    fig = Figure(facecolor='white', edgecolor='black',
+                 figsize=(width_inches, height_inches), frameon=False)
 
     # Set margins according to specification.
-    matplotlib.rcParams['figure.subplot.left'] = \
-            float(LEFT_MARGIN) / WIDTH
-    matplotlib.rcParams['figure.subplot.right'] = \
-            float(WIDTH - RIGHT_MARGIN) / WIDTH
-    matplotlib.rcParams['figure.subplot.top'] = \
-            float(HEIGHT - TOP_MARGIN) / HEIGHT
-    matplotlib.rcParams['figure.subplot.bottom'] = \
-            float(BOTTOM_MARGIN) / HEIGHT
-
-    last_hist = Bwhist.objects.filter(fingerprint=fingerprint)\
-                .order_by('-date')[:1][0]
-
-    if bwtype == 'Read':
-        t_start, t_end, tr_list = last_hist.read
-    elif bwtype == 'Written':
-        t_start, t_end, tr_list = last_hist.written
+    _set_margins(fig, TOTAL_WIDTH, HEIGHT, TOP_MARGIN, BOTTOM_MARGIN,
+                 LEFT_MARGIN, RIGHT_MARGIN)
 
-    recent_date = last_hist.date
-    recent_time = datetime.datetime.combine(recent_date,
-                  datetime.time())
+    # Graphs are separated by the margins on either side of a graph,
+    # given as a fraction of the width of a plot.
+    fig.subplots_adjust(wspace=float(LEFT_MARGIN + RIGHT_MARGIN) /
+                        (WIDTH - LEFT_MARGIN - RIGHT_MARGIN))
 
-    # It's possible that we might be missing some entries at the
-    # beginning; add values of 0 in this case
-    tr_list[0:0] = ([0] * t_start)
+    for number, (bwtype, color, shade, start_time, tr_list) in \
+            enumerate(panels):
+        ax = fig.add_subplot(1, len(panels), number + 1)
+        _plot_history(ax, bwtype, color, shade, start_time, tr_list)
 
-    # We want to have 96 data points in our graph; if we don't have
-    # them, get some data points from the day before, if we can
-    to_fill = 96 - len(tr_list)
+    canvas = FigureCanvas(fig)
+    image = StringIO()
+    canvas.print_png(image, ha="center")
+    return image.getvalue()
 
-    start_time = recent_time - datetime.timedelta(
-                 minutes=(15 * to_fill))
-    end_time = start_time + datetime.timedelta(
-               days=1) - datetime.timedelta(minutes=15)
 
-    # If less than 96 entries in the array, get earlier entries.
-    # If they don't exist, fill in the array with '0' values.
-    if to_fill:
-        day_before = last_hist.date - datetime.timedelta(days=1)
-
-        try:
-            day_before_hist = Bwhist.objects.get(
-                    fingerprint=fingerprint,
-                    date=str(day_before))
-            if bwtype == 'Read':
-                y_start, y_end, y_list = day_before_hist.read
-            elif bwtype == 'Written':
-                y_start, y_end, y_list = day_before_hist.written
-            y_list.extend([0] * (95 - y_end))
-            y_list[0:0] = ([0] * y_start)
-
-        except Bwhist.DoesNotExist:
-            y_list = ([0] * 96)
-        tr_list[0:0] = y_list[(-1 * to_fill):]
+def _plot_history(ax, bwtype, color, shade, start_time, tr_list):
+    """
+    Plot a line graph of bandwidth history.
 
-    width_inches = float(WIDTH) / 80
-    height_inches = float(HEIGHT) / 80
-    fig = Figure(facecolor='white', edgecolor='black',
-                 figsize=(width_inches, height_inches), frameon=False)
-    ax = fig.add_subplot(111)
+    @type ax: C{Axes}
+    @param ax: The plot to draw the graph in.
+    @type bwtype: C{string}
+    @param bwtype: Either 'Read' or 'Written'.
+    @type color: C{string}
+    @param color: The color to draw the line graph with.
+    @type shade: C{string}
+    @param shade: The color to shade under the line graph.
+    @type start_time: C{datetime}
+    @param start_time: The time of the first data point.
+    @type tr_list: C{list} of C{int}
+    @param tr_list: The 96 data points.
+    """
+    # Font sizes, in pixels
+    X_FONT_SIZE = '8'
+    Y_FONT_SIZE = '8'
+    # Font weight used for labels and titles.
+    FONT_WEIGHT = 'bold'
+
+    end_time = start_time + datetime.timedelta(
+               days=1) - datetime.timedelta(minutes=15)
 
     # Return bytes per second, not total bandwidth for 15 minutes
     bps = map(lambda x: x / (15 * 60), tr_list)
@@ -732,8 +1054,3 @@ def draw_line_graph(fingerprint, bwtype, color, shade):
             + start_time.strftime("%Y-%m-%d %H:%M") + " to "
             + end_time.strftime("%Y-%m-%d %H:%M"), fontsize='12',
             fontweight=FONT_WEIGHT)
-
-    canvas = FigureCanvas(fig)
-    response = HttpResponse(content_type='image/png')
-    canvas.print_png(response, ha="center")
-    return response
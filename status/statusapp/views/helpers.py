@@ -6,14 +6,22 @@ import datetime
 
 # Django-specific import statements -----------------------------------
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection
 from django.http import HttpRequest, HttpResponse
 
 # TorStatus-specific import statements --------------------------------
-from statusapp.models import Bwhist, Descriptor
+from statusapp.models import ActiveRelay, Bwhist, Descriptor, Hostname
 import config
 
-__SEARCH_SESSION_KEYS = set(('filters', 'search',
-                           'sortOrder', 'sortListing'))
+# The fields that relays can be sorted by.
+__SORT_OPTIONS = frozenset(('nickname', 'fingerprint', 'country',
+                            'bandwidthkbps', 'uptime', 'published',
+                            'hostname', 'address', 'orport',
+                            'dirport', 'contact', 'isauthority',
+                            'isbaddirectory', 'isbadexit', 'isv2dir',
+                            'isexit', 'isfast', 'isguard',
+                            'ishibernating', 'ishsdir', 'isnamed',
+                            'isstable', 'isrunning', 'isvalid'))
 
 
 def button_choice(request, button, field, current_columns,
@@ -33,7 +41,7 @@ def button_choice(request, button, field, current_columns,
         C{'selected_removeColumn'} or C{'selected_addColumn'}.
     @type current_columns: C{list}
     @param current_columns: A list of the columns that will be
-        displayed on this session.
+        displayed.
     @type available_columns: C{list}
     @param available_columns: A list of the columns that can be added
         to the current ones.
@@ -81,10 +89,6 @@ def button_choice(request, button, field, current_columns,
                            current_columns[selection_pos]
             current_columns[selection_pos] = aux
 
-    # Save the changes made in the session
-    request.session['currentColumns'] = current_columns
-    request.session['availableColumns'] = available_columns
-
     return (current_columns, available_columns, selection)
 
 
@@ -298,7 +302,7 @@ def port_match(dest_port, port_line):
 def get_filter_params(request):
     """
     Get the filter preferences provided by the user via the
-    HttpRequest and store them in the session.
+    HttpRequest.
 
     @type request: HttpRequest
     @param request: The HttpRequest provided by the client
@@ -308,7 +312,6 @@ def get_filter_params(request):
     """
     filters = {}
 
-    #if 'filters' not in request.session:
     # Add filters for flags only if the parameter is a 0 or a 1
     for flag in config.FLAGS:
         filt = request.GET.get(flag, '')
@@ -334,83 +337,57 @@ def get_filter_params(request):
                 key = '__'.join((search, criteriainput))
                 filters[key] = searchinput
 
-    # Save these filters in the session
-    if filters:
-        request.session['filters'] = filters
-
     return filters
 
 
-def get_order(request):
+def get_order(request, default=config.DEFAULT_LISTING):
     """
     Get the sorting parameter and order from the user via the
     HttpRequest.
 
-    This function returns 'nickname' if no order is specified or if
+    This function returns C{default} if no order is specified or if
     there is an error parsing the supplied information.
 
     @type request: HttpRequest
     @param request: The HttpRequest provided by the client.
+    @type default: C{string}
+    @param default: The order to return if the client has not
+        specified one.
     @rtype: C{string}
     @return: The sorting parameter and order as specified by the
         HttpRequest object.
     """
+    advanced_order = request.GET.get('sortOrder', '')
+    advanced_listing = request.GET.get('sortListing', '')
 
-    # Options to sort from.
-    options = ['nickname', 'fingerprint', 'country',
-                'bandwidthkbps','uptime','published',
-                'hostname', 'address', 'orport',
-                'dirport', 'contact', 'isauthority',
-                'isbaddirectory', 'isbadexit','isv2dir',
-                'isexit', 'isfast','isguard', 'ishibernating',
-                'ishsdir', 'isnamed', 'isstable', 'isrunning',
-                'isvalid']
-
-    orders = ['ascending', 'descending']
-
-    advanced_order = ''
-    advanced_listing = ''
-
-    # Gets the order and listing from the session then validates
-    # by comparison with specified sort columns
-    if request.GET:
-        advanced_order = request.GET.get('sortOrder', '')
-        advanced_listing = request.GET.get('sortListing', '')
-
-    if advanced_listing in options and advanced_order in orders:
-        request.session['sortOrder'] = advanced_order
-        request.session['sortListing'] = advanced_listing
-
-    # Returns appropriate sort preference
-    if 'sortOrder' in request.session and \
-                    'sortListing' in request.session:
-
-        if request.session['sortOrder'] == 'ascending':
-            return request.session['sortListing']
-        elif request.session['sortOrder'] == 'descending':
-            return '-' + request.session['sortListing']
+    # Validates the order and listing by comparison with specified
+    # sort columns, and returns the appropriate sort preference
+    if advanced_listing in __SORT_OPTIONS:
+        if advanced_order == 'ascending':
+            return advanced_listing
+        elif advanced_order == 'descending':
+            return '-' + advanced_listing
 
     # If none specified returns default ordering.
-    return config.DEFAULT_LISTING
+    return default
 
 
-def search_session_reset(request):
+def is_order(order):
     """
-    Function to clear the search filters parameters and orderings.
+    Check whether relays can be sorted in an order.
 
-    @type request: C{HttpRequest}
-    @param request: The request provided by the client
-    @rtype: C{HttpResponse}
-    @returns: The C{request} supplied with any references to
-        search filters in the session deleted.
+    @type order: C{string}
+    @param order: The sorting parameter, prefixed with a '-' for
+        descending order, as returned by L{get_order}.
+    @rtype: C{bool}
+    @return: True if relays can be sorted in the order, False
+        otherwise.
     """
-
-    # Loop goes through and erases them.
-    for key in __SEARCH_SESSION_KEYS:
-        if key in request.session:
-            del request.session[key]
-
-    return request
+    if not isinstance(order, basestring):
+        return False
+    if order.startswith('-'):
+        order = order[1:]
+    return order in __SORT_OPTIONS
 
 
 def gen_list_dict(active_relays):
@@ -436,7 +413,8 @@ def gen_list_dict(active_relays):
                           'bandwidthkbps': str(relay.bandwidthkbps) + " KB/s",
                           'uptime': str(relay.uptimedays) + " d",
                           'address': relay.address,
-                          #'hostname': relay.hostname,
+                          'hostname': relay.hostname or
+                                      relay.address,
                           'hibernating': 1 if relay.ishibernating else 0,
                           'orport': relay.orport,
                           'dirport': relay.dirport,
@@ -458,6 +436,57 @@ def gen_list_dict(active_relays):
     return list_dict
 
 
+def stream_relays(validafter, chunk_size):
+    """
+    Generate all of the relays in a consensus, ordered by nickname, in
+    chunks read from a server-side cursor.
+
+    Only one chunk of relays is held in memory at a time. Since django
+    closes its database connection as soon as a view returns, and
+    before a streamed response is consumed, the connection used by the
+    cursor is closed again once the relays have been generated.
+
+    @type validafter: C{datetime}
+    @param validafter: The valid-after time of the consensus.
+    @type chunk_size: C{int}
+    @param chunk_size: The number of relays to generate at a time.
+    @rtype: C{generator} of C{list} of L{ActiveRelay}
+    @return: Lists of at most C{chunk_size} relays, in order, each
+        with the C{hostname} of its IP address from the L{Hostname}
+        table, or C{None}.
+    """
+    quote_name = connection.ops.quote_name
+    fields = ActiveRelay._meta.fields
+    query = ('SELECT %s, h.%s FROM %s AS r LEFT JOIN %s AS h '
+             'ON r.%s = h.%s WHERE r.%s = %%s ORDER BY r.%s' % (
+             ', '.join(['r.' + quote_name(field.column)
+                        for field in fields]),
+             quote_name('hostname'),
+             quote_name(ActiveRelay._meta.db_table),
+             quote_name(Hostname._meta.db_table),
+             quote_name('address'), quote_name('address'),
+             quote_name('validafter'), quote_name('nickname')))
+
+    # Make sure that django has opened a connection, then declare a
+    # named (server-side) cursor on it.
+    connection.cursor()
+    cursor = connection.connection.cursor('stream_relays')
+    try:
+        cursor.execute(query, (validafter,))
+        rows = cursor.fetchmany(chunk_size)
+        while rows:
+            relays = []
+            for row in rows:
+                relay = ActiveRelay(*row[:-1])
+                relay.hostname = row[-1]
+                relays.append(relay)
+            yield relays
+            rows = cursor.fetchmany(chunk_size)
+    finally:
+        cursor.close()
+        connection.close()
+
+
 def gen_relay_dict(relay):
     """
     Method that generates a dictionary of all the fields of a relay.
@@ -503,16 +532,14 @@ def gen_relay_dict(relay):
                   'HS Directory': relay.ishsdir,
                  }
 
-    # Hibernating and adjusted uptime are only available if the
-    # relay has a descriptor
+    # Hibernating is only available if the relay has a descriptor. The
+    # adjusted uptime is filled in by the details page itself.
     if relay.hasdescriptor:
         relay_dict['Hibernating'] = 1 if relay.ishibernating else 0
-        relay_dict['Adjusted Uptime'] = relay.adjuptime
 
     # Default values
     else:
         relay_dict['Hibernating'] = 0
-        relay_dict['Adjusted Uptime'] = None
 
     return relay_dict
 
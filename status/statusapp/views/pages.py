@@ -4,21 +4,46 @@ The pages module for TorStatus.
 This module contains a single controller for each page type.
 """
 # General python import statements ------------------------------------
-import subprocess
 import datetime
-from socket import getfqdn
 
 # Django-specific import statements -----------------------------------
 from django.shortcuts import render_to_response, redirect
 from django.http import HttpResponse, HttpRequest
-from django.db.models import Q, Max, Count
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from django.views.decorators.cache import cache_page
-from django.core.paginator import Paginator, InvalidPage, EmptyPage
 
 # TorStatus specific import statements --------------------------------
-from statusapp.models import ActiveRelay
+from statusapp.models import ActiveRelay, Hostname
+from statusapp import consensus, exitpolicies, hostnames, snapshot, \
+        whoisclient
+from statusapp.lrucache import LRUCache
+from statusapp.templatetags.details_filters import words
 import config
 import helpers
+import pagination
+import relaytable
+import viewstate
+
+# INIT Variables ------------------------------------------------------
+# The number of relays the full index renders at a time.
+__FULL_INDEX_CHUNK_SIZE = 500
+
+# Stands in for the rows of the relay table on the full index page.
+__FULL_INDEX_ROWS_MARKER = u'<!-- relay rows -->'
+
+# The rendered details pages of relays, keyed by fingerprint and the
+# token of the version of the ActiveRelay cache, and the number of
+# bytes of pages that are kept.
+__DETAILS_PAGES_SIZE = 16 * 1024 * 1024
+__DETAILS_PAGES = LRUCache(__DETAILS_PAGES_SIZE)
+
+# Stands in for the adjusted uptime of a relay on its details page.
+__ADJUSTED_UPTIME_MARKER = '<!-- adjusted uptime -->'
+
+# The number of seconds the WHOIS page waits for an address to be
+# looked up.
+__WHOIS_WAIT = 10
 
 
 def splash(request):
@@ -31,6 +56,7 @@ def splash(request):
     return render_to_response("splash.html")
 
 
+@consensus.conditional
 def index(request):
     """
     Supply a dictionary to the index.html template consisting of a list
@@ -45,19 +71,14 @@ def index(request):
         network itself.
     """
 
-    # See if the user wants to reset search and display preferences
-    reset = request.GET.get('reset', '')
-    if reset == 'True':
-        helpers.search_session_reset(request)
+    # Get the search and display choices carried in the URL, updated
+    # with any basic search from the splash page, advanced search from
+    # the advanced search page, order, or reset the user has just
+    # given. Nothing is kept on the server, so the page only depends
+    # on its URL.
+    state = viewstate.from_request(request)
 
-    # Get all relays in last consensus
-    last_validafter = ActiveRelay.objects.aggregate(
-                      last=Max('validafter'))['last']
-    active_relays = ActiveRelay.objects.filter(
-                    validafter=last_validafter).order_by('nickname')
-
-    # Get the order specified by session.request
-    order = helpers.get_order(request)
+    order = state.order
     if order.startswith('-'):
         ascending_or_descending = 'ascending'
         order_param = order[1:]
@@ -65,113 +86,42 @@ def index(request):
         ascending_or_descending = 'descending'
         order_param = order
 
-    # See if the user has defined a "basic search", i.e. if the
-    # user has supplied a search term on the splash page
-    basic_input = request.GET.get('search', '')
-
-    # See also if the user has defined an "advanced search", i.e., if
-    # the user has supplied a search term on the advanced search page
-    advanced_input = helpers.get_filter_params(request)
-
-    # If the user defines both basic search parameters as well as
-    # advanced search parameters via a GET, use only the advanced
-    # search parameters
-    if basic_input and advanced_input:
-        basic_input = ''
-
-    # If the user has just defined a "basic search", save the
-    # search parameter in the session and delete the advanced
-    # search filters
-    if basic_input:
-        request.session['search'] = basic_input
-        if 'filters' in request.session:
-            del request.session['filters']
-
-    # Otherwise, if the user has just defined an "advanced search",
-    # save the advanced search parameters in the session and delete
-    # the basic search parameter
-    elif advanced_input:
-        advanced_input = helpers.get_filter_params(request)
-        if 'search' in request.session:
-            del request.session['search']
-
-    # If neither a basic search nor an advanced search was just
-    # defined, get the search information from the session
-    else:
-        basic_input = request.session.get('search', '')
-        advanced_input = request.session.get('filters', {})
-
-    # We should never have both basic_input AND advanced_input
-    # defined at this point.
-    assert not (basic_input and advanced_input)
-
-    # If basic search input has been supplied, search the beginnings
-    # of all fingerprints, nicknames, and IPs in the last consensus
-    # and return any matches
-    if basic_input:
-        active_relays = active_relays.filter(
-                        Q(nickname__istartswith=basic_input) | \
-                        Q(fingerprint__istartswith=basic_input) | \
-                        Q(address__istartswith=basic_input)).\
-                        order_by(order)
-
-    # Otherwise, an advanced search may have been defined, so filter
-    # all relays by the parameters given
-    else:
-        active_relays = active_relays.filter(
-                        **advanced_input).order_by(order)
+    # Search the relays in the last consensus, either the beginnings
+    # of all fingerprints, nicknames, and IPs for the basic search
+    # input, or by the parameters of the advanced search. Result sets
+    # are remembered per consensus, so a client paging through the
+    # same search is only searched for once.
+    active_relays = snapshot.results(state.search, state.filters,
+                                     order)
 
     num_results = active_relays.count()
 
     # If the search returns only one relay, go to the details page for
     # that relay.
-    if active_relays.count() == 1:
+    if num_results == 1:
         url = ''.join(('/details/', active_relays[0].fingerprint))
         return redirect(url)
 
+    # Paginate results by seeking to the page the client asked for.
     # TODO: Eventually give client the option to view all relays
     # on one page. The page needs to load faster before this
     # is possible.
-    all_relays = request.session.get('all', 0)
-
-    # If the user doesn't want to see all of the relays, then paginate
-    # results.
-    if not all_relays:
-        # Make sure entries per page is an integer. If not, or
-        # if no value is specified, make entries per page 50.
-        per_page = request.session.get('perpage', 50)
-        paginator = Paginator(active_relays, per_page)
-
-        # Make sure page request is an int. If not, deliver first page.
-        try:
-            page = int(request.GET.get('page', 1))
-        except ValueError:
-            page = 1
-
-        # If page request is out of range, deliver last
-        # page of results.
-        try:
-            paged_relays = paginator.page(page)
-        except (EmptyPage, InvalidPage):
-            paged_relays = paginator.page(paginator.num_pages)
-    # Display all relays on one page by making the page size as large
-    # as the current result set
-    else:
-        paginator = Paginator(active_relays, num_results)
-        paged_relays = paginator.page(1)
+    paged_relays = pagination.paginate(active_relays, state.per_page,
+                                       request.GET)
 
     # Convert the list of relays to a dictionary object
     paged_relays.object_list = helpers.gen_list_dict(
                                paged_relays.object_list)
 
-    # Get the current columns from the session. If no current columns
-    # are defined, just use the config.DEFAULT_COLUMNS
-    current_columns = request.session.get(
-                      'currentColumns', config.DEFAULT_COLUMNS)
-    request.session['currentColumns'] = current_columns
+    current_columns = state.columns
 
+    # Render the rows of the relay table with a renderer compiled for
+    # the current columns
+    relay_rows = relaytable.render_rows(paged_relays.object_list,
+                                        current_columns)
 
     template_values = {'paged_relays': paged_relays,
+                       'relay_rows': relay_rows,
                        'current_columns': current_columns,
                        'displayable_columns': config.DISPLAYABLE_COLUMNS,
                        'not_columns': config.NOT_MOVABLE_COLUMNS,
@@ -182,32 +132,30 @@ def index(request):
                        'ascending_or_descending':
                                 ascending_or_descending,
                        'order_param': order_param,
+                       'state': viewstate.encode(state),
                        'all': False}
 
     return render_to_response('index.html', template_values)
 
 
-# We can't cache the page too often, since we'd like to provide recent
-# information about the relays in the Tor network, but we can't cache
-# the page too infrequently, either. It'd be nice to have a cache
-# that updates itself without being requested.
-@cache_page(60 * 10)
+@consensus.conditional
 def full_index(request):
     """
     Display all columns and routers available.
 
+    The page is streamed to the client: the top of the page is sent
+    at once, the rows of the relay table follow as they are read from
+    the database, and only one chunk of relays is held in memory at a
+    time.
+
     @rtype: C{HttpResponse}
     @return: The full, unpaged list of all columns and relays.
     """
     # For now, clients don't have a choice for current columns
-    # and filters, since the index page loads slowly.
-    last_validafter = ActiveRelay.objects.aggregate(
-                      last=Max('validafter'))['last']
-    active_relays = ActiveRelay.objects.filter(
-                    validafter=last_validafter).order_by(
-                    'nickname')
-
-    num_results = active_relays.count()
+    # and filters, since the page lists every relay.
+    last_validafter = consensus.last_validafter()
+    has_relays = ActiveRelay.objects.filter(
+                 validafter=last_validafter).exists()
 
     columns = ['Country Code', 'Router Name', 'Fingerprint',
                'Bandwidth', 'Uptime', 'IP', 'Icons', 'ORPort',
@@ -216,57 +164,143 @@ def full_index(request):
                'Contact', 'Last Descriptor Published', 'Bad Directory',
                'Bad Exit']
 
-    paginator = Paginator(active_relays, num_results)
-    paged_relays = paginator.page(1)
-    paged_relays.object_list = helpers.gen_list_dict(
-                               paged_relays.object_list)
+    # The rows are rendered in place of a marker that splits the page
+    # into the parts before and after the relay table's rows.
+    relay_rows = ''
+    if has_relays:
+        relay_rows = mark_safe(__FULL_INDEX_ROWS_MARKER)
 
-    template_values = {'paged_relays': paged_relays,
+    template_values = {'relay_rows': relay_rows,
                        'current_columns': columns,
                        'displayable_columns': config.DISPLAYABLE_COLUMNS,
                        'not_columns': config.NOT_MOVABLE_COLUMNS,
                        'request': request,
                        'column_value_name': config.COLUMN_VALUE_NAME,
                        'icons_list': config.ICONS,
-                       'number_of_results': num_results,
                        'all': True}
 
-    return render_to_response('index.html', template_values)
+    page = render_to_string('index.html', template_values)
+    if not has_relays:
+        return HttpResponse(page)
+
+    head, tail = page.split(__FULL_INDEX_ROWS_MARKER, 1)
+    return HttpResponse(_stream_full_index(head, tail, last_validafter,
+                                           columns))
 
 
+def _stream_full_index(head, tail, validafter, columns):
+    """
+    Generate the full index page, one chunk of relay rows at a time.
+
+    @type head: C{unicode}
+    @param head: The page up to the rows of the relay table.
+    @type tail: C{unicode}
+    @param tail: The page after the rows of the relay table.
+    @type validafter: C{datetime}
+    @param validafter: The valid-after time of the last consensus.
+    @type columns: C{list} of C{string}
+    @param columns: The columns of the relay table.
+    @rtype: C{generator} of C{unicode}
+    @return: The parts of the full index page, in order.
+    """
+    yield head
+    relay_chunks = helpers.stream_relays(validafter,
+                                         __FULL_INDEX_CHUNK_SIZE)
+    try:
+        relay_dicts = (helpers.gen_list_dict(relays)
+                       for relays in relay_chunks)
+        for rows in relaytable.stream_rows(relay_dicts, columns):
+            yield rows
+    finally:
+        # Release the cursor even if the client goes away mid-page.
+        relay_chunks.close()
+    yield tail
+
+
+@consensus.conditional
 def details(request, fingerprint):
     """
     Supply the L{ActiveRelay} information associated with a
     relay with a given fingerprint to the details.html template.
 
+    Pages are cached per relay and version of the ActiveRelay cache,
+    and only the adjusted uptime of the relay is filled in on every
+    request.
+
     @type fingerprint: C{string}
     @param fingerprint: The fingerprint of the router to display the
         details of.
     @rtype: C{HttpResponse}
     @return: The L{ActiveRelay} information of the router.
     """
+    key = (fingerprint, consensus.token())
+    page = __DETAILS_PAGES.get(key)
+    if page is None:
+        page = _render_details(fingerprint)
+        if page is None:
+            # If no such relay exists, display a 404 page with an
+            # informative debugging message.
+            return render_to_response(
+                    '404.html',
+                    {'debug_message': ('The server could not find ' +
+                                       'any recently active relay ' +
+                                       'with a fingerprint of ' +
+                                       fingerprint + '.')})
+        # A page without the hostname of the relay is not kept, so
+        # that the hostname is looked up again.
+        if page[2]:
+            __DETAILS_PAGES.set(key, page, len(page[0]))
+
+    content, uptime_since, resolved = page
+
+    # If the relay has a descriptor and the relay is active, calculate
+    # the adjusted uptime. Clients revalidate the page per consensus,
+    # so the uptime they see may be up to a consensus old.
+    if uptime_since is not None:
+        uptime, published = uptime_since
+        now = datetime.datetime.utcnow()
+        diff = now - published
+        diff_sec = (diff.microseconds + (
+                    diff.seconds + diff.days * 24 * 3600) * 10**6) \
+                    / 10**6
+        content = content.replace(__ADJUSTED_UPTIME_MARKER,
+                                  words(uptime + diff_sec))
+    response = HttpResponse(content)
+
+    # A page without the hostname of the relay must not be revalidated
+    # for the rest of the consensus, so it is given an ETag of its own.
+    if not resolved:
+        response['ETag'] = '"%s-unresolved"' % consensus.token()
+    return response
+
+
+def _render_details(fingerprint):
+    """
+    Render the details page of a relay, with a marker in place of its
+    adjusted uptime.
+
+    @type fingerprint: C{string}
+    @param fingerprint: The fingerprint of the router to display the
+        details of.
+    @rtype: C{tuple}
+    @return: The page, the uptime and the publication time of the
+        descriptor of the relay if it has an adjusted uptime or else
+        C{None}, and whether the hostname of the relay was known, or
+        C{None} if there is no such relay.
+    """
     # We'll let the client look up a relay as long as it is in the
     # ActiveRelay cache; it need not be in the last consensus
     poss_relay = ActiveRelay.objects.filter(
                  fingerprint=fingerprint).order_by('-validafter')[:1]
-
-    # If no such relay exists, display a 404 page with an informative
-    # debugging message.
     if not poss_relay:
-        return render_to_response(
-                '404.html',
-                {'debug_message': ('The server could not find any ' +
-                                   'recently active relay with a ' +
-                                   'fingerprint of ' + fingerprint +
-                                   '.')})
+        return None
 
     # Otherwise, at least one entry for the relay exists, so get the
     # most recent entry for this relay
     relay = poss_relay[0]
 
     # Create an attribute, 'active', to flag active/unactive relays
-    last_va = ActiveRelay.objects.aggregate(
-              last=Max('validafter'))['last']
+    last_va = consensus.last_validafter()
 
     # A relay is "active" if it is in the last consensus
     if last_va != relay.validafter:
@@ -281,24 +315,24 @@ def details(request, fingerprint):
     else:
         relay.hasdescriptor = False
 
-    # If the relay has a descriptor and the relay is active, calculate
-    # the adjusted uptime
     if relay.hasdescriptor and relay.active:
-        published = relay.published
-        now = datetime.datetime.utcnow()
-        diff = now - published
-        diff_sec = (diff.microseconds + (
-                    diff.seconds + diff.days * 24 * 3600) * 10**6) \
-                    / 10**6
-        relay.adjuptime = relay.uptime + diff_sec
-
-    # TODO: eventually, we'll want to find a way to add a hostname
-    # attribute into the database instead of calculating it each time
-    # the details page is requested. It might be of interest on the
-    # index page as well.
-    # NOTE: getfqdn returns the IP address itself if no hostname is
-    # available, so there is no need to catch errors or null objects.
-    relay.hostname = getfqdn(str(relay.address))
+        uptime_since = (relay.uptime, relay.published)
+    else:
+        uptime_since = None
+
+    # Hostnames are resolved in bulk into the Hostname table. An
+    # address that is not in the table yet is resolved in the
+    # background, and the IP address itself is given until the
+    # hostname is known, just as getfqdn does when no hostname is
+    # available.
+    try:
+        relay.hostname = Hostname.objects.get(
+                         address=relay.address).hostname or \
+                         relay.address
+        resolved = True
+    except Hostname.DoesNotExist:
+        relay.hostname = hostnames.hostname(relay.address)
+        resolved = hostnames.is_resolved(relay.address)
 
     # Generate a dictionary mapping labels to
     # values in a router details table
@@ -315,16 +349,17 @@ def details(request, fingerprint):
                        'relay_dict': relay_dict,
                        'options_list': options_list,
                        'flags_list': flags_list,
+                       'adjusted_uptime':
+                            mark_safe(__ADJUSTED_UPTIME_MARKER),
                        }
-    return render_to_response('details.html', template_values)
+    content = render_to_string('details.html', template_values)
+    return (content.encode('utf-8'), uptime_since, resolved)
 
 
 def whois(request, address):
     """
     Get WHOIS information for a given IP address.
 
-    @see: U{http://docs.python.org/library/subprocess.html}
-
     @type address: C{string}
     @param address: The IP address to gather WHOIS information for.
     @rtype: C{HttpResponse}
@@ -332,12 +367,12 @@ def whois(request, address):
     """
     # Make sure that the given IP address is in fact an IP address
     if helpers.is_ipaddress(address):
-        # NOTE: Linux/Unix specific command; would break on windows.
-        # TODO: Find a replacement for this command.
-        proc = subprocess.Popen(["whois %s" % address],
-                                  stdout=subprocess.PIPE,
-                                  shell=True)
-        whois = proc.communicate()[0]
+        # WHOIS servers are queried by a small pool of threads, and
+        # each address is only looked up once at a time.
+        whois = whoisclient.lookup(address, __WHOIS_WAIT)
+        if whois is None:
+            whois = ('WHOIS information for this address is not ' +
+                     'available yet. Please try again in a moment.')
 
     # If the given IP address is not a valid IP address, the whois
     # information cannot be looked up. Supply helpful debugging
@@ -353,7 +388,8 @@ def exitnodequery(request):
     """
     Determine if an IP address is an active Tor server, and optionally
     see if the server's exit policy would permit it to exit to a given
-    destination IP address and port.
+    destination IP address and port. If only a destination is given,
+    find every relay that would exit to it, grouped by country.
 
     This method aims to provide meaningful information to the client in
     the case of unparsable input by returning both the information
@@ -401,34 +437,41 @@ def exitnodequery(request):
     router_nickname = ""
     exit_possible = False
     relays = []
-    if (source_valid):
-
-        # Search only entries in the last consensus.
-        last_va = ActiveRelay.objects.aggregate(
-                  last=Max('validafter'))['last']
-
-        fingerprints = ActiveRelay.objects.filter(
-                       address=source, validafter=last_va).values(
-                       'fingerprint').annotate(
-                       Count('fingerprint'))
-
-        # Grouped by fingerprints, which are unique. If at least one
-        # fingerprint is found, there is a match, so for each
-        # fingerprint, get the fingerprint and nickname.
-        if (fingerprints):
+    exits = []
+    exit_count = 0
+    if (not source and dest_ip_valid and dest_port_valid):
+
+        # Check every relay in the last consensus against the
+        # destination at once.
+        policies = exitpolicies.current()
+        positions = policies.exits_to(snapshot.address_value(dest_ip),
+                                      int(dest_port))
+        exits = _exits_by_country(policies.snapshot, positions)
+        exit_count = len(positions)
+
+    elif (source_valid):
+
+        # Search only relays in the last consensus, in which each
+        # fingerprint appears at most once. Relays are indexed by
+        # their address, and their exit policies are compiled, once
+        # per consensus.
+        policies = exitpolicies.current()
+        source_relays = policies.snapshot.at_address(
+                        snapshot.address_value(source))
+        if (dest_ip_valid and dest_port_valid):
+            dest_address = snapshot.address_value(dest_ip)
+            dest_port_number = int(dest_port)
+
+        # If at least one relay is found, there is a match, so for each
+        # relay, get the fingerprint and nickname.
+        if (source_relays):
             is_router = True
 
-            # For each entry, gather the nickname and fingerprint. If a
+            # For each relay, gather the nickname and fingerprint. If a
             # destination IP and port are defined, also find whether or
-            # not the entries will allow exiting to the given
+            # not the relays will allow exiting to the given
             # IP and port.
-            for fp_entry in fingerprints:
-                # Note that the trailing [:1] is djangonese for
-                # "LIMIT 1", so this query should not be expensive.
-                relay = ActiveRelay.objects.filter(
-                        fingerprint=fp_entry['fingerprint']).order_by(
-                        '-validafter')[:1][0]
-
+            for relay in source_relays:
                 nickname = relay.nickname
                 fingerprint = relay.fingerprint
                 exit_possible = False
@@ -436,28 +479,9 @@ def exitnodequery(request):
                 # If the client also wants to test the relay's exit
                 # policy, dest_ip and dest_port cannot be empty strings
                 if (dest_ip_valid and dest_port_valid):
-
-                    # Search the exit policy information for a case in
-                    # which the given IP is in a subnet defined in the
-                    # exit policy information of a relay.
-                    for policy_line in relay.exitpolicy:
-                        condition, network_line = (policy_line.strip())\
-                                                   .split(' ')
-                        subnet, port_line = network_line.split(':')
-
-                        # When the IP is in the given subnet, check to
-                        # ensure that the given destination port is also
-                        # in the port defined in the exit policy
-                        # information. When a match is found, see if the
-                        # condition is "accept" or "reject".
-                        if (helpers.is_ip_in_subnet(dest_ip, subnet)):
-                            if (helpers.port_match(
-                                        dest_port, port_line)):
-                                if (condition == 'accept'):
-                                    exit_possible = True
-                                else:
-                                    exit_possible = False
-                                break
+                    exit_possible = policies.allows(relay.index,
+                                                    dest_address,
+                                                    dest_port_number)
 
                 # Render a 'relays' list to response consisting only of
                 # the relays' nickname, fingerprint, and whether or not
@@ -466,6 +490,8 @@ def exitnodequery(request):
 
     template_values = {'is_router': is_router,
                        'relays': relays,
+                       'exits': exits,
+                       'exit_count': exit_count,
                        'dest_ip': dest_ip,
                        'dest_port': dest_port,
                        'source': source,
@@ -475,6 +501,47 @@ def exitnodequery(request):
     return render_to_response('nodequery.html', template_values)
 
 
+def _exits_by_country(relays, positions):
+    """
+    Group relays by country, with the countries that have the most
+    bandwidth first and the relays with the most bandwidth first
+    within each country.
+
+    @type relays: L{snapshot.Snapshot}
+    @param relays: The snapshot that the relays are in.
+    @type positions: C{list} of C{int}
+    @param positions: The positions of the relays in the snapshot.
+    @rtype: C{list} of C{tuple}
+    @return: The country code, the number of relays, their total
+        bandwidth in KB/s, and their nicknames, fingerprints and
+        bandwidths, of each country. Relays without a known country
+        or bandwidth are grouped under C{None}, and counted as having
+        no bandwidth, respectively.
+    """
+    nicknames = relays.columns['nickname']
+    fingerprints = relays.columns['fingerprint']
+    countries = relays.columns['country']
+    bandwidths = relays.columns['bandwidthkbps']
+
+    by_country = {}
+    for position in positions:
+        bandwidth = max(bandwidths[position], 0)
+        by_country.setdefault(countries[position], []).append(
+                (bandwidth, nicknames[position],
+                 fingerprints[position]))
+
+    groups = []
+    for country, members in by_country.items():
+        members.sort(key=lambda member: (-member[0], member[1]))
+        groups.append((country, len(members),
+                       sum([member[0] for member in members]),
+                       [(nickname, fingerprint, bandwidth)
+                        for bandwidth, nickname, fingerprint
+                        in members]))
+    groups.sort(key=lambda group: (-group[2], group[0]))
+    return groups
+
+
 @cache_page(60 * 30)
 def netstatgraphs(request):
     """
@@ -491,11 +558,11 @@ def display_options(request):
     Let the user choose what columns should be displayed on the index
     page.
 
-    This view makes use of the sessions in order to store two
-    array-listobjects (currentColumns and availableColumns) in a
-    "cookie" file so that the implementation of the "REMOVE", "ADD",
-    "UP" and "DOWN" options from the page could be possible. It orders
-    the two array-lists by using the user input, through a GET single
+    The current and available columns and the number of relays per
+    page are carried in the C{state} parameter, as on the index page,
+    so that the implementation of the "REMOVE", "ADD", "UP" and "DOWN"
+    options from the page could be possible. It orders the two
+    array-lists by using the user input, through a GET single
     selection HTML form.
 
     @rtype: C{HttpResponse}
@@ -504,8 +571,10 @@ def display_options(request):
     """
     debug_message = ''
 
+    state = viewstate.decode(request.GET.get('state', ''))
+
     # If the user has specified a number of relays per page, save the
-    # input in the session.
+    # input in the state.
     if 'pp' in request.GET:
 
         # Ensure that the supplied information is an integer between 1
@@ -513,7 +582,7 @@ def display_options(request):
         try:
             supplied_pp = int(request.GET.get('pp', ''))
             assert 1 <= supplied_pp <= config.MAX_PP
-            request.session['perpage'] = supplied_pp
+            state.per_page = supplied_pp
 
         # Display a helpful debug_message in the case of unusable input
         except (ValueError, AssertionError):
@@ -522,33 +591,17 @@ def display_options(request):
                              ' integer between 1 and ' +
                              str(config.MAX_PP) + ', inclusive.')
 
-    # Get the number of relays per page from the session, and if it
-    # doesn't exist, make it 50 by default.
-    current_pp = int(request.session.get('perpage', 50))
-
-    current_columns = []
-    available_columns = []
+    current_pp = state.per_page
 
-    # If the user wants to reset column preferences, remove all
-    # column information from the session
+    # If the user wants to reset column preferences, go back to the
+    # default columns
     if ('resetPreferences' in request.GET):
-        if 'currentColumns' in request.session:
-            del request.session['currentColumns']
-        if 'availableColumns' in request.session:
-            del request.session['availableColumns']
-    # If no currentColumns and availableColumns are defined,
-    # save the defanults in the session
-    if not ('currentColumns' in request.session and 'availableColumns'
-            in request.session):
-        request.session['currentColumns'] = config.DEFAULT_COLUMNS
-        request.session['availableColumns'] = config.AVAILABLE_COLUMNS
-
-    # Now there is guaranteed to be currentColumns and availableColumns
-    # information in the session, so get it
+        state.columns = list(config.DEFAULT_COLUMNS)
+
     # Current columns
-    curr = request.session['currentColumns']
+    curr = state.columns
     # Available columns
-    avail = request.session['availableColumns']
+    avail = viewstate.available_columns(state)
     # Selected column/entry
     sel = ''
 
@@ -582,11 +635,14 @@ def display_options(request):
         curr, avail, sel = helpers.button_choice(request, 'down',
                            'selected_removeColumn', curr, avail)
 
+    state.columns = curr
+
     template_values = {'currentColumns': curr,
                        'availableColumns': avail,
                        'selectedEntry': sel,
                        'current_pp': current_pp,
-                       'debug_message': debug_message}
+                       'debug_message': debug_message,
+                       'state': viewstate.encode(state)}
 
     return render_to_response('displayoptions.html', template_values)
 
@@ -611,6 +667,8 @@ def advanced_search(request):
             'searchOptionsBooleans': config.SEARCH_OPTIONS_BOOLEANS,
             'filterOptionsOrder': config.FILTER_OPTIONS_ORDER,
             'filterOptions': config.FILTER_OPTIONS,
+            'state': viewstate.encode(viewstate.decode(
+                     request.GET.get('state', ''))),
                       }
 
     return render_to_response('advanced_search.html', template_values)
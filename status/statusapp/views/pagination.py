@@ -0,0 +1,213 @@
+"""
+Keyset pagination of the relays on the index page.
+
+A page is found by seeking to a cursor, the sort key of the relay just
+before or after it, rather than by counting relays from the start of
+the result set. Cursors name the relay they were taken from by its
+value in the sorted column and its fingerprint, so the pages before
+and after a page stay the same even if the relays on it change.
+"""
+# General python import statements ------------------------------------
+import datetime
+
+# Django-specific import statements -----------------------------------
+from django.db import models
+
+# TorStatus specific import statements --------------------------------
+from statusapp.models import ActiveRelay
+
+# INIT Variables ------------------------------------------------------
+# The format of datetime values in cursors.
+__DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class KeysetPage(object):
+    """
+    A page of relays, with the cursors of the pages around it.
+
+    Pages have the attributes of a django C{Page} that the index
+    template uses, plus the cursors that link to the previous and
+    next pages.
+
+    @type object_list: C{list} of L{SnapshotRelay}
+    @ivar object_list: The relays on the page.
+    @type number: C{int}
+    @ivar number: The number of the page, counting from 1.
+    @type num_pages: C{int}
+    @ivar num_pages: The number of pages in the result set.
+    @type previous_cursor: C{unicode}
+    @ivar previous_cursor: The cursor of the page before this one, to
+        be given as the C{before} parameter.
+    @type next_cursor: C{unicode}
+    @ivar next_cursor: The cursor of the page after this one, to be
+        given as the C{after} parameter.
+    """
+
+    def __init__(self, relays, start, per_page):
+        """
+        @type relays: L{RelaySet}
+        @param relays: The ordered result set.
+        @type start: C{int}
+        @param start: The position of the first relay on the page.
+        @type per_page: C{int}
+        @param per_page: The number of relays on each page.
+        """
+        count = len(relays)
+        end = min(start + per_page, count)
+        self.object_list = relays[start:end]
+
+        # A page that starts part of the way into a page of the result
+        # set, since relays have come or gone, is numbered as though
+        # there was a full page before it.
+        self.number = (start + per_page - 1) // per_page + 1
+        self.num_pages = self.number + \
+                (count - end + per_page - 1) // per_page
+        self.previous_page_number = self.number - 1
+        self.next_page_number = self.number + 1
+
+        self.previous_cursor = None
+        self.next_cursor = None
+        if self.object_list:
+            self.previous_cursor = encode_cursor(relays,
+                                                 self.object_list[0])
+            self.next_cursor = encode_cursor(relays,
+                                             self.object_list[-1])
+
+    def has_previous(self):
+        return self.number > 1
+
+    def has_next(self):
+        return self.number < self.num_pages
+
+
+def paginate(relays, per_page, query):
+    """
+    Get the page of relays that a client has asked for.
+
+    Clients ask for the page after a cursor with the C{after}
+    parameter, for the page before a cursor with the C{before}
+    parameter, or for a page by its number with the C{page} parameter.
+    Cursors that cannot be read are ignored, and page numbers that are
+    out of range give the last page, as with django's C{Paginator}.
+
+    @type relays: L{RelaySet}
+    @param relays: The ordered result set.
+    @type per_page: C{int}
+    @param per_page: The number of relays on each page.
+    @type query: C{QueryDict}
+    @param query: The GET parameters supplied by the client.
+    @rtype: L{KeysetPage}
+    @return: The page of relays.
+    """
+    count = len(relays)
+    last_start = max(0, (count - 1) // per_page * per_page)
+
+    after = decode_cursor(relays, query.get('after', ''))
+    before = decode_cursor(relays, query.get('before', ''))
+    if after is not None:
+        # If no relays are left after the cursor, show the last ones.
+        start = relays.seek(after, True)
+        if start >= count:
+            start = max(0, count - per_page)
+    elif before is not None:
+        start = max(0, relays.seek(before, False) - per_page)
+    else:
+        try:
+            page = int(query.get('page', 1))
+        except ValueError:
+            page = 1
+        start = (page - 1) * per_page
+        if page < 1 or start > last_start:
+            start = last_start
+
+    return KeysetPage(relays, start, per_page)
+
+
+def encode_cursor(relays, relay):
+    """
+    Encode the sort key of a relay as a cursor.
+
+    @type relays: L{RelaySet}
+    @param relays: The ordered result set that the relay is in.
+    @type relay: L{SnapshotRelay}
+    @param relay: The relay.
+    @rtype: C{unicode}
+    @return: The cursor, consisting of the order of the result set,
+        the fingerprint of the relay, and its value in the sorted
+        column prefixed with a character giving the type of the value.
+    """
+    is_null, value, fingerprint = relays.sort_key(relay)
+    if value is None:
+        encoded = u'n'
+    elif isinstance(value, bool):
+        encoded = u'b%d' % value
+    elif isinstance(value, (int, long)):
+        encoded = u'i%d' % value
+    elif isinstance(value, datetime.datetime):
+        encoded = u'd' + value.strftime(__DATETIME_FORMAT)
+    else:
+        encoded = u's' + value
+    return u':'.join((relays.order or u'', fingerprint, encoded))
+
+
+def decode_cursor(relays, cursor):
+    """
+    Decode a cursor into a sort key of a result set.
+
+    @type relays: L{RelaySet}
+    @param relays: The ordered result set.
+    @type cursor: C{unicode}
+    @param cursor: The cursor, as given by L{encode_cursor}.
+    @rtype: C{tuple}
+    @return: The sort key, or C{None} if the cursor is malformed, was
+        taken from a result set in a different order, or has a value
+        of a different type than the sorted column.
+    """
+    parts = cursor.split(u':', 2)
+    if len(parts) != 3 or parts[0] != (relays.order or u''):
+        return None
+    order, fingerprint, encoded = parts
+
+    kind, text = encoded[:1], encoded[1:]
+    if kind != u'n' and kind != _column_kind(relays):
+        return None
+    try:
+        if kind == u'n':
+            value = None
+        elif kind == u'b':
+            value = bool(int(text))
+        elif kind == u'i':
+            value = int(text)
+        elif kind == u'd':
+            value = datetime.datetime.strptime(text, __DATETIME_FORMAT)
+        elif kind == u's':
+            value = text
+        else:
+            return None
+    except ValueError:
+        return None
+    return (value is None, value, fingerprint)
+
+
+def _column_kind(relays):
+    """
+    Get the character that gives the type of the values in the sorted
+    column of a result set, as in a cursor.
+
+    @type relays: L{RelaySet}
+    @param relays: The ordered result set.
+    @rtype: C{unicode}
+    @return: The character, as given by L{encode_cursor} for a value
+        that is not NULL.
+    """
+    name = (relays.order or u'fingerprint').lstrip(u'-')
+    snapshot = relays.snapshot
+    if name in snapshot.flag_bits:
+        return u'b'
+    elif name in snapshot.int_columns:
+        return u'i'
+    for field in ActiveRelay._meta.fields:
+        if field.name == name and \
+                isinstance(field, models.DateTimeField):
+            return u'd'
+    return u's'
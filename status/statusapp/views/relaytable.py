@@ -0,0 +1,342 @@
+"""
+Compiled rendering of the relay table on the index page.
+
+Deciding how each cell of the relay table is displayed only depends on
+the columns the client has chosen, not on the relay itself, so the
+column layout is compiled once into a list of cell functions and each
+relay dictionary from L{helpers.gen_list_dict} is then simply run
+through them. The HTML produced is exactly what the row loop in
+index.html used to produce inside of its C{{% spaceless %}} block.
+"""
+# Python-specific import statements -----------------------------------
+import datetime
+import decimal
+
+# Django-specific import statements -----------------------------------
+from django.conf import settings
+from django.utils import dateformat, numberformat
+from django.utils.encoding import force_unicode
+from django.utils.formats import get_format
+from django.utils.safestring import mark_safe
+
+# TorStatus specific import statements --------------------------------
+from statusapp.lrucache import LRUCache
+from statusapp.templatetags.index_filters import get_os, nospace
+import config
+
+# INIT Variables ------------------------------------------------------
+# Compiled row renderers, keyed by a tuple of the current columns. The
+# columns are chosen by the client, so only the renderers of the most
+# recently used layouts are kept.
+__MAX_RENDERERS = 64
+__RENDERERS = LRUCache(__MAX_RENDERERS)
+
+# The template used to leave this whitespace between the value of a
+# plain column and its closing tag; spaceless does not remove it, since
+# it does not lie between two tags.
+__VALUE_CELL_END = u'\n            \n            </td>'
+
+
+def _compile_text():
+    """
+    Compile a function that converts a value to escaped unicode,
+    exactly as a C{{{ variable }}} would be rendered in an autoescaped
+    template.
+
+    Looking up the format of the current locale is by far the most
+    expensive part of rendering a value, so the formats are looked up
+    once and the rendered values are remembered. The function returned
+    should therefore only be used for the duration of a single request.
+
+    @rtype: C{function}
+    @return: A function mapping a value to its localized, escaped
+        unicode representation.
+    """
+    use_l10n = settings.USE_L10N
+    if use_l10n:
+        decimal_separator = get_format('DECIMAL_SEPARATOR')
+        number_grouping = get_format('NUMBER_GROUPING')
+        thousand_separator = get_format('THOUSAND_SEPARATOR')
+        datetime_format = get_format('DATETIME_FORMAT')
+        date_format = get_format('DATE_FORMAT')
+        time_format = get_format('TIME_FORMAT')
+    rendered = {}
+
+    def text(value):
+        if not isinstance(value, unicode):
+            # Keyed on the string of the value rather than the value
+            # itself, since hashing a Decimal is slow and booleans
+            # compare equal to integers but render differently.
+            key = (type(value), str(value))
+            if key in rendered:
+                return rendered[key]
+
+            # The same formatting as django.utils.formats.localize
+            if use_l10n:
+                if isinstance(value, (decimal.Decimal, float, int)):
+                    value = numberformat.format(value,
+                            decimal_separator, None, number_grouping,
+                            thousand_separator)
+                elif isinstance(value, datetime.datetime):
+                    value = dateformat.format(value, datetime_format)
+                elif isinstance(value, datetime.date):
+                    value = dateformat.format(value, date_format)
+                elif isinstance(value, datetime.time):
+                    value = dateformat.time_format(value, time_format)
+            value = force_unicode(value)
+        else:
+            key = None
+
+        value = value.replace('&', '&amp;').replace('<', '&lt;').replace(
+                '>', '&gt;').replace('"', '&quot;').replace("'", '&#39;')
+        if key is not None:
+            rendered[key] = value
+        return value
+
+    return text
+
+
+def _country_cell(relay, text):
+    """
+    Render the flag of the country of a relay, linked to a map.
+    """
+    country = relay['country']
+    latitude = relay['latitude']
+    longitude = relay['longitude']
+    return (u'<td id="col_relayName"><a href="http://www.openstreetmap'
+            u'.org/?mlon=%s&mlat=%s&zoom=6"><img src="/static/img/'
+            u'flags/%s.png" alt=%s title="%s: %s, %s" border=0></a>'
+            u'</td>' % (text(longitude), text(latitude),
+                        text(force_unicode(country or u'zz').lower()),
+                        text(country or u'?'), text(country or u'?'),
+                        text(latitude or u'?'), text(longitude or u'?')))
+
+
+def _router_cell(relay, text):
+    """
+    Render the nickname of a relay as a link to its details page.
+    """
+    return (u'<td id="col_relayName"><a class="linkDetails" '
+            u'href="/details/%s" target="_BLANK">%s</a></td>' % (
+            text(relay['fingerprint']), text(relay['nickname'])))
+
+
+def _named_router_cell(relay, text):
+    """
+    Render the nickname of a relay as a link to its details page,
+    in bold if the relay is named.
+    """
+    if relay['isnamed'] == 1:
+        return (u'<td id="col_relayName"><b><a class="linkDetails" '
+                u'href="/details/%s" target="_BLANK">%s</a></b></td>' % (
+                text(relay['fingerprint']), text(relay['nickname'])))
+    return _router_cell(relay, text)
+
+
+def _address_cell(relay, text):
+    """
+    Render the IP address of a relay as a link to its WHOIS page.
+    """
+    address = text(relay['address'])
+    return (u'<td>[<a id="relayAddress" href="/details/%s/whois">%s'
+            u'</a>]</td>' % (address, address))
+
+
+def _bad_directory_cell(relay, text):
+    """
+    Render whether or not a relay is a bad directory.
+    """
+    if relay['isbaddirectory']:
+        return (u'<td id="col_relayBadDir" ><img src="/static/img/'
+                u'bg_yes.png" width="12" height="12" alt="Bad Directory"'
+                u' title="Bad Directory"></td>')
+    return (u'<td id="col_relayBadDir" ><img src="/static/img/'
+            u'bg_no.png" width="12" height="12" alt="Not a Bad '
+            u'Directory" title="Not a Bad Directory"></td>')
+
+
+def _bad_exit_cell(relay, text):
+    """
+    Render whether or not a relay is a bad exit.
+    """
+    # The template never closed this cell, so neither do we.
+    if relay['isbadexit'] == 1:
+        return (u'<td id="col_relayBadExit"><img src="/static/img/'
+                u'bg_yes.png" width="12" height="12" alt="Bad Exit" '
+                u'title="Bad Exit">')
+    return (u'<td id="col_relayBadExit"><img src="/static/img/'
+            u'bg_no.png" width="12" height="12" alt="Not a Bad Exit" '
+            u'title="Not a Bad Exit">')
+
+
+def _closing_cell(relay, text):
+    """
+    Render a column that has no cell of its own, such as a flag that
+    is only displayed as an icon.
+    """
+    return u'</td>'
+
+
+def _compile_icons_cell(current_columns):
+    """
+    Compile the cell that displays an icon for each flag and the
+    platform of a relay.
+
+    @type current_columns: C{tuple} of C{string}
+    @param current_columns: The columns that the client has chosen.
+    @rtype: C{function}
+    @return: A function mapping a relay dictionary to the icons cell.
+    """
+    # Decide, once, which icons are to be displayed and how.
+    icons = []
+    for icon in config.ICONS:
+        if icon in current_columns:
+            icons.append((icon, config.FILTERED_NAME[icon],
+                          u'<img src="/static/img/status/%s.png" '
+                          u'alt="%s" title="%s">' % (icon, icon, icon)))
+
+    def icons_cell(relay, text):
+        parts = [u'<td id="col_relayIcons">']
+        for icon, field, image in icons:
+            value = relay[field]
+            if icon == 'Platform':
+                os_name = text(get_os(value))
+                parts.append(u'<img src="/static/img/os-icons/%s.png" '
+                             u'alt="%s" title="%s">' % (os_name,
+                             os_name, text(value or
+                             u'Platform Not Available')))
+            elif value == 1:
+                parts.append(image)
+        parts.append(u'</td>')
+        return u''.join(parts)
+
+    return icons_cell
+
+
+def _compile_value_cell(column_name):
+    """
+    Compile the cell that displays the plain value of a column.
+
+    @type column_name: C{string}
+    @param column_name: The title of a displayable column.
+    @rtype: C{function}
+    @return: A function mapping a relay dictionary to the cell.
+    """
+    field = config.FILTERED_NAME[column_name]
+    start = u'<td id="col_relay%s">' % nospace(column_name)
+
+    def value_cell(relay, text):
+        return u''.join((start, text(relay[field] or u'None'),
+                         __VALUE_CELL_END))
+
+    return value_cell
+
+
+def _compile_cell(column_name, current_columns):
+    """
+    Compile the cell of a single column of the relay table.
+
+    @type column_name: C{string}
+    @param column_name: The title of the column.
+    @type current_columns: C{tuple} of C{string}
+    @param current_columns: The columns that the client has chosen.
+    @rtype: C{function}
+    @return: A function mapping a relay dictionary to the cell.
+    """
+    if column_name == 'Country Code':
+        return _country_cell
+    elif column_name == 'Router Name':
+        if 'Named' in current_columns:
+            return _named_router_cell
+        return _router_cell
+    elif column_name == 'IP':
+        return _address_cell
+    elif column_name == 'Bad Directory':
+        return _bad_directory_cell
+    elif column_name == 'Bad Exit':
+        return _bad_exit_cell
+    elif column_name == 'Icons':
+        return _compile_icons_cell(current_columns)
+    elif column_name in config.DISPLAYABLE_COLUMNS:
+        return _compile_value_cell(column_name)
+    return _closing_cell
+
+
+def compile_row_renderer(current_columns):
+    """
+    Compile a column layout into a function that renders a single row
+    of the relay table.
+
+    Renderers are cached per column layout, so each of the layouts
+    in use is only compiled once per process.
+
+    @type current_columns: C{list} of C{string}
+    @param current_columns: The columns that the client has chosen.
+    @rtype: C{function}
+    @return: A function mapping a relay dictionary, as generated by
+        L{helpers.gen_list_dict}, and a function returned by
+        L{_compile_text} to the HTML of the row of the relay.
+    """
+    current_columns = tuple(current_columns)
+    render_row = __RENDERERS.get(current_columns)
+    if render_row is not None:
+        return render_row
+
+    cells = [_compile_cell(column_name, current_columns)
+             for column_name in current_columns]
+    shows_bad_exit = 'Bad Exit' in current_columns
+
+    def render_row(relay, text):
+        if not shows_bad_exit:
+            parts = [u'<tr class="relay">']
+        elif relay['isbadexit']:
+            parts = [u'<tr  class="relayBadExit" >']
+        elif relay['hibernating']:
+            parts = [u'<tr  class="relayHibernating" >']
+        else:
+            parts = [u'<tr  class="relay" >']
+        for cell in cells:
+            parts.append(cell(relay, text))
+        parts.append(u'</tr>')
+        return u''.join(parts)
+
+    __RENDERERS.set(current_columns, render_row)
+    return render_row
+
+
+def render_rows(relays, current_columns):
+    """
+    Render the rows of the relay table for a list of relays.
+
+    @type relays: C{list} of C{dict}
+    @param relays: The relay dictionaries, as generated by
+        L{helpers.gen_list_dict}.
+    @type current_columns: C{list} of C{string}
+    @param current_columns: The columns that the client has chosen.
+    @rtype: C{SafeUnicode}
+    @return: The HTML of all of the rows, safe to be inserted into
+        a template.
+    """
+    render_row = compile_row_renderer(current_columns)
+    text = _compile_text()
+    return mark_safe(u''.join([render_row(relay, text)
+                               for relay in relays]))
+
+
+def stream_rows(relay_chunks, current_columns):
+    """
+    Render the rows of the relay table for chunks of relays, one chunk
+    at a time.
+
+    @type relay_chunks: C{iterable} of C{list} of C{dict}
+    @param relay_chunks: Lists of relay dictionaries, as generated by
+        L{helpers.gen_list_dict}.
+    @type current_columns: C{list} of C{string}
+    @param current_columns: The columns that the client has chosen.
+    @rtype: C{generator} of C{unicode}
+    @return: The HTML of the rows of each chunk of relays.
+    """
+    render_row = compile_row_renderer(current_columns)
+    text = _compile_text()
+    for relays in relay_chunks:
+        yield u''.join([render_row(relay, text) for relay in relays])
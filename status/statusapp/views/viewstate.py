@@ -0,0 +1,256 @@
+"""
+Search and display state carried in URLs.
+
+The search, sort order, columns and number of relays per page that a
+client has chosen used to be kept in its session, which was written to
+disk on almost every request and made every index page depend on a
+cookie. They are now carried from page to page in a compact, signed
+C{state} parameter instead, so that every page only depends on its URL.
+
+A state token is the URL-safe base64 encoding of a JSON object holding
+only the choices that differ from the defaults, followed by a '.' and
+an HMAC of the encoding, keyed with the C{SECRET_KEY} setting. The
+default state is the empty token.
+"""
+# General python import statements ------------------------------------
+import base64
+import hashlib
+import hmac
+
+# Django-specific import statements -----------------------------------
+from django.conf import settings
+from django.utils import simplejson
+
+# TorStatus specific import statements --------------------------------
+import config
+import helpers
+
+# INIT Variables ------------------------------------------------------
+# Every column a client can choose, in the order that columns which
+# are not displayed are listed in. Columns are held in tokens by their
+# position in this list.
+__ALL_COLUMNS = config.AVAILABLE_COLUMNS + config.DEFAULT_COLUMNS
+
+# The number of relays per page unless the client chooses otherwise.
+__DEFAULT_PER_PAGE = 50
+
+# The number of hexadecimal digits of the HMAC kept in a token.
+__SIGNATURE_LENGTH = 16
+
+
+class ViewState(object):
+    """
+    The search and display choices of a client.
+
+    @type search: C{unicode}
+    @ivar search: The basic search term, or an empty string.
+    @type filters: C{dict}
+    @ivar filters: The advanced search lookups, as given by
+        L{helpers.get_filter_params}.
+    @type order: C{string}
+    @ivar order: The order of the relays, as given by
+        L{helpers.get_order}.
+    @type columns: C{list} of C{string}
+    @ivar columns: The titles of the columns to display, in order.
+    @type per_page: C{int}
+    @ivar per_page: The number of relays on each page.
+    """
+
+    def __init__(self, search, filters, order, columns, per_page):
+        self.search = search
+        self.filters = filters
+        self.order = order
+        self.columns = columns
+        self.per_page = per_page
+
+
+def default():
+    """
+    Get the choices of a client that has not made any.
+
+    @rtype: L{ViewState}
+    @return: The default search and display choices.
+    """
+    return ViewState(u'', {}, config.DEFAULT_LISTING,
+                     list(config.DEFAULT_COLUMNS), __DEFAULT_PER_PAGE)
+
+
+def available_columns(state):
+    """
+    Get the columns that a client can add to those it displays.
+
+    @type state: L{ViewState}
+    @param state: The choices of the client.
+    @rtype: C{list} of C{string}
+    @return: The titles of the columns that are not displayed.
+    """
+    return [column for column in __ALL_COLUMNS
+            if column not in state.columns]
+
+
+def encode(state):
+    """
+    Encode the choices of a client as a token.
+
+    @type state: L{ViewState}
+    @param state: The choices of the client.
+    @rtype: C{string}
+    @return: The token, which is safe to be put in a URL as it is, or
+        an empty string if all of the choices are the defaults.
+    """
+    data = {}
+    if state.search:
+        data['s'] = state.search
+    if state.filters:
+        data['f'] = state.filters
+    if state.order != config.DEFAULT_LISTING:
+        data['o'] = state.order
+    if state.columns != config.DEFAULT_COLUMNS:
+        data['c'] = [__ALL_COLUMNS.index(column)
+                     for column in state.columns]
+    if state.per_page != __DEFAULT_PER_PAGE:
+        data['p'] = state.per_page
+    if not data:
+        return ''
+
+    payload = base64.urlsafe_b64encode(simplejson.dumps(data,
+              separators=(',', ':'), sort_keys=True)).rstrip('=')
+    return '.'.join((payload, _sign(payload)))
+
+
+def decode(token):
+    """
+    Decode the choices of a client from a token.
+
+    @type token: C{string}
+    @param token: The token, as given by L{encode}.
+    @rtype: L{ViewState}
+    @return: The choices held in the token, or the default choices if
+        the token is empty, malformed, or has been tampered with.
+    """
+    state = default()
+    try:
+        payload, dot, signature = str(token).partition('.')
+    except UnicodeError:
+        return state
+    if not payload or not _equal(signature, _sign(payload)):
+        return state
+
+    try:
+        data = simplejson.loads(base64.urlsafe_b64decode(
+               payload + '=' * (-len(payload) % 4)))
+        search = data.get('s', state.search)
+        filters = data.get('f', state.filters)
+        order = data.get('o', state.order)
+        positions = data.get('c', None)
+        per_page = int(data.get('p', state.per_page))
+    except (TypeError, ValueError, AttributeError):
+        return state
+
+    # Tokens are signed, but are still checked, since a token signed
+    # with a different list of columns or criteria may be out of date.
+    if not isinstance(search, basestring) or \
+            not isinstance(filters, dict) or \
+            not all([_is_filter(key, value)
+                     for key, value in filters.items()]) or \
+            not helpers.is_order(order) or \
+            not 1 <= per_page <= config.MAX_PP:
+        return state
+    if positions is not None:
+        if not isinstance(positions, list) or \
+                len(set(positions)) != len(positions) or \
+                not all([isinstance(position, int) and
+                         0 <= position < len(__ALL_COLUMNS)
+                         for position in positions]):
+            return state
+        state.columns = [__ALL_COLUMNS[position]
+                         for position in positions]
+
+    state.search = search
+    state.filters = dict([(str(key), value)
+                          for key, value in filters.items()])
+    state.order = str(order)
+    state.per_page = per_page
+    return state
+
+
+def from_request(request):
+    """
+    Get the choices of a client from the C{state} parameter of a
+    request, updated with any search, filters or order that the client
+    has just given.
+
+    A basic search replaces any advanced search and the other way
+    around. If both are given, only the advanced search is
+    used. Resetting the search with C{reset=True} also resets the
+    order, but keeps the columns and the number of relays per page.
+
+    @type request: C{HttpRequest}
+    @param request: The request supplied by the client.
+    @rtype: L{ViewState}
+    @return: The choices of the client.
+    """
+    state = decode(request.GET.get('state', ''))
+
+    if request.GET.get('reset', '') == 'True':
+        state.search = u''
+        state.filters = {}
+        state.order = config.DEFAULT_LISTING
+
+    basic_input = request.GET.get('search', '')
+    advanced_input = helpers.get_filter_params(request)
+    if advanced_input:
+        state.search = u''
+        state.filters = advanced_input
+    elif basic_input:
+        state.search = basic_input
+        state.filters = {}
+
+    state.order = helpers.get_order(request, state.order)
+    return state
+
+
+def _sign(payload):
+    """
+    Sign the payload of a token.
+
+    @type payload: C{string}
+    @param payload: The encoded choices of a client.
+    @rtype: C{string}
+    @return: The signature of the payload.
+    """
+    key = hashlib.sha1('statusapp.views.viewstate' +
+                       settings.SECRET_KEY).digest()
+    return hmac.new(key, payload, hashlib.sha1).hexdigest()[
+           :__SIGNATURE_LENGTH]
+
+
+def _equal(first, second):
+    """
+    Compare two signatures in time that does not depend on where they
+    first differ.
+
+    @rtype: C{bool}
+    @return: C{True} if the signatures are equal, C{False} otherwise.
+    """
+    if len(first) != len(second):
+        return False
+    difference = 0
+    for first_char, second_char in zip(first, second):
+        difference |= ord(first_char) ^ ord(second_char)
+    return difference == 0
+
+
+def _is_filter(key, value):
+    """
+    Check that an advanced search lookup could have been given by
+    L{helpers.get_filter_params}.
+
+    @rtype: C{bool}
+    @return: C{True} if the lookup is valid, C{False} otherwise.
+    """
+    if key in config.FLAGS:
+        return value in (0, 1)
+    name, separator, criteria = key.partition('__')
+    return (name in config.SEARCHES and criteria in config.CRITERIA
+            and isinstance(value, basestring))
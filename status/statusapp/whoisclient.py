@@ -0,0 +1,232 @@
+"""
+A cache of WHOIS information about IP addresses, filled by a small
+pool of background threads.
+
+The WHOIS page used to run the C{whois} command in a shell for every
+request and wait for it to finish, so a burst of requests started a
+burst of processes. Instead, WHOIS servers are now queried directly
+over TCP by at most L{__LOOKERS} threads at a time. Requests for an
+address that is already being looked up wait for that lookup rather
+than starting another one, and answers are remembered for L{__TTL}
+seconds. A failed lookup keeps any earlier answer, and is tried again
+after L{__ERROR_TTL} seconds.
+
+Addresses are first looked up at the server in the C{WHOIS_SERVER}
+setting, by default the IANA's, which refers them to the server of the
+registry that the address belongs to.
+"""
+# General python import statements ------------------------------------
+import Queue
+import socket
+import threading
+import time
+
+# Django-specific import statements -----------------------------------
+from django.conf import settings
+
+# INIT Variables ------------------------------------------------------
+# The WHOIS server that addresses are first looked up at, and the port
+# that WHOIS servers listen on.
+__SERVER = getattr(settings, 'WHOIS_SERVER', 'whois.iana.org')
+__PORT = 43
+
+# The number of seconds for which WHOIS information is remembered.
+__TTL = 24 * 60 * 60
+
+# The number of seconds for which a failed lookup is remembered.
+__ERROR_TTL = 5 * 60
+
+# The number of seconds that connecting to or reading from a WHOIS
+# server may take, and that a whole lookup may take.
+__TIMEOUT = 10
+__LOOKUP_TIMEOUT = 30
+
+# The largest number of bytes that is read from a WHOIS server.
+__MAX_RESPONSE = 64 * 1024
+
+# The number of threads looking up WHOIS information.
+__LOOKERS = 4
+
+# The number of addresses that are remembered, and that may wait to be
+# looked up, at a time.
+__MAX_ENTRIES = 1000
+__MAX_PENDING = 100
+
+# Maps addresses to their WHOIS information, or None if no lookup has
+# succeeded, and the time at which the entry expires.
+__CACHE = {}
+
+# Addresses waiting to be looked up, in a queue, and mapped to an event
+# that is set once the lookup has finished.
+__QUEUE = Queue.Queue(__MAX_PENDING)
+__PENDING = {}
+
+# Whether the lookup threads have been started.
+__STARTED = False
+
+# Held while the cache, the pending addresses or the lookup threads
+# are changed.
+__LOCK = threading.Lock()
+
+
+def lookup(address, wait):
+    """
+    Get the WHOIS information of an IP address, waiting a limited
+    time for it to be looked up.
+
+    @type address: C{string}
+    @param address: The IP address.
+    @type wait: C{int}
+    @param wait: The number of seconds to wait for the lookup.
+    @rtype: C{unicode}
+    @return: The WHOIS information of the address, or C{None} if it
+        could not be looked up, or has not been looked up yet.
+    """
+    global __STARTED
+
+    entry = __CACHE.get(address)
+    if entry is not None and entry[1] > time.time():
+        return entry[0]
+
+    __LOCK.acquire()
+    try:
+        if not __STARTED:
+            for number in range(__LOOKERS):
+                looker = threading.Thread(target=_look_up_queued)
+                looker.setDaemon(True)
+                looker.start()
+            __STARTED = True
+        finished = __PENDING.get(address)
+        if finished is None:
+            try:
+                __QUEUE.put_nowait(address)
+                finished = __PENDING[address] = threading.Event()
+            except Queue.Full:
+                # The address will be queued again when it is next
+                # asked for.
+                pass
+    finally:
+        __LOCK.release()
+
+    if finished is not None:
+        finished.wait(wait)
+
+    # Stale information is still better than none while it is looked
+    # up again.
+    entry = __CACHE.get(address, entry)
+    if entry is not None:
+        return entry[0]
+    return None
+
+
+def query(address, server, port=__PORT):
+    """
+    Query WHOIS servers about an IP address, following a referral
+    from the first server to another, if it gives one.
+
+    @type address: C{string}
+    @param address: The IP address.
+    @type server: C{string}
+    @param server: The host name or address of the first server.
+    @type port: C{int}
+    @param port: The port of the first server.
+    @rtype: C{unicode}
+    @return: The answer of the last server queried.
+    @raise socket.error: If a server could not be queried in time.
+    """
+    deadline = time.time() + __LOOKUP_TIMEOUT
+    answer = _query_server(address, server, port, deadline)
+    referral = _referral(answer)
+    if referral is not None and referral != server:
+        answer = _query_server(address, referral, __PORT,
+                               deadline)
+    return answer.decode('utf-8', 'replace')
+
+
+def _look_up_queued():
+    """
+    Look up queued addresses, forever.
+    """
+    while True:
+        address = __QUEUE.get()
+        try:
+            information = query(address, __SERVER)
+            expires = time.time() + __TTL
+        except Exception:
+            # Answers that cannot be read are failures too, and must
+            # not stop the thread.
+            information = None
+            expires = time.time() + __ERROR_TTL
+
+        __LOCK.acquire()
+        try:
+            try:
+                if information is None:
+                    # Stale information is still better than none
+                    # until the address is looked up again.
+                    information = __CACHE.get(address, (None,))[0]
+                if len(__CACHE) >= __MAX_ENTRIES:
+                    now = time.time()
+                    for cached in __CACHE.keys():
+                        if __CACHE[cached][1] <= now:
+                            del __CACHE[cached]
+                    if len(__CACHE) >= __MAX_ENTRIES:
+                        __CACHE.clear()
+                __CACHE[address] = (information, expires)
+            finally:
+                __PENDING.pop(address).set()
+        finally:
+            __LOCK.release()
+
+
+def _query_server(address, server, port, deadline):
+    """
+    Query a single WHOIS server about an IP address.
+
+    @type address: C{string}
+    @param address: The IP address.
+    @type server: C{string}
+    @param server: The host name or address of the server.
+    @type port: C{int}
+    @param port: The port of the server.
+    @type deadline: C{float}
+    @param deadline: The time by which the answer must have been read.
+    @rtype: C{string}
+    @return: The answer of the server, of at most L{__MAX_RESPONSE}
+        bytes.
+    @raise socket.error: If the server could not be queried in time.
+    """
+    connection = socket.create_connection((server, port), __TIMEOUT)
+    try:
+        connection.settimeout(__TIMEOUT)
+        connection.sendall('%s\r\n' % address)
+        chunks = []
+        received = 0
+        while received < __MAX_RESPONSE:
+            if time.time() > deadline:
+                raise socket.timeout('WHOIS lookup took too long')
+            chunk = connection.recv(4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            received += len(chunk)
+        return ''.join(chunks)[:__MAX_RESPONSE]
+    finally:
+        connection.close()
+
+
+def _referral(answer):
+    """
+    Find the WHOIS server that an answer refers to, as the IANA's
+    server does with a 'refer:' line.
+
+    @type answer: C{string}
+    @param answer: The answer of a WHOIS server.
+    @rtype: C{string}
+    @return: The host name of the server referred to, or C{None}.
+    """
+    for line in answer.splitlines():
+        name, colon, value = line.partition(':')
+        if colon and name.strip().lower() == 'refer' and value.strip():
+            return value.strip()
+    return None